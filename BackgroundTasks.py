@@ -0,0 +1,191 @@
+import concurrent.futures
+import queue
+import sys
+import threading
+import traceback
+
+class TaskCancelled(Exception):
+	"""Raised within a task's job once the task has been cancelled."""
+
+class Task:
+
+	"""
+		Task tracks one job run by a TaskRunner.  The job is called in a worker
+		thread with its Task as the first argument, and uses it to report
+		progress and to notice when it has been cancelled.
+
+		Cancellation is cooperative: cancel() only sets a flag, and the job
+		stops at its next call to progress() or checkCancelled(), which raise
+		TaskCancelled.  A task cancelled before it starts never runs.
+
+		Public parameters:
+			name - a name for the task, for messages
+			finished - whether the task is done, failed or was cancelled
+
+		Public Functions:
+			Task.progress(done, total, message) - report progress, from the job
+			Task.checkCancelled() - raise TaskCancelled if the task was cancelled
+			Task.cancel() - ask the task to stop
+			Task.cancelled() - return whether cancel() has been called
+		"""
+
+	def __init__(self, runner, name, onDone, onError, onProgress, onCancelled):
+		self.name = name
+		self.finished = False
+		self._runner = runner
+		self._cancelEvent = threading.Event()
+		self._onDone = onDone
+		self._onError = onError
+		self._onProgress = onProgress
+		self._onCancelled = onCancelled
+
+	def progress(self, done, total=None, message=""):
+		"""Report how much of the job is done, raising TaskCancelled if the
+			task has been cancelled."""
+		self.checkCancelled()
+		self._runner._messages.put(("progress", self, (done, total, message)))
+
+	def checkCancelled(self):
+		"""Raise TaskCancelled if the task has been cancelled."""
+		if self._cancelEvent.is_set():
+			raise TaskCancelled(self.name)
+
+	def cancel(self):
+		"""Ask the task to stop at its next progress report."""
+		self._cancelEvent.set()
+
+	def cancelled(self):
+		"""Return whether the task has been asked to stop."""
+		return self._cancelEvent.is_set()
+
+class TaskRunner:
+
+	"""
+		TaskRunner runs long jobs in a pool of worker threads, so the Tk main
+		loop is free to keep the GUI responsive.
+
+		Jobs never touch the GUI.  Their progress, results and errors are put on
+		a thread-safe queue, which is polled from the Tk main loop with
+		widget.after while any task is unfinished, and the task's callbacks are
+		called from there.  Only the latest progress report of each task is
+		passed on per poll.
+
+		Worker threads suit the jobs run here: hashing, compression and numpy
+		release the GIL, and the Tester and Trainer run their own process pools.
+
+		Public parameters:
+			widget - the Tk widget whose after() schedules polling
+
+		Public Functions:
+			TaskRunner.submit(job, *args, ...) - run job(task, *args) in a
+				worker thread, returning its Task
+			TaskRunner.pending() - return the unfinished Tasks
+			TaskRunner.cancelAll() - cancel every unfinished Task
+			TaskRunner.shutdown() - cancel everything and stop the workers
+		"""
+
+	def __init__(self, widget, workers=1, pollInterval=100):
+		self.widget = widget
+		self.pollInterval = pollInterval
+		self._executor = concurrent.futures.ThreadPoolExecutor(workers)
+		self._messages = queue.Queue()
+		self._tasks = list()
+		self._polling = False
+
+	def submit(self, job, *args, name="", onDone=None, onError=None,
+			onProgress=None, onCancelled=None):
+		"""Run job(task, *args) in a worker thread, and return the Task.
+
+			Call this from the Tk main loop.  Each callback is called from the
+			Tk main loop too:
+				onDone(result) - when job returns
+				onError(exception) - when job raises, by default printing the
+					traceback
+				onProgress(done, total, message) - when the job reports progress
+				onCancelled() - when the job stops after being cancelled
+			"""
+		task = Task(self, name, onDone, onError, onProgress, onCancelled)
+		self._tasks.append(task)
+		self._executor.submit(self._run, task, job, args)
+		if not self._polling:
+			self._polling = True
+			self.widget.after(self.pollInterval, self._poll)
+		return task
+
+	def _run(self, task, job, args):
+		"""Run a job in a worker thread, queueing how it ended."""
+		try:
+			task.checkCancelled()
+			self._messages.put(("done", task, job(task, *args)))
+		except TaskCancelled:
+			self._messages.put(("cancelled", task, None))
+		except Exception as exception:
+			self._messages.put(("error", task, exception))
+
+	def _poll(self):
+		"""Pass queued messages on to their callbacks, from the Tk main loop."""
+		try:
+			self._dispatch()
+		finally:
+			# However the callbacks went, unfinished tasks are still polled
+			if len(self._tasks) > 0:
+				self.widget.after(self.pollInterval, self._poll)
+			else:
+				self._polling = False
+
+	def _dispatch(self):
+		"""Call the callbacks of every queued message."""
+		latestProgress = dict()
+		endings = list()
+		while True:
+			try:
+				kind, task, value = self._messages.get_nowait()
+			except queue.Empty:
+				break
+			if kind == "progress":
+				latestProgress[task] = value
+			else:
+				latestProgress.pop(task, None)
+				endings.append((kind, task, value))
+
+		for task, (done, total, message) in latestProgress.items():
+			if task._onProgress is not None and not task.finished:
+				self._callback(task, task._onProgress, done, total, message)
+		for kind, task, value in endings:
+			task.finished = True
+			self._tasks.remove(task)
+			if kind == "done":
+				if task._onDone is not None:
+					self._callback(task, task._onDone, value)
+			elif kind == "cancelled":
+				if task._onCancelled is not None:
+					self._callback(task, task._onCancelled)
+			elif task._onError is not None:
+				self._callback(task, task._onError, value)
+			else:
+				sys.stderr.write("Task %s failed:\n" % task.name)
+				traceback.print_exception(type(value), value, value.__traceback__)
+
+	@staticmethod
+	def _callback(task, callback, *args):
+		"""Call one of a task's callbacks, printing the traceback of anything
+			it raises, so the other callbacks are still called."""
+		try:
+			callback(*args)
+		except Exception:
+			sys.stderr.write("Callback of task %s failed:\n" % task.name)
+			traceback.print_exc()
+
+	def pending(self):
+		"""Return the Tasks that haven't finished."""
+		return list(self._tasks)
+
+	def cancelAll(self):
+		"""Ask every unfinished Task to stop."""
+		for task in self._tasks:
+			task.cancel()
+
+	def shutdown(self):
+		"""Cancel every Task, and stop the worker threads once they finish."""
+		self.cancelAll()
+		self._executor.shutdown(wait=False)
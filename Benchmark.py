@@ -0,0 +1,348 @@
+#!/usr/bin/env python3
+
+import argparse
+import json
+import os
+import shutil
+import tempfile
+import time
+
+import numpy
+
+from Corpus import TestCorpus, TrainingCorpus
+from NCD import NCDClassifier
+from NGram import MAX_HASH_BITS, MAX_N, countNGrams, dimension
+from NGramClassifier import NGramClassifier
+from SectionReader import ReaderCache
+from SVM import SVMClassifier, trainSVM
+from Trainer import Trainer
+
+# Results format version, bumped whenever the stages or figures change
+BENCHMARK_VERSION = 4
+
+def _textBytes(rng, size):
+	"""Words of lower case letters, split by spaces and the odd newline."""
+	letters = numpy.frombuffer(b"etaoinshrdlucmfwypvbgkjqxz", dtype=numpy.uint8)
+	weights = 1.0 / numpy.arange(1, len(letters) + 1)
+	data = rng.choice(letters, size, p=weights / weights.sum())
+	data[rng.random_sample(size) < 0.18] = ord(" ")
+	data[rng.random_sample(size) < 0.01] = ord("\n")
+	return data.tobytes()
+
+def _randomBytes(rng, size):
+	"""Uniformly random bytes, like compressed or encrypted data."""
+	return rng.randint(0, 256, size, dtype=numpy.uint8).tobytes()
+
+def _codeBytes(rng, size):
+	"""Bytes drawn from a skewed distribution, like machine code."""
+	return numpy.minimum(rng.geometric(0.03, size) - 1, 255).astype(
+			numpy.uint8).tobytes()
+
+def _paddingBytes(rng, size):
+	"""Mostly zero or 0xff runs, with the odd random byte."""
+	data = numpy.zeros(size, dtype=numpy.uint8)
+	data[(numpy.arange(size) // 512) % 2 == 1] = 0xff
+	noise = rng.random_sample(size) < 0.02
+	data[noise] = rng.randint(0, 256, int(noise.sum()), dtype=numpy.uint8)
+	return data.tobytes()
+
+# The synthetic filetypes, and a function (rng, size) making bytes of each
+SYNTHETIC_FILETYPES = {
+	"text": _textBytes,
+	"random": _randomBytes,
+	"code": _codeBytes,
+	"padding": _paddingBytes,
+}
+
+def generateCorpora(directory, filesPerType=8, fileSize=64 * 1024,
+		firmwareCount=2, firmwareSize=1024 * 1024, sectionSize=64 * 1024,
+		nValue=2, seed=0):
+	"""Write synthetic training files, firmware images and corpus configs.
+
+		Each firmware image is a run of sections of random filetypes, each
+		about sectionSize bytes.  Returns the filenames of the training corpus
+		config and the test corpus config, which holds the true sections.
+		"""
+	rng = numpy.random.RandomState(seed)
+	names = sorted(SYNTHETIC_FILETYPES)
+	trainingCorpus = TrainingCorpus(name="Synthetic", nValue=nValue)
+	for name in names:
+		files = list()
+		for i in range(filesPerType):
+			filename = os.path.join(directory, "%s%d.bin" % (name, i))
+			with open(filename, "wb") as outputFile:
+				outputFile.write(SYNTHETIC_FILETYPES[name](rng, fileSize))
+			files.append(filename)
+		trainingCorpus.appendFileType({"Name": name, "Ignore Existing": True,
+				"Filetype File": os.path.join(directory, name + ".model"),
+				"Files": files})
+
+	testCorpus = TestCorpus(name="Synthetic")
+	for i in range(firmwareCount):
+		filename = os.path.join(directory, "firmware%d.bin" % i)
+		sections = list()
+		with open(filename, "wb") as outputFile:
+			start = 0
+			while start < firmwareSize:
+				size = min(int(rng.randint(sectionSize // 2, sectionSize * 3 // 2)),
+						firmwareSize - start)
+				name = names[rng.randint(len(names))]
+				outputFile.write(SYNTHETIC_FILETYPES[name](rng, size))
+				sections.append({"Start": start, "End": start + size,
+						"Filetype": name})
+				start += size
+		testCorpus.appendFirmware({"Name": "firmware%d" % i,
+				"Filename": filename, "Sections": sections})
+
+	trainingFile = os.path.join(directory, "training.cfg")
+	testFile = os.path.join(directory, "test.cfg")
+	trainingCorpus.writeOut(trainingFile)
+	testCorpus.writeOut(testFile)
+	return trainingFile, testFile
+
+def generateLargeConfig(filename, sections, firmwareCount=10):
+	"""Write a test corpus config with many small sections, and no images."""
+	testCorpus = TestCorpus(name="Large")
+	perFirmware = -(-sections // firmwareCount)
+	for i in range(firmwareCount):
+		count = max(0, min(perFirmware, sections - i * perFirmware))
+		testCorpus.appendFirmware({"Name": "firmware%d" % i,
+				"Filename": "firmware%d.bin" % i,
+				"Sections": [{"Start": j * 64, "End": (j + 1) * 64,
+				"Filetype": "text"} for j in range(count)]})
+	testCorpus.writeOut(filename)
+
+def _timed(function, repeat=1):
+	"""Run function repeat times, returning the fastest seconds, and the
+		result of the last run."""
+	best = None
+	for _ in range(repeat):
+		start = time.perf_counter()
+		result = function()
+		seconds = time.perf_counter() - start
+		best = seconds if best is None else min(best, seconds)
+	return best, result
+
+def _classifierThroughput(makeClassifier, testCorpus, repeat=1):
+	"""Return the speed and accuracy of a classifier over a corpus's sections.
+
+		Each run classifies with a fresh classifier from makeClassifier, as a
+		classifier may cache its results, and later runs would then time the
+		cache rather than the classifier.  Building the classifier is timed
+		apart, as Setup Seconds.
+		"""
+	readers = ReaderCache()
+	sections = [(readers.get(firmware.filename), section)
+			for firmware in testCorpus.firmwareDefinitions
+			for section in firmware.sections]
+
+	def classifyAll(classifier):
+		datas = [reader.section(section) for reader, section in sections]
+		try:
+			if hasattr(classifier, "classifyBatch"):
+				return classifier.classifyBatch(datas)
+			return [classifier.classify(data) for data in datas]
+		finally:
+			for data in datas:
+				data.release()
+
+	seconds = setupSeconds = labels = None
+	for _ in range(repeat):
+		runSetupSeconds, classifier = _timed(makeClassifier)
+		try:
+			runSeconds, labels = _timed(lambda: classifyAll(classifier))
+		finally:
+			if hasattr(classifier, "close"):
+				classifier.close()
+		seconds = runSeconds if seconds is None else min(seconds, runSeconds)
+		setupSeconds = runSetupSeconds if setupSeconds is None else min(
+				setupSeconds, runSetupSeconds)
+	readers.close()
+	correct = sum(1 for (_, section), label in zip(sections, labels)
+			if label == section.filetype)
+	sectionBytes = sum(len(section) for _, section in sections)
+	result = dict()
+	result["Seconds"] = seconds
+	result["Setup Seconds"] = setupSeconds
+	result["Sections Per Second"] = len(sections) / max(seconds, 1e-9)
+	result["MB Per Second"] = sectionBytes / 1e6 / max(seconds, 1e-9)
+	result["Accuracy"] = correct / float(max(len(sections), 1))
+	return result
+
+# The classifiers that may be benchmarked, and how to build each
+CLASSIFIERS = {
+	"ngram": NGramClassifier,
+	"svm": SVMClassifier,
+	"ncd": NCDClassifier,
+}
+
+def runBenchmarks(directory, nValues=(1, 2, 3), classifiers=("ngram", "svm"),
+		configSections=100000, repeat=3, hashBits=20, **corpusOptions):
+	"""Generate synthetic corpora in directory and time each stage.
+
+		N-gram counting is timed for each n, and for n with more than
+		2**hashBits possible n-grams also with the n-grams hashed into that
+		many buckets.  corpusOptions are passed on to
+		generateCorpora.  Returns a dictionary
+		of the parameters, and of the figures for each stage by name.
+		"""
+	results = dict()
+	trainingFile, testFile = generateCorpora(directory, **corpusOptions)
+
+	largeFile = os.path.join(directory, "large.cfg")
+	generateLargeConfig(largeFile, configSections)
+	seconds, largeCorpus = _timed(lambda: TestCorpus(filename=largeFile),
+			repeat)
+	results["Load Test Corpus"] = {"Seconds": seconds,
+			"Sections Per Second": configSections / max(seconds, 1e-9)}
+	seconds, _ = _timed(lambda: largeCorpus.writeOut(largeFile + ".out"),
+			repeat)
+	results["Write Test Corpus"] = {"Seconds": seconds,
+			"Sections Per Second": configSections / max(seconds, 1e-9)}
+	seconds, _ = _timed(lambda: sum(len(firmware.sections)
+			for firmware in TestCorpus.iterFirmware(largeFile)), repeat)
+	results["Stream Test Corpus"] = {"Seconds": seconds,
+			"Sections Per Second": configSections / max(seconds, 1e-9)}
+	del largeCorpus
+
+	seconds, trainingCorpus = _timed(
+			lambda: TrainingCorpus(filename=trainingFile), repeat)
+	trainingFiles = sum(len(filetype.files)
+			for filetype in trainingCorpus.filetypeDefinitions)
+	results["Load Training Corpus"] = {"Seconds": seconds,
+			"Files Per Second": trainingFiles / max(seconds, 1e-9)}
+	testCorpus = TestCorpus(filename=testFile)
+	datas = list()
+	for filetype in trainingCorpus.filetypeDefinitions:
+		for sample in filetype.files:
+			with open(sample.filename, "rb") as inputFile:
+				datas.append(inputFile.read())
+	totalBytes = sum(len(data) for data in datas)
+	for n in nValues:
+		seconds, _ = _timed(lambda: [countNGrams(data, n) for data in datas],
+				repeat)
+		results["NGram n=%d" % n] = {"Seconds": seconds,
+				"MB Per Second": totalBytes / 1e6 / max(seconds, 1e-9)}
+		if dimension(n) > dimension(n, hashBits):
+			seconds, _ = _timed(lambda: [countNGrams(data, n, hashBits)
+					for data in datas], repeat)
+			results["NGram n=%d hashed" % n] = {"Seconds": seconds,
+					"MB Per Second": totalBytes / 1e6 / max(seconds, 1e-9)}
+
+	def trainAll():
+		# Train from scratch each run, rather than updating the last run's models
+		for filetype in trainingCorpus.filetypeDefinitions:
+			if os.path.exists(filetype.filetypeFile):
+				os.remove(filetype.filetypeFile)
+		Trainer(trainingCorpus).run()
+
+	seconds, _ = _timed(trainAll, repeat)
+	results["Train"] = {"Seconds": seconds,
+			"MB Per Second": totalBytes / 1e6 / max(seconds, 1e-9)}
+	if "svm" in classifiers:
+		seconds, _ = _timed(lambda: trainSVM(trainingCorpus), repeat)
+		results["Train SVM"] = {"Seconds": seconds}
+
+	for name in classifiers:
+		results["Classify " + name] = _classifierThroughput(
+				lambda: CLASSIFIERS[name](trainingCorpus), testCorpus, repeat)
+
+	parameters = dict(corpusOptions)
+	parameters["nValues"] = list(nValues)
+	parameters["classifiers"] = list(classifiers)
+	parameters["configSections"] = configSections
+	parameters["repeat"] = repeat
+	parameters["hashBits"] = hashBits
+	return {"Version": BENCHMARK_VERSION, "Parameters": parameters,
+			"Results": results}
+
+def compareResults(results, baseline, tolerance=0.2):
+	"""Return the stages that got slower than baseline by more than tolerance.
+
+		Each is a tuple of (stage, baseline seconds, seconds, ratio).  Stages
+		missing from either, or run with different parameters, are skipped.
+		"""
+	if baseline.get("Parameters") != results.get("Parameters"):
+		return list()
+	regressions = list()
+	for stage, figures in sorted(results["Results"].items()):
+		if stage not in baseline["Results"]:
+			continue
+		before = baseline["Results"][stage]["Seconds"]
+		after = figures["Seconds"]
+		if before > 0 and after / before > 1 + tolerance:
+			regressions.append((stage, before, after, after / before))
+	return regressions
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(
+			description="Benchmark corpus loading, n-gram counting, training " +
+			"and classification on synthetic corpora.")
+	parser.add_argument("output", help="file to write the JSON results to")
+	parser.add_argument("--baseline",
+			help="earlier results to compare against, failing on regressions")
+	parser.add_argument("--tolerance", type=float, default=0.2,
+			help="the slowdown allowed against the baseline (default: " +
+			"%(default)s)")
+	parser.add_argument("--directory",
+			help="where to write the synthetic corpora (default: a temporary " +
+			"directory, removed afterwards)")
+	parser.add_argument("--seed", type=int, default=0,
+			help="the random seed (default: %(default)s)")
+	parser.add_argument("--files", type=int, default=8,
+			help="training files per filetype (default: %(default)s)")
+	parser.add_argument("--file-size", type=int, default=64 * 1024,
+			help="bytes per training file (default: %(default)s)")
+	parser.add_argument("--firmware", type=int, default=2,
+			help="number of firmware images (default: %(default)s)")
+	parser.add_argument("--firmware-size", type=int, default=1024 * 1024,
+			help="bytes per firmware image (default: %(default)s)")
+	parser.add_argument("--section-size", type=int, default=64 * 1024,
+			help="average bytes per firmware section (default: %(default)s)")
+	parser.add_argument("--config-sections", type=int, default=100000,
+			help="sections in the config load benchmark (default: %(default)s)")
+	parser.add_argument("-n", "--n-values", type=int, nargs="+",
+			default=[1, 2, 3], choices=range(1, MAX_N + 1),
+			help="n values to time n-gram counting for (default: 1 2 3)")
+	parser.add_argument("--classifiers", nargs="+", default=["ngram", "svm"],
+			choices=sorted(CLASSIFIERS),
+			help="classifiers to time (default: ngram svm)")
+	parser.add_argument("--repeat", type=int, default=3,
+			help="runs per stage, keeping the fastest (default: %(default)s)")
+	parser.add_argument("--hash-bits", type=int, default=20,
+			choices=range(1, MAX_HASH_BITS + 1), metavar="BITS",
+			help="hash bits for the hashed n-gram counts (default: %(default)s)")
+	args = parser.parse_args(argv)
+
+	directory = args.directory
+	if directory is None:
+		directory = tempfile.mkdtemp(prefix="benchmark")
+	try:
+		results = runBenchmarks(directory, args.n_values, args.classifiers,
+				args.config_sections, args.repeat, hashBits=args.hash_bits,
+				filesPerType=args.files,
+				fileSize=args.file_size, firmwareCount=args.firmware,
+				firmwareSize=args.firmware_size, sectionSize=args.section_size,
+				seed=args.seed)
+	finally:
+		if args.directory is None:
+			shutil.rmtree(directory)
+	with open(args.output, "w") as outputFile:
+		json.dump(results, outputFile, indent=2, sort_keys=True)
+	for stage, figures in sorted(results["Results"].items()):
+		print("%-24s %10.4f s" % (stage, figures["Seconds"]))
+
+	if args.baseline is not None:
+		with open(args.baseline, "r") as baselineFile:
+			baseline = json.load(baselineFile)
+		if baseline.get("Parameters") != results["Parameters"]:
+			print("Baseline was run with different parameters, not compared")
+		regressions = compareResults(results, baseline, args.tolerance)
+		for stage, before, after, ratio in regressions:
+			print("Regression: %s took %.4f s, was %.4f s (%.2fx)" % (stage,
+					after, before, ratio))
+		if len(regressions) > 0:
+			parser.exit(1)
+
+if __name__ == "__main__":
+	main()
@@ -1,22 +1,446 @@
+from array import array
+from bisect import bisect_left, bisect_right
+import contextlib
 import json
+import numbers
+import os
+
+try:
+	import orjson
+except ImportError:
+	orjson = None
+
+import CorpusStore
+import Instrumentation
+
+# Corpus configs with these extensions are line-delimited: a header object with
+# the corpus settings on the first line, then one definition per line
+LINE_DELIMITED_EXTENSIONS = (".jsonl", ".ndjson")
+
+# Corpus.save appends changes to an edit log beside the config, named with this
+# suffix, and rewrites the config once the log has more records than
+# COMPACT_RATIO of the definitions, or COMPACT_MINIMUM if that is more
+EDIT_LOG_SUFFIX = ".edits"
+COMPACT_RATIO = 0.25
+COMPACT_MINIMUM = 1000
+
+# The entry that tells apart the definitions under each definitions key
+_IDENTITY_KEYS = {"Firmware Definitions": "Filename",
+		"Filetype Definitions": "Name"}
+
+def _encode(value):
+	"""Return value as compact JSON bytes, using orjson if it's installed.
+
+		The result is always ASCII, as json.dumps would write it, so the
+		configs read the same whatever the locale's encoding.  orjson writes
+		NaN and infinities as null, where json.dumps writes NaN and Infinity,
+		so any output containing null is encoded again by json.dumps.
+		"""
+	if orjson is not None:
+		try:
+			encoded = orjson.dumps(value)
+			if encoded.isascii() and b"null" not in encoded:
+				return encoded
+		except TypeError:
+			# Such as integers too big for orjson, or non-string keys
+			pass
+	return json.dumps(value, separators=(",", ":")).encode("ascii")
+
+class _JSONStream:
+
+	"""
+		_JSONStream decodes the JSON values in a file one at a time, reading
+		only as much of the file as the next value needs.
+		"""
+
+	def __init__(self, inputFile, chunkSize=1024 * 1024):
+		self.inputFile = inputFile
+		self.chunkSize = chunkSize
+		self.eof = False
+		self._buf = ""
+		self._pos = 0
+		self._decoder = json.JSONDecoder()
+		# The length of the longest value decoded so far
+		self._longest = 0
+
+	def _fill(self, size):
+		"""Read up to size more characters, returning False at end of file."""
+		if self.eof:
+			return False
+		data = self.inputFile.read(size)
+		if data == "":
+			self.eof = True
+			return False
+		self._buf = self._buf[self._pos:] + data
+		self._pos = 0
+		return True
+
+	def peek(self):
+		"""Return the next non-whitespace character, or "" at end of file."""
+		while True:
+			while self._pos < len(self._buf) and self._buf[self._pos] in " \t\r\n":
+				self._pos += 1
+			if self._pos < len(self._buf):
+				return self._buf[self._pos]
+			if not self._fill(self.chunkSize):
+				return ""
+
+	def expect(self, chars):
+		"""Consume and return the next character, which must be in chars."""
+		char = self.peek()
+		if char == "" or char not in chars:
+			raise ValueError("Expected one of %r in corpus config, found %r" %
+					(chars, char))
+		self._pos += 1
+		return char
+
+	def value(self):
+		"""Decode and return the next complete value."""
+		self.peek()
+		# Read ahead for a value as long as the longest so far, so values are
+		# seldom decoded while still cut short
+		if len(self._buf) - self._pos < 2 * self._longest:
+			self._fill(max(self.chunkSize, 4 * self._longest))
+		while True:
+			try:
+				value, end = self._decoder.raw_decode(self._buf, self._pos)
+				# A value running to the end of the buffer may be cut short
+				if end < len(self._buf) or self.eof:
+					self._longest = max(self._longest, end - self._pos)
+					self._pos = end
+					return value
+			except json.JSONDecodeError:
+				if self.eof:
+					raise
+			# Read as much again as is buffered, so a huge value is decoded
+			# no more than twice over in all
+			self._fill(max(self.chunkSize, len(self._buf) - self._pos))
+
+def _readEditLog(filename):
+	"""Return the header entries, the latest edit of each definition, and the
+		number of records in a config's edit log.
+
+		Edits map each changed definition's identity to its definition, or to
+		None if it was removed.
+		"""
+	header = dict()
+	edits = dict()
+	records = 0
+	try:
+		editLog = open(filename + EDIT_LOG_SUFFIX, "r")
+	except FileNotFoundError:
+		return header, edits, records
+	with editLog:
+		for line in editLog:
+			if line.strip() == "":
+				continue
+			record = json.loads(line)
+			records += 1
+			if "Header" in record:
+				header.update(record["Header"])
+			elif "Removed" in record:
+				edits[record["Removed"]] = None
+			else:
+				edits[record["Identity"]] = record["Definition"]
+	return header, edits, records
+
+def _iterConfig(filename, definitionsKey, editLog=None):
+	"""Yield (key, value) pairs from a corpus config, reading it as it goes.
+
+		Top level entries are yielded as they are, except for definitionsKey,
+		which holds a list or dictionary of definitions.  Each definition in it
+		is yielded as its own (definitionsKey, definition) pair as soon as it is
+		read.  Both the JSON and line-delimited config formats are read.
+
+		Any edit log Corpus.save left beside the config is applied: edited
+		definitions replace the ones they share an identity with, removed ones
+		are skipped, new ones follow the rest, and header entries come last.
+		Pass editLog, as _readEditLog returns it, if it has been read already.
+
+		Filenames a CorpusStore handles are read from the store instead.
+		"""
+	store = CorpusStore.storeFor(filename, readOnly=True)
+	if store is not None:
+		# Closed as soon as this generator is, however much was read
+		with store, contextlib.closing(store.iterConfig(definitionsKey)) as items:
+			yield from items
+		return
+	if editLog is None:
+		editLog = _readEditLog(filename)
+	header, edits, records = editLog
+	if records == 0:
+		yield from _iterConfigFile(filename, definitionsKey)
+		return
+	identityKey = _IDENTITY_KEYS[definitionsKey]
+	for key, value in _iterConfigFile(filename, definitionsKey):
+		if key == definitionsKey and value.get(identityKey) in edits:
+			value = edits.pop(value.get(identityKey))
+			if value is None:
+				continue
+		yield key, value
+	for definition in edits.values():
+		if definition is not None:
+			yield definitionsKey, definition
+	for key, value in header.items():
+		yield key, value
+
+def _iterConfigFile(filename, definitionsKey):
+	"""Yield (key, value) pairs from the config file itself, as _iterConfig."""
+	with open(filename, "r") as configFile:
+		if filename.endswith(LINE_DELIMITED_EXTENSIONS):
+			header = None
+			for line in configFile:
+				if line.strip() == "":
+					continue
+				if header is None:
+					header = json.loads(line)
+					for key, value in header.items():
+						yield key, value
+				else:
+					yield definitionsKey, json.loads(line)
+			return
+
+		stream = _JSONStream(configFile)
+		stream.expect("{")
+		if stream.peek() == "}":
+			return
+		while True:
+			key = stream.value()
+			stream.expect(":")
+			if key == definitionsKey and stream.peek() in "[{":
+				closing = "]" if stream.expect("[{") == "[" else "}"
+				if stream.peek() == closing:
+					stream.expect(closing)
+				else:
+					while True:
+						if closing == "}":
+							# Definitions in a dictionary are keyed by their name
+							stream.value()
+							stream.expect(":")
+						yield key, stream.value()
+						if stream.expect("," + closing) == closing:
+							break
+			else:
+				yield key, stream.value()
+			if stream.expect(",}") == "}":
+				return
 
 class Corpus:
 
 	"""
 		A superclass for Test and Training Corpus.  This should really do more...
 
+		A corpus remembers the file it was last loaded from or written to, and
+		which of its definitions have changed since, so save() can append just
+		the changes to that file's edit log.  Edited definitions are found by
+		their identity - a firmware's filename, or a filetype's name - so a
+		definition whose identity changes is saved as a removal and an
+		addition, and moves to the end of the corpus when next loaded.
+
+		Filenames with an extension registered in CorpusStore.STORES, such as
+		an SQLite database's, are written to that store rather than as JSON,
+		and save() applies its changes to the store directly.
+
 		Public Functions:
 			Corpus.writeOut(filename) - write the corpus out to a file
+			Corpus.save(filename) - write out just the changes since the corpus
+				was last loaded from or written to filename
+			Corpus.prepareSave(filename) - return a function doing save(filename)
+				that may run on another thread
+			Corpus.snapshot() - return a copy of the corpus, sharing nothing
+				that can be edited with it
 		"""
 
+	def __init__(self):
+		self._savedFilename = None
+		self._savedHeader = None
+		self._savedIdentities = None
+		self._editLogRecords = 0
+
 	def writeOut(self, filename):
-		"""Write the corpus out to a file."""
-		with open(filename, "w") as outputFile:
-			json.dump(self._toDict(), outputFile)
+		"""Write the corpus out to a file, replacing any edit log.
+
+			If filename ends with one of LINE_DELIMITED_EXTENSIONS, the corpus is
+			written in the line-delimited format.  Either way, the definitions
+			are encoded and written one at a time, so the whole corpus is never
+			held as dictionaries, and the file is replaced atomically once it is
+			complete.
+			"""
+		self._writeFile(filename)
+		self._markSaved(filename, 0)
+
+	def _writeFile(self, filename):
+		"""Write the whole corpus to filename, without marking it saved."""
+		store = CorpusStore.storeFor(filename)
+		if store is not None:
+			with store:
+				store.write(self._definitionsKey, self._headerDict(),
+						self._definitionDicts())
+			return
+		tempFilename = filename + ".tmp"
+		try:
+			with open(tempFilename, "wb", buffering=1024 * 1024) as outputFile:
+				if filename.endswith(LINE_DELIMITED_EXTENSIONS):
+					self._writeLines(outputFile)
+				else:
+					self._writeJSON(outputFile)
+			os.replace(tempFilename, filename)
+		except BaseException:
+			if os.path.exists(tempFilename):
+				os.remove(tempFilename)
+			raise
+		try:
+			os.remove(filename + EDIT_LOG_SUFFIX)
+		except FileNotFoundError:
+			pass
+
+	def _writeLines(self, outputFile):
+		"""Write the header, then each definition, a line each."""
+		outputFile.write(_encode(self._headerDict()) + b"\n")
+		for definition in self._definitionDicts():
+			outputFile.write(_encode(definition) + b"\n")
+
+	def _writeJSON(self, outputFile):
+		"""Write the corpus as one JSON object, as _toDict would give it,
+			encoding a definition at a time."""
+		header = _encode(self._headerDict())
+		outputFile.write(header[:-1])
+		if len(header) > 2:
+			outputFile.write(b",")
+		opening, closing = self._definitionsBrackets
+		outputFile.write(_encode(self._definitionsKey) + b":" + opening)
+		first = True
+		for key, definition in self._keyedDefinitionDicts():
+			if not first:
+				outputFile.write(b",")
+			first = False
+			if key is not None:
+				outputFile.write(_encode(key) + b":")
+			outputFile.write(_encode(definition))
+		outputFile.write(closing + b"}")
+
+	def _keyedDefinitionDicts(self):
+		"""Yield the key, if the definitions are keyed, and dictionary of each
+			definition in the config."""
+		for definition in self._definitionDicts():
+			yield None, definition
+
+	def save(self, filename):
+		"""Save the corpus to a file, as cheaply as possible.
+
+			If the corpus was last loaded from or written to filename, the
+			header and definitions that changed since, and the identities of
+			removed definitions, are appended to the file's edit log.
+			Otherwise, or once the log is due for compaction, the whole corpus
+			is written out.
+			"""
+		self.prepareSave(filename)()
+
+	def prepareSave(self, filename):
+		"""Take what save(filename) would write, and return a function that
+			writes it.
+
+			Call this on the thread that edits the corpus.  It marks the corpus
+			saved, and copies what is to be written - the changed definitions'
+			records, or a snapshot of the whole corpus - so the returned
+			function may run on another thread while editing carries on.  Edits
+			made after this are saved next time.  If the function fails, the
+			next save writes the whole corpus.
+			"""
+		definitions = self._definitions()
+		identities = [self._identity(definition) for definition in definitions]
+		current = set(identities)
+		if (self._savedFilename != os.path.realpath(filename) or
+				self._savedIdentities is None or len(current) < len(identities)
+				or not os.path.exists(filename)):
+			return self._prepareWriteOut(filename)
+
+		records = list()
+		header = self._headerDict()
+		if header != self._savedHeader:
+			records.append({"Header": header})
+		for identity in self._savedIdentities - current:
+			records.append({"Removed": identity})
+		for identity, definition in zip(identities, definitions):
+			if definition.isDirty() or identity not in self._savedIdentities:
+				records.append({"Identity": identity,
+						"Definition": definition._toDict()})
+
+		if CorpusStore.storeClassFor(filename) is not None:
+			logRecords = 0
+		else:
+			logRecords = self._editLogRecords + len(records)
+			if logRecords > max(COMPACT_MINIMUM,
+					COMPACT_RATIO * len(definitions)):
+				return self._prepareWriteOut(filename)
+		self._markSaved(filename, logRecords)
+
+		def writeRecords():
+			try:
+				store = CorpusStore.storeFor(filename)
+				if store is not None:
+					with store:
+						store.applyEdits(self._definitionsKey, records)
+				elif len(records) > 0:
+					with open(filename + EDIT_LOG_SUFFIX, "ab") as editLog:
+						for record in records:
+							editLog.write(_encode(record) + b"\n")
+			except BaseException:
+				self._savedFilename = None
+				raise
+		return writeRecords
+
+	def _prepareWriteOut(self, filename):
+		"""Return a function writing a snapshot of the whole corpus, as
+			prepareSave does."""
+		snapshot = self.snapshot()
+		self._markSaved(filename, 0)
+
+		def writeSnapshot():
+			try:
+				snapshot._writeFile(filename)
+			except BaseException:
+				self._savedFilename = None
+				raise
+		return writeSnapshot
+
+	def _markSaved(self, filename, editLogRecords):
+		"""Remember the corpus as it is in filename, marking it unchanged."""
+		definitions = self._definitions()
+		for definition in definitions:
+			definition.markClean()
+		identities = set(self._identity(definition)
+				for definition in definitions)
+		self._savedFilename = os.path.realpath(filename)
+		self._savedHeader = self._headerDict()
+		# Duplicate identities can't be told apart in an edit log
+		if len(identities) < len(definitions):
+			identities = None
+		self._savedIdentities = identities
+		self._editLogRecords = editLogRecords
+
+	# The config entry holding the definitions, and the brackets around them
+	_definitionsKey = None
+	_definitionsBrackets = (b"[", b"]")
+
+	def snapshot(self):
+		raise NotImplementedError("Corpus must be inherited.")
+
+	def _definitions(self):
+		raise NotImplementedError("Corpus must be inherited.")
+
+	def _identity(self, definition):
+		raise NotImplementedError("Corpus must be inherited.")
 
 	def _toDict(self):
 		raise NotImplementedError("Corpus must be inherited.")
 
+	def _headerDict(self):
+		raise NotImplementedError("Corpus must be inherited.")
+
+	def _definitionDicts(self):
+		raise NotImplementedError("Corpus must be inherited.")
+
 
 class TestCorpus(Corpus):
 
@@ -28,45 +452,76 @@ class TestCorpus(Corpus):
 			description - a brief description of the corpus
 			firmwareDefinitions - a list of Firmware objects, with info about each
 				firmware in the test corpus
+
+		Public Functions:
+			TestCorpus.iterFirmware(filename) - yield each Firmware in a config
+				file as it is read, without loading the whole corpus
 		"""
 
+	_definitionsKey = "Firmware Definitions"
+
 	def __init__(self, name="", description="", filename=None):
 		"""Construct a test corpus
 
 			Supply filename if you wish to load from a file
 			Otherwise, name each parameter
 			"""
+		super(TestCorpus, self).__init__()
 		self.name = name
 		self.description = description
 		self.firmwareDefinitions = list()
 		if filename is not None:
-			# Load the configuration
-			config = dict()
-			with open(filename, 'r') as testConfigFile:
-				config = json.load(testConfigFile)
-
-			# Separate out the important parts for ease
-			if "Name" in config:
-				self.name = config["Name"]
-			if "Description" in config:
-				self.description = config["Description"]
-			if "Firmware Definitions" in config:
-				for fwDef in config["Firmware Definitions"]:
-					self.appendFileType(fwDef)
+			# Load the configuration, separating out the important parts
+			editLog = _readEditLog(filename)
+			for key, value in Instrumentation.timedIter("Corpus Load",
+					_iterConfig(filename, "Firmware Definitions", editLog)):
+				if key == "Name":
+					self.name = value
+				elif key == "Description":
+					self.description = value
+				elif key == "Firmware Definitions":
+					self.appendFirmware(value)
+			self._markSaved(filename, editLog[2])
+
+	@staticmethod
+	def iterFirmware(filename):
+		"""Yield each Firmware defined in a test corpus config, as it is read."""
+		# Closed with this generator, so stopping early releases the config
+		with contextlib.closing(_iterConfig(filename,
+				"Firmware Definitions")) as items:
+			for key, value in Instrumentation.timedIter("Corpus Load", items):
+				if key == "Firmware Definitions":
+					yield Firmware(value)
 
 	def _toDict(self):
 		"""Return a dictionary representation of the test corpus."""
+		outputDict = self._headerDict()
+		outputDict["Firmware Definitions"] = list(self._definitionDicts())
+		return outputDict
+
+	def _headerDict(self):
 		outputDict = dict()
 		outputDict["Name"] = self.name
 		outputDict["Description"] = self.description
-		
-		fwDefs = list()
-		for fwDef in self.firmwareDefinitions:
-			fwDefs.append(fwDef._toDict())
-
-		outputDict["Firmware Definitions"] = fwDefs
 		return outputDict
 
+	def snapshot(self):
+		"""Return a copy of the corpus and its firmware."""
+		corpus = TestCorpus(self.name, self.description)
+		corpus.firmwareDefinitions = [firmware.copy()
+				for firmware in self.firmwareDefinitions]
+		return corpus
+
+	def _definitions(self):
+		return self.firmwareDefinitions
+
+	def _identity(self, firmware):
+		return firmware.filename
+
+	def _definitionDicts(self):
+		for fwDef in self.firmwareDefinitions:
+			yield fwDef._toDict()
+
 	def appendFirmware(self, firmware):
 		"""Append a firmware to the corpus.
 			
@@ -78,29 +533,63 @@ class TestCorpus(Corpus):
 		else:
 			self.firmwareDefinitions.append(Firmware(firmware))
 
-class Firmware:
+class _Tracked:
+
+	"""Marks an object changed whenever one of its parameters is set."""
+
+	def __setattr__(self, name, value):
+		object.__setattr__(self, name, value)
+		if name != "_changed":
+			object.__setattr__(self, "_changed", True)
+
+	def isDirty(self):
+		"""Return whether the object changed since markClean was called."""
+		return self._changed
+
+	def markClean(self):
+		"""Mark the object unchanged, as when it has been saved."""
+		self._changed = False
+
+class Firmware(_Tracked):
 
 	"""
 		Firmware stores one firmware object and its sections
 
+		Setting a parameter, or changing a section, marks the firmware dirty
+		until it is saved.
+
 		Public parameters:
 			name - a user friendly name for the firmware
 			filename - the path to the firmware
-			sections - a list of firmware sections
+			sections - a SectionTable of firmware sections, used like a list
+
+		Public Functions:
+			Firmware.isDirty() - return whether the firmware changed since it
+				was loaded or saved
+			Firmware.markClean() - mark the firmware unchanged
+			Firmware.copy() - return a copy of the firmware and its sections
+			Firmware.appendFirmwareSection(section) - append a section, raising
+				ValueError if it overlaps one already there
+			Firmware.sectionAt(offset) - return the section containing an
+				offset, or None
+			Firmware.sectionsIn(start, end) - return the sections overlapping
+				[start, end), in order
+			Firmware.gaps(size) - return the (start, end) ranges no section
+				covers
 		"""
 
 	def __init__(self, firmwareDef):
 		self.name = ""
 		self.filename = ""
-		self.sections = list()
+		self.sections = SectionTable()
 
 		if "Name" in firmwareDef:
 			self.name = firmwareDef["Name"]
 		if "Filename" in firmwareDef:
 			self.filename = firmwareDef["Filename"]
 		if "Sections" in firmwareDef:
-			for section in firmwareDef["Sections"]:
-				self.appendFirmwareSection(section)
+			# Configs may already hold overlapping sections, so they're kept
+			self.sections = SectionTable(firmwareDef["Sections"], validate=False)
 
 	def _toDict(self):
 		outputDict = dict()
@@ -113,11 +602,428 @@ class Firmware:
 
 		return outputDict
 
+	def isDirty(self):
+		return self._changed or self.sections.dirty
+
+	def markClean(self):
+		self._changed = False
+		self.sections.dirty = False
+
+	def copy(self):
+		"""Return a copy of the firmware and its sections."""
+		firmware = Firmware({"Name": self.name, "Filename": self.filename})
+		firmware.sections = self.sections.copy()
+		return firmware
+
 	def appendFirmwareSection(self, section):
-		if isinstance(section, FirmwareSection):
-			self.sections.append(section)
+		self.sections.append(section)
+
+	def sectionAt(self, offset):
+		"""Return the section containing offset, or None."""
+		return self.sections.sectionAt(offset)
+
+	def sectionsIn(self, start, end):
+		"""Return the sections overlapping [start, end), in order."""
+		return self.sections.sectionsIn(start, end)
+
+	def gaps(self, size=None):
+		"""Return the (start, end) ranges that no section covers.
+
+			Give the firmware size to include the range after the last section.
+			"""
+		return self.sections.gaps(size)
+
+class SectionTable:
+
+	"""
+		SectionTable stores the sections of a firmware as columns, rather than as
+		an object per section: the starts and ends of every section in two
+		array('Q')s, and the filetype of each as an id into a list of the
+		distinct filetype names.
+
+		It is used like a list of FirmwareSections.  Indexing or iterating it
+		gives SectionViews, which read and write their row of the table and
+		have the same parameters as a FirmwareSection.  Slicing it gives a
+		list of SectionViews, and deleting sections moves the rows after them
+		up, as for a list, so views of those rows shouldn't be kept across a
+		deletion.  Bounds must be non-negative whole numbers.
+
+		Sections appended or moved may not overlap.  The table also keeps the
+		rows in order of their starts, so the section containing an offset, or
+		the sections within a range, are found by bisection.  Empty sections
+		are allowed anywhere that isn't strictly inside another section, and
+		sort before any section with the same start.
+
+		Sections loaded from a config may already overlap, so they can be
+		appended with validate=False instead.  A table holding overlapping
+		sections works the same, but searches it by scanning rather than
+		bisection.
+
+		Public parameters:
+			starts - the start of each section
+			ends - the end of each section
+			filetypeIds - the filetype id of each section
+			filetypes - the filetype name of each filetype id
+			dirty - whether any section was added or changed since this was
+				last cleared
+			overlapping - whether sections appended without validation left
+				any sections overlapping
+
+		Public Functions:
+			SectionTable.append(section, validate) - append a FirmwareSection,
+				SectionView, or something the FirmwareSection constructor can
+				handle, raising ValueError if it overlaps another unless validate
+				is False
+			SectionTable.filetypeId(filetype) - return the id of a filetype name,
+				adding it if it's new
+			SectionTable.setBounds(index, bounds) - move a section
+			SectionTable.remove(section) - delete the first section with the
+				same bounds and filetype, raising ValueError if there's none
+			SectionTable.sectionAt(offset) - return the section containing an
+				offset, or None
+			SectionTable.sectionsIn(start, end) - return the sections
+				overlapping [start, end), in order
+			SectionTable.ordered() - yield the sections in order of their starts
+			SectionTable.gaps(size) - return the (start, end) ranges no section
+				covers
+			SectionTable.copy() - return a copy of the table
+		"""
+
+	__slots__ = ("starts", "ends", "filetypeIds", "filetypes", "_filetypeIds",
+			"_sortedStarts", "_order", "dirty", "overlapping")
+
+	def __init__(self, sections=(), validate=True):
+		self.starts = array("Q")
+		self.ends = array("Q")
+		self.filetypeIds = array("I")
+		self.filetypes = list()
+		self._filetypeIds = dict()
+		# The starts in order, and the row of each
+		self._sortedStarts = array("Q")
+		self._order = array("I")
+		self.dirty = False
+		self.overlapping = False
+		if validate:
+			for section in sections:
+				self.append(section)
+		else:
+			self._load(sections)
+
+	def _load(self, sections):
+		"""Fill an empty table with sections, unvalidated, sorting them once.
+
+			Config section dictionaries are read directly, rather than as
+			FirmwareSections, and ordered sections, as configs usually hold,
+			aren't sorted at all.
+			"""
+		starts = self.starts
+		ends = self.ends
+		filetypeIds = self.filetypeIds
+		filetypeId = self.filetypeId
+		inOrder = True
+		lastKey = (0, False)
+		for section in sections:
+			if type(section) is dict:
+				if "Start" in section and "End" in section:
+					start, end = section["Start"], section["End"]
+				else:
+					start = end = 0
+				filetype = section.get("Filetype", "")
+			else:
+				if not isinstance(section, (FirmwareSection, SectionView)):
+					section = FirmwareSection(section)
+				(start, end), filetype = section.bounds, section.filetype
+			if not (type(start) is int and type(end) is int and
+					0 <= start <= end < 2 ** 64):
+				self._checkBounds(start, end)
+				if start > end:
+					raise ValueError("Section %r ends before it starts" %
+							((start, end),))
+			# Empty sections sort before others with the same start
+			key = (start, start != end)
+			if key < lastKey:
+				inOrder = False
+			lastKey = key
+			starts.append(start)
+			ends.append(end)
+			filetypeIds.append(filetypeId(filetype))
+		if inOrder:
+			order = range(len(starts))
 		else:
-			self.sections.append(FirmwareSection(section))
+			order = sorted(range(len(starts)),
+					key=lambda row: (starts[row], starts[row] != ends[row]))
+		self._order = array("I", order)
+		self._sortedStarts = array("Q", (starts[row] for row in order))
+		# A section overlaps an earlier one just if it starts before the
+		# furthest end so far, as empty sections sort first
+		furthest = 0
+		for row in order:
+			if starts[row] < furthest:
+				self.overlapping = True
+				break
+			furthest = max(furthest, ends[row])
+		self.dirty = len(starts) > 0
+
+	def copy(self):
+		"""Return a copy of the table, with the same dirty state."""
+		table = SectionTable()
+		table.starts = array("Q", self.starts)
+		table.ends = array("Q", self.ends)
+		table.filetypeIds = array("I", self.filetypeIds)
+		table.filetypes = list(self.filetypes)
+		table._filetypeIds = dict(self._filetypeIds)
+		table._sortedStarts = array("Q", self._sortedStarts)
+		table._order = array("I", self._order)
+		table.dirty = self.dirty
+		table.overlapping = self.overlapping
+		return table
+
+	@staticmethod
+	def _checkBounds(start, end):
+		"""Raise ValueError unless the bounds fit in the table's columns."""
+		for bound in (start, end):
+			if isinstance(bound, bool) or not isinstance(bound, numbers.Integral):
+				raise ValueError("Section bounds %r must be whole numbers" %
+						((start, end),))
+			if not 0 <= bound < 2 ** 64:
+				raise ValueError("Section bounds %r must be from 0 to 2**64 - 1"
+						% ((start, end),))
+
+	def _position(self, start, end, validate=True):
+		"""Return where a section would go in the sorted order, raising
+			ValueError if its bounds are invalid or backwards, or if validate is
+			set and it overlaps another section."""
+		self._checkBounds(start, end)
+		if start > end:
+			raise ValueError("Section %r ends before it starts" % ((start, end),))
+		if start == end:
+			position = bisect_left(self._sortedStarts, start)
+		else:
+			position = bisect_right(self._sortedStarts, start)
+		if validate or not self.overlapping:
+			row = self._overlap(start, end, position)
+			if row is not None:
+				if validate:
+					raise ValueError("Section %r overlaps section %r" %
+							((start, end), (self.starts[row], self.ends[row])))
+				self.overlapping = True
+		return position
+
+	def _overlap(self, start, end, position):
+		"""Return a row overlapping [start, end), which would go at position
+			in the sorted order, or None."""
+		if self.overlapping:
+			# Every section starting before end may reach into the range
+			neighbours = range(bisect_left(self._sortedStarts, end))
+		else:
+			# Only the neighbours need checking, since no sections overlap yet
+			neighbours = (position - 1, position)
+		for neighbour in neighbours:
+			if 0 <= neighbour < len(self._order):
+				row = self._order[neighbour]
+				if self.starts[row] < end and self.ends[row] > start:
+					return row
+		return None
+
+	def _sortedPosition(self, index):
+		"""Return the position of a row in the sorted order."""
+		position = bisect_left(self._sortedStarts, self.starts[index])
+		while self._order[position] != index:
+			position += 1
+		return position
+
+	def filetypeId(self, filetype):
+		"""Return the id of a filetype name, adding it if it's new."""
+		if filetype not in self._filetypeIds:
+			self._filetypeIds[filetype] = len(self.filetypes)
+			self.filetypes.append(filetype)
+		return self._filetypeIds[filetype]
+
+	def append(self, section, validate=True):
+		if not isinstance(section, (FirmwareSection, SectionView)):
+			section = FirmwareSection(section)
+		start, end = section.bounds
+		position = self._position(start, end, validate)
+		self._sortedStarts.insert(position, start)
+		self._order.insert(position, len(self.starts))
+		self.starts.append(start)
+		self.ends.append(end)
+		self.filetypeIds.append(self.filetypeId(section.filetype))
+		self.dirty = True
+
+	def setBounds(self, index, bounds):
+		"""Move a section, raising ValueError if it would overlap another."""
+		position = self._sortedPosition(index)
+		del self._sortedStarts[position]
+		del self._order[position]
+		try:
+			newPosition = self._position(bounds[0], bounds[1])
+		except ValueError:
+			self._sortedStarts.insert(position, self.starts[index])
+			self._order.insert(position, index)
+			raise
+		self._sortedStarts.insert(newPosition, bounds[0])
+		self._order.insert(newPosition, index)
+		self.starts[index] = bounds[0]
+		self.ends[index] = bounds[1]
+		self.dirty = True
+
+	def remove(self, section):
+		"""Delete the first section with the same bounds and filetype."""
+		for i in range(len(self)):
+			if SectionView(self, i) == section:
+				del self[i]
+				return
+		raise ValueError("Section %r not in table" % (section.bounds,))
+
+	def _delete(self, index):
+		"""Delete a row, moving the rows after it up one."""
+		position = self._sortedPosition(index)
+		del self._sortedStarts[position]
+		del self._order[position]
+		del self.starts[index]
+		del self.ends[index]
+		del self.filetypeIds[index]
+		for position, row in enumerate(self._order):
+			if row > index:
+				self._order[position] = row - 1
+		self.dirty = True
+
+	def sectionAt(self, offset):
+		"""Return the SectionView containing offset, or None.
+
+			Of overlapping sections, the one starting last is returned.
+			"""
+		position = bisect_right(self._sortedStarts, offset) - 1
+		if self.overlapping:
+			while position >= 0 and self.ends[self._order[position]] <= offset:
+				position -= 1
+		if position >= 0 and self.ends[self._order[position]] > offset:
+			return SectionView(self, self._order[position])
+		return None
+
+	def sectionsIn(self, start, end):
+		"""Return the SectionViews overlapping [start, end), in order.
+
+			Empty sections count if they start within the range.
+			"""
+		first = bisect_left(self._sortedStarts, start)
+		last = bisect_left(self._sortedStarts, end, first)
+		if self.overlapping:
+			# Any section starting before the range may reach into it
+			return [SectionView(self, self._order[position])
+					for position in range(last)
+					if position >= first or self.ends[self._order[position]] > start]
+		# At most one section starts before the range and reaches into it
+		if first > 0 and self.ends[self._order[first - 1]] > start:
+			first -= 1
+		return [SectionView(self, self._order[position])
+				for position in range(first, last)]
+
+	def ordered(self):
+		"""Yield the SectionViews in order of their starts."""
+		for row in self._order:
+			yield SectionView(self, row)
+
+	def gaps(self, size=None):
+		"""Return the (start, end) ranges that no section covers.
+
+			The range before the first section is included, and so is the range
+			after the last if size is given.
+			"""
+		gaps = list()
+		covered = 0
+		for row in self._order:
+			if self.starts[row] > covered:
+				gaps.append((covered, self.starts[row]))
+			covered = max(covered, self.ends[row])
+		if size is not None and size > covered:
+			gaps.append((covered, size))
+		return gaps
+
+	def __len__(self):
+		return len(self.starts)
+
+	def __getitem__(self, index):
+		if isinstance(index, slice):
+			return [SectionView(self, i) for i in range(*index.indices(len(self)))]
+		if index < 0:
+			index += len(self)
+		if not 0 <= index < len(self):
+			raise IndexError("section index out of range")
+		return SectionView(self, index)
+
+	def __delitem__(self, index):
+		if isinstance(index, slice):
+			# Highest first, so the rows still to delete don't move
+			for i in sorted(range(*index.indices(len(self))), reverse=True):
+				self._delete(i)
+			return
+		if index < 0:
+			index += len(self)
+		if not 0 <= index < len(self):
+			raise IndexError("section index out of range")
+		self._delete(index)
+
+	def __iter__(self):
+		for i in range(len(self)):
+			yield SectionView(self, i)
+
+class SectionView:
+
+	"""
+		SectionView is a FirmwareSection stored as a row of a SectionTable.  It
+		holds only the table and row, so any number may be made cheaply, and
+		changing its parameters changes the table.  Views are equal to any
+		section with the same bounds and filetype.
+
+		Public parameters:
+			bounds - a tuple of form (start, end), as in FirmwareSection
+			length - the number of bytes in the segment, it's (end-start)
+			filetype - a string specifying the filetype
+		"""
+
+	__slots__ = ("table", "index")
+
+	def __init__(self, table, index):
+		self.table = table
+		self.index = index
+
+	@property
+	def bounds(self):
+		return (self.table.starts[self.index], self.table.ends[self.index])
+
+	@bounds.setter
+	def bounds(self, bounds):
+		self.table.setBounds(self.index, bounds)
+
+	@property
+	def filetype(self):
+		return self.table.filetypes[self.table.filetypeIds[self.index]]
+
+	@filetype.setter
+	def filetype(self, filetype):
+		filetypeId = self.table.filetypeId(filetype)
+		if self.table.filetypeIds[self.index] != filetypeId:
+			self.table.filetypeIds[self.index] = filetypeId
+			self.table.dirty = True
+
+	def __len__(self):
+		return self.table.ends[self.index] - self.table.starts[self.index]
+
+	length = property(__len__)
+
+	def __eq__(self, other):
+		if not isinstance(other, (SectionView, FirmwareSection)):
+			return NotImplemented
+		return (self.bounds == tuple(other.bounds) and
+				self.filetype == other.filetype)
+
+	# Views change with their table, so can't be hashed by value
+	__hash__ = None
+
+	def _toDict(self):
+		return FirmwareSection._toDict(self)
 
 class FirmwareSection:
 
@@ -131,7 +1037,9 @@ class FirmwareSection:
 			length - the number of bytes in the segment, it's (end-start)
 			filetype - a string specifying the filetype
 		"""
-		
+
+	__slots__ = ("bounds", "filetype")
+
 	def __init__(self, sectionDef):
 		self.bounds = (0,0)
 		self.filetype = ""
@@ -164,49 +1072,89 @@ class TrainingCorpus(Corpus):
 			nValue - the n value specified in the corpus description
 			filetypeDefinitions - a list of FileType objects, with info about each
 				filetype in the training corpus
+
+		Public Functions:
+			TrainingCorpus.iterFileTypes(filename) - yield each FileType in a
+				config file as it is read, without loading the whole corpus
 		"""
 
+	_definitionsKey = "Filetype Definitions"
+	_definitionsBrackets = (b"{", b"}")
+
 	def __init__(self, name="", description="", nValue=1, filename=None):
 		"""Construct a training corpus
 			Supply filename if you wish to load from a file
 			Otherwise, name each parameter
 			"""
+		super(TrainingCorpus, self).__init__()
 		self.name = name
 		self.description = description
 		self.nValue = nValue
 		self.filetypeDefinitions = list()
 
 		if filename is not None:
-			# Load the configuration
-			config = dict()
-			with open(filename, 'r') as trainingConfigFile:
-				config = json.load(trainingConfigFile)
-
-			# Separate out the important parts for ease
-			if "Description" in config:
-				self.description = config["Description"]
-			if "Name" in config:
-				self.name = config["Name"]
-			if "n Value" in config:
-				self.nValue = config["n Value"]
-			if "Filetype Definitions" in config:
-				for ftDefKey in config["Filetype Definitions"]:
-					ftDef = config["Filetype Definitions"][ftDefKey]
-					self.appendFileType(ftDef)
+			# Load the configuration, separating out the important parts
+			editLog = _readEditLog(filename)
+			for key, value in Instrumentation.timedIter("Corpus Load",
+					_iterConfig(filename, "Filetype Definitions", editLog)):
+				if key == "Description":
+					self.description = value
+				elif key == "Name":
+					self.name = value
+				elif key == "n Value":
+					self.nValue = value
+				elif key == "Filetype Definitions":
+					self.appendFileType(value)
+			self._markSaved(filename, editLog[2])
+
+	@staticmethod
+	def iterFileTypes(filename):
+		"""Yield each FileType defined in a training corpus config, as it is
+			read."""
+		with contextlib.closing(_iterConfig(filename,
+				"Filetype Definitions")) as items:
+			for key, value in Instrumentation.timedIter("Corpus Load", items):
+				if key == "Filetype Definitions":
+					yield FileType(value)
 
 	def _toDict(self):
 		"""Return a dictionary representation of the training corpus."""
+		outputDict = self._headerDict()
+		outputDict["Filetype Definitions"] = dict(self._keyedDefinitionDicts())
+		return outputDict
+
+	def _headerDict(self):
 		outputDict = dict()
 		outputDict["Name"] = self.name
 		outputDict["Description"] = self.description
 		outputDict["n Value"] = self.nValue
-		
-		ftDefs = dict()
+		return outputDict
+
+	def snapshot(self):
+		"""Return a copy of the corpus and its filetypes."""
+		corpus = TrainingCorpus(self.name, self.description, self.nValue)
+		corpus.filetypeDefinitions = [filetype.copy()
+				for filetype in self.filetypeDefinitions]
+		return corpus
+
+	def _definitions(self):
+		return self.filetypeDefinitions
+
+	def _identity(self, filetype):
+		return filetype.name
+
+	def _definitionDicts(self):
 		for ftDef in self.filetypeDefinitions:
-			ftDefs[ftDef.name] = ftDef._toDict()
+			yield ftDef._toDict()
 
-		outputDict["Filetype Definitions"] = ftDefs
-		return outputDict
+	def _keyedDefinitionDicts(self):
+		# Filetypes are keyed by name, so a later filetype of the same name
+		# replaces an earlier one, in its place
+		byName = dict()
+		for ftDef in self.filetypeDefinitions:
+			byName[ftDef.name] = ftDef
+		for name, ftDef in byName.items():
+			yield name, ftDef._toDict()
 
 	def appendFileType(self, filetype):
 		"""Append a filetype to the corpus.
@@ -219,16 +1167,27 @@ class TrainingCorpus(Corpus):
 		else:
 			self.filetypeDefinitions.append(FileType(filetype))
 	
-class FileType:
+class FileType(_Tracked):
 
 	"""
 		FileType stores the configuration for a single training corpus file type.
 
+		Setting a parameter, or appending a training file, marks the filetype
+		dirty until it is saved.  Call markDirty after changing files any other
+		way.
+
 		Public parameters:
 			name - the name of the filetype
 			filetypeFile - the file in which to store the filetype classification data
 			ignoreExisting - whether to overwrite the existing file when training
 			files - a list of TrainingFile objects, tracking each file in the type
+
+		Public Functions:
+			FileType.isDirty() - return whether the filetype changed since it
+				was loaded or saved
+			FileType.markDirty() - mark the filetype changed
+			FileType.markClean() - mark the filetype unchanged
+			FileType.copy() - return a copy of the filetype and its files
 		"""
 
 	def __init__(self, filetypeDef):
@@ -277,6 +1236,20 @@ class FileType:
 			self.files.append(trainingFile)
 		else:
 			self.files.append(TrainingFile(trainingFile))
+		self._changed = True
+
+	def markDirty(self):
+		"""Mark the filetype changed, as after editing its files in place."""
+		self._changed = True
+
+	def copy(self):
+		"""Return a copy of the filetype and its files."""
+		filetype = FileType({"Name": self.name,
+				"Filetype File": self.filetypeFile,
+				"Ignore Existing": self.ignoreExisting})
+		for trainingFile in self.files:
+			filetype.appendTrainingFile(trainingFile.filename)
+		return filetype
 
 class TrainingFile:
 
@@ -287,6 +1260,8 @@ class TrainingFile:
 			filename - the filename for the training file
 		"""
 
+	__slots__ = ("filename",)
+
 	def __init__(self, filename=""):
 		self.filename = filename
 
@@ -0,0 +1,413 @@
+#!/usr/bin/env python3
+
+import argparse
+import itertools
+import json
+import os
+import sqlite3
+import urllib.parse
+
+import Corpus
+
+# Corpus files with these extensions are SQLite databases
+SQLITE_EXTENSIONS = (".sqlite", ".sqlite3", ".db")
+
+# Rows are inserted this many at a time
+BATCH_SIZE = 10000
+
+class CorpusStore:
+
+	"""
+		A superclass for corpus storage backends other than JSON configs.
+
+		A store reads and writes a corpus as the dictionaries the JSON configs
+		hold: a header of corpus settings, and a definition per firmware or
+		filetype.  Corpus.writeOut, Corpus.save and the corpus loaders use the
+		store registered in STORES for a filename's extension, so a corpus can
+		be kept in any backend just by its filename.
+
+		Public Functions:
+			CorpusStore.write(definitionsKey, header, definitions) - replace the
+				stored corpus
+			CorpusStore.applyEdits(definitionsKey, records) - apply the records
+				Corpus.save would put in an edit log
+			CorpusStore.iterConfig(definitionsKey) - yield (key, value) pairs as
+				a config file's reader does
+			CorpusStore.close() - release the store
+		"""
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, excType, excValue, traceback):
+		self.close()
+		return False
+
+	def write(self, definitionsKey, header, definitions):
+		raise NotImplementedError("CorpusStore must be inherited.")
+
+	def applyEdits(self, definitionsKey, records):
+		raise NotImplementedError("CorpusStore must be inherited.")
+
+	def iterConfig(self, definitionsKey):
+		raise NotImplementedError("CorpusStore must be inherited.")
+
+	def close(self):
+		pass
+
+class SQLiteStore(CorpusStore):
+
+	"""
+		SQLiteStore keeps a test or training corpus in an SQLite database, with
+		a table each for the firmware, their sections, the filetypes and their
+		training files, and indexes on filenames, section filetypes and lengths,
+		and section bounds.
+
+		Writes are batched within one transaction.  Definitions keep the order
+		they were written in, and an edited definition keeps its place, so
+		reading the corpus back gives what was written.  Queries run in the
+		database, without loading the corpus.
+
+		A store opened read-only never creates or changes the database, so a
+		mistyped filename raises FileNotFoundError rather than leaving an empty
+		database behind.  The kind of corpus written is kept in the header
+		table, so an empty training corpus reads back as one.
+
+		Public parameters:
+			filename - the database file
+			connection - the sqlite3 connection
+
+		Public Functions:
+			SQLiteStore.kind() - return the definitions key of the corpus stored
+			SQLiteStore.sectionsOfType(filetype, minLength) - return the
+				(filename, start, end) of each section of a filetype at least
+				minLength bytes long
+			SQLiteStore.sectionsIn(filename, start, end) - return the (start,
+				end, filetype) of each section of a firmware overlapping [start,
+				end)
+			SQLiteStore.firmware(filename) - return the definition of the
+				firmware at filename, or None
+			SQLiteStore.filetypesOf(filename) - return the names of the
+				filetypes a training file belongs to
+		"""
+
+	_SCHEMA = """
+		CREATE TABLE IF NOT EXISTS header (
+			key TEXT PRIMARY KEY,
+			value TEXT NOT NULL);
+		CREATE TABLE IF NOT EXISTS firmware (
+			id INTEGER PRIMARY KEY,
+			name TEXT NOT NULL,
+			filename TEXT NOT NULL);
+		CREATE INDEX IF NOT EXISTS firmware_filename ON firmware (filename);
+		CREATE TABLE IF NOT EXISTS sections (
+			firmware_id INTEGER NOT NULL REFERENCES firmware (id),
+			start_offset INTEGER NOT NULL,
+			end_offset INTEGER NOT NULL,
+			filetype TEXT NOT NULL);
+		CREATE INDEX IF NOT EXISTS sections_bounds
+			ON sections (firmware_id, start_offset, end_offset);
+		CREATE INDEX IF NOT EXISTS sections_filetype_length
+			ON sections (filetype, (end_offset - start_offset));
+		CREATE TABLE IF NOT EXISTS filetypes (
+			id INTEGER PRIMARY KEY,
+			name TEXT NOT NULL,
+			filetype_file TEXT NOT NULL,
+			ignore_existing INTEGER NOT NULL);
+		CREATE INDEX IF NOT EXISTS filetypes_name ON filetypes (name);
+		CREATE TABLE IF NOT EXISTS training_files (
+			filetype_id INTEGER NOT NULL REFERENCES filetypes (id),
+			filename TEXT NOT NULL);
+		CREATE INDEX IF NOT EXISTS training_files_filetype
+			ON training_files (filetype_id);
+		CREATE INDEX IF NOT EXISTS training_files_filename
+			ON training_files (filename);
+		"""
+
+	# The header key the definitions key of the corpus is kept under
+	_KIND_KEY = "Definitions Key"
+
+	def __init__(self, filename, readOnly=False):
+		self.filename = filename
+		if readOnly:
+			if not os.path.exists(filename):
+				raise FileNotFoundError("No such corpus database: " + filename)
+			self.connection = sqlite3.connect("file:%s?mode=ro" %
+					urllib.parse.quote(os.path.abspath(filename)), uri=True)
+		else:
+			self.connection = sqlite3.connect(filename)
+			self.connection.executescript(self._SCHEMA)
+
+	def close(self):
+		self.connection.close()
+
+	def kind(self):
+		"""Return the definitions key of the corpus stored: "Filetype
+			Definitions" for a training corpus, or "Firmware Definitions"."""
+		row = self.connection.execute("SELECT value FROM header WHERE key = ?",
+				(self._KIND_KEY,)).fetchone()
+		if row is not None:
+			return json.loads(row[0])
+		# Written before the kind was kept, so judged by what's stored
+		if self.connection.execute("SELECT 1 FROM filetypes LIMIT 1").fetchone():
+			return "Filetype Definitions"
+		return "Firmware Definitions"
+
+	def write(self, definitionsKey, header, definitions):
+		"""Replace the stored corpus, in one transaction.
+
+			definitions may be any iterable of definition dictionaries.  header
+			is written after them, so it may be filled in as they are read.
+			"""
+		with self.connection:
+			for table in ("header", "sections", "firmware", "training_files",
+					"filetypes"):
+				self.connection.execute("DELETE FROM " + table)
+			definitions = iter(definitions)
+			nextId = 1
+			while True:
+				batch = list(itertools.islice(definitions, BATCH_SIZE))
+				if len(batch) == 0:
+					break
+				ids = range(nextId, nextId + len(batch))
+				self._insert(definitionsKey, ids, batch)
+				nextId += len(batch)
+			self._writeHeader(header)
+			self._writeHeader({self._KIND_KEY: definitionsKey})
+
+	def _insert(self, definitionsKey, ids, definitions):
+		"""Insert definitions with the given ids, and their sections or files."""
+		if definitionsKey == "Firmware Definitions":
+			self.connection.executemany("INSERT INTO firmware VALUES (?, ?, ?)",
+					[(definitionId, definition.get("Name", ""),
+					definition.get("Filename", ""))
+					for definitionId, definition in zip(ids, definitions)])
+			self.connection.executemany(
+					"INSERT INTO sections VALUES (?, ?, ?, ?)",
+					[(definitionId, section.get("Start", 0), section.get("End", 0),
+					section.get("Filetype", ""))
+					for definitionId, definition in zip(ids, definitions)
+					for section in definition.get("Sections", ())])
+		else:
+			self.connection.executemany(
+					"INSERT INTO filetypes VALUES (?, ?, ?, ?)",
+					[(definitionId, definition.get("Name", ""),
+					definition.get("Filetype File", ""),
+					bool(definition.get("Ignore Existing", False)))
+					for definitionId, definition in zip(ids, definitions)])
+			self.connection.executemany(
+					"INSERT INTO training_files VALUES (?, ?)",
+					[(definitionId, filename)
+					for definitionId, definition in zip(ids, definitions)
+					for filename in definition.get("Files", ())])
+
+	def _writeHeader(self, header):
+		self.connection.executemany("INSERT OR REPLACE INTO header VALUES (?, ?)",
+				[(key, json.dumps(value)) for key, value in header.items()])
+
+	def applyEdits(self, definitionsKey, records):
+		"""Apply edit log records, as Corpus.save makes, in one transaction.
+
+			An edited definition is updated where it is, and a new one is added
+			at the end.
+			"""
+		if definitionsKey == "Firmware Definitions":
+			table, identityColumn, childTable, childKey = ("firmware", "filename",
+					"sections", "firmware_id")
+		else:
+			table, identityColumn, childTable, childKey = ("filetypes", "name",
+					"training_files", "filetype_id")
+		with self.connection:
+			for record in records:
+				if "Header" in record:
+					self._writeHeader(record["Header"])
+					continue
+				identity = record.get("Removed", record.get("Identity"))
+				ids = [row[0] for row in self.connection.execute(
+						"SELECT id FROM %s WHERE %s = ?" % (table, identityColumn),
+						(identity,))]
+				for definitionId in ids:
+					self.connection.execute("DELETE FROM %s WHERE %s = ?" %
+							(childTable, childKey), (definitionId,))
+					self.connection.execute("DELETE FROM %s WHERE id = ?" % table,
+							(definitionId,))
+				if "Definition" in record:
+					if len(ids) == 0:
+						ids = [self.connection.execute("SELECT COALESCE(MAX(id), 0) "
+								"+ 1 FROM %s" % table).fetchone()[0]]
+					self._insert(definitionsKey, ids[:1], [record["Definition"]])
+
+	def iterConfig(self, definitionsKey):
+		"""Yield (key, value) pairs, as the config file reader does: each
+			header entry, then each definition as it is read."""
+		for key, value in self.connection.execute(
+				"SELECT key, value FROM header WHERE key != ?",
+				(self._KIND_KEY,)).fetchall():
+			yield key, json.loads(value)
+		# Children are read in order alongside their parents, so the corpus
+		# is never all in memory
+		if definitionsKey == "Firmware Definitions":
+			parents = self.connection.execute(
+					"SELECT id, name, filename FROM firmware ORDER BY id")
+			children = self.connection.execute(
+					"SELECT firmware_id, start_offset, end_offset, filetype "
+					"FROM sections ORDER BY firmware_id, rowid")
+		else:
+			parents = self.connection.execute("SELECT id, name, filetype_file, "
+					"ignore_existing FROM filetypes ORDER BY id")
+			children = self.connection.execute("SELECT filetype_id, filename "
+					"FROM training_files ORDER BY filetype_id, rowid")
+		try:
+			yield from self._iterDefinitions(definitionsKey, parents, children)
+		finally:
+			# Closed with the generator, even if it's only partly read
+			parents.close()
+			children.close()
+
+	@staticmethod
+	def _iterDefinitions(definitionsKey, parents, children):
+		"""Yield a (definitionsKey, definition) pair per parent row, with its
+			rows of children."""
+		childGroups = itertools.groupby(children, key=lambda row: row[0])
+		childId, childRows = next(childGroups, (None, ()))
+		for parent in parents:
+			rows = ()
+			# Skip the children of parents since removed, if any remain
+			while childId is not None and childId < parent[0]:
+				childId, childRows = next(childGroups, (None, ()))
+			if childId == parent[0]:
+				# The rows must be read before the group moves on
+				rows = list(childRows)
+				childId, childRows = next(childGroups, (None, ()))
+			if definitionsKey == "Firmware Definitions":
+				sections = [{"Start": row[1], "End": row[2], "Filetype": row[3]}
+						for row in rows]
+				yield definitionsKey, {"Name": parent[1], "Filename": parent[2],
+						"Sections": sections}
+			else:
+				files = [row[1] for row in rows]
+				yield definitionsKey, {"Name": parent[1],
+						"Filetype File": parent[2],
+						"Ignore Existing": bool(parent[3]), "Files": files}
+
+	def sectionsOfType(self, filetype, minLength=0):
+		"""Return the (filename, start, end) of each section of a filetype at
+			least minLength bytes long."""
+		return self.connection.execute(
+				"SELECT firmware.filename, start_offset, end_offset FROM sections "
+				"JOIN firmware ON firmware.id = sections.firmware_id "
+				"WHERE sections.filetype = ? "
+				"AND (end_offset - start_offset) >= ?", (filetype, minLength)
+				).fetchall()
+
+	def sectionsIn(self, filename, start, end):
+		"""Return the (start, end, filetype) of each section of the firmware at
+			filename that overlaps [start, end), in order."""
+		return self.connection.execute(
+				"SELECT start_offset, end_offset, sections.filetype FROM sections "
+				"JOIN firmware ON firmware.id = sections.firmware_id "
+				"WHERE firmware.filename = ? AND start_offset < ? "
+				"AND end_offset > ? ORDER BY start_offset", (filename, end, start)
+				).fetchall()
+
+	def firmware(self, filename):
+		"""Return the definition of the firmware at filename, or None."""
+		row = self.connection.execute("SELECT id, name FROM firmware "
+				"WHERE filename = ? ORDER BY id LIMIT 1", (filename,)).fetchone()
+		if row is None:
+			return None
+		sections = [{"Start": start, "End": end, "Filetype": filetype}
+				for start, end, filetype in self.connection.execute(
+				"SELECT start_offset, end_offset, filetype FROM sections "
+				"WHERE firmware_id = ? ORDER BY rowid", (row[0],))]
+		return {"Name": row[1], "Filename": filename, "Sections": sections}
+
+	def filetypesOf(self, filename):
+		"""Return the names of the filetypes that have filename as a training
+			file."""
+		return [row[0] for row in self.connection.execute(
+				"SELECT DISTINCT filetypes.name FROM training_files "
+				"JOIN filetypes ON filetypes.id = training_files.filetype_id "
+				"WHERE training_files.filename = ?", (filename,))]
+
+# The store class for each extension, checked in order
+STORES = [(SQLITE_EXTENSIONS, SQLiteStore)]
+
+def storeClassFor(filename):
+	"""Return the store class for filename, or None if it's a JSON config."""
+	for extensions, storeClass in STORES:
+		if filename.endswith(extensions):
+			return storeClass
+	return None
+
+def storeFor(filename, readOnly=False):
+	"""Return an open store for filename, or None if it's a JSON config.
+
+		A store opened readOnly must already exist, and is never changed.
+		"""
+	storeClass = storeClassFor(filename)
+	if storeClass is None:
+		return None
+	return storeClass(filename, readOnly)
+
+def importConfig(configFilename, storeFilename, definitionsKey):
+	"""Copy a JSON config into a store, reading it as it goes."""
+	header = dict()
+
+	def definitions():
+		for key, value in Corpus._iterConfig(configFilename, definitionsKey):
+			if key == definitionsKey:
+				yield value
+			else:
+				header[key] = value
+
+	with storeFor(storeFilename) as store:
+		store.write(definitionsKey, header, definitions())
+
+def exportConfig(storeFilename, configFilename):
+	"""Write the corpus in a store out as a JSON config."""
+	with storeFor(storeFilename, readOnly=True) as store:
+		kind = store.kind()
+	if kind == "Filetype Definitions":
+		corpus = Corpus.TrainingCorpus(filename=storeFilename)
+	else:
+		corpus = Corpus.TestCorpus(filename=storeFilename)
+	corpus.writeOut(configFilename)
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(
+			description="Move corpora between JSON configs and SQLite databases, " +
+			"and query them.")
+	subparsers = parser.add_subparsers(dest="command", required=True)
+	importParser = subparsers.add_parser("import",
+			help="copy a JSON config into a database")
+	importParser.add_argument("config", help="the corpus config to read")
+	importParser.add_argument("database", help="the database to write, " +
+			"ending in one of " + ", ".join(SQLITE_EXTENSIONS))
+	importParser.add_argument("--training", action="store_true",
+			help="the config is a training corpus, not a test corpus")
+	exportParser = subparsers.add_parser("export",
+			help="write a database out as a JSON config")
+	exportParser.add_argument("database", help="the database to read")
+	exportParser.add_argument("config", help="the corpus config to write")
+	sectionsParser = subparsers.add_parser("sections",
+			help="list the sections of a filetype")
+	sectionsParser.add_argument("database", help="the database to query")
+	sectionsParser.add_argument("filetype", help="the section filetype")
+	sectionsParser.add_argument("--min-length", type=int, default=0,
+			help="only list sections at least this many bytes long")
+	args = parser.parse_args(argv)
+
+	if args.command == "import":
+		importConfig(args.config, args.database, "Filetype Definitions"
+				if args.training else "Firmware Definitions")
+	elif args.command == "export":
+		exportConfig(args.database, args.config)
+	else:
+		with storeFor(args.database, readOnly=True) as store:
+			for filename, start, end in store.sectionsOfType(args.filetype,
+					args.min_length):
+				print("%s\t%d\t%d" % (filename, start, end))
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,321 @@
+#!/usr/bin/env python3
+
+import argparse
+import csv
+import json
+import os
+
+import numpy
+
+import Instrumentation
+from Corpus import TestCorpus
+
+# The predicted filetype of bytes no prediction covers.  Not a string, so it
+# can't be taken for a filetype, not even the default filetype ""
+NO_PREDICTION = None
+
+def _firmwareKey(filename):
+	"""Return the key predictions and ground truth are matched on."""
+	return os.path.realpath(filename)
+
+def _columns(sections):
+	"""Return the starts, ends and filetypes of a Firmware's sections."""
+	starts = numpy.frombuffer(sections.starts, dtype=numpy.uint64).astype(
+			numpy.int64)
+	ends = numpy.frombuffer(sections.ends, dtype=numpy.uint64).astype(numpy.int64)
+	filetypeIds = numpy.frombuffer(sections.filetypeIds, dtype=numpy.uint32)
+	filetypes = [sections.filetypes[i] for i in filetypeIds.tolist()]
+	return starts, ends, filetypes
+
+def loadPredictions(filename):
+	"""Return the predicted sections in a file, by firmware.
+
+		The file may be Tester output, with a line of JSON per classified
+		section, or a test corpus config such as the Segmenter writes.  The
+		result maps the real path of each firmware image to a tuple of numpy
+		arrays of the starts and ends of its sections, and a list of their
+		predicted filetypes.
+		"""
+	with open(filename, "r") as inputFile:
+		firstLine = inputFile.readline()
+	try:
+		first = json.loads(firstLine)
+	except ValueError:
+		first = None
+	predictions = dict()
+	if isinstance(first, dict) and "Classification" in first:
+		byFirmware = dict()
+		with open(filename, "r") as inputFile:
+			for line in inputFile:
+				if line.strip() == "":
+					continue
+				result = json.loads(line)
+				sections = byFirmware.setdefault(_firmwareKey(result["Filename"]),
+						(list(), list(), list()))
+				sections[0].append(result["Start"])
+				sections[1].append(result["End"])
+				sections[2].append(result["Classification"])
+		for key, (starts, ends, filetypes) in byFirmware.items():
+			predictions[key] = (numpy.array(starts, dtype=numpy.int64),
+					numpy.array(ends, dtype=numpy.int64), filetypes)
+	else:
+		for firmware in TestCorpus.iterFirmware(filename):
+			predictions[_firmwareKey(firmware.filename)] = _columns(
+					firmware.sections)
+	return predictions
+
+def _cover(starts, ends, offsets):
+	"""Return the index of the interval containing each offset, or -1.
+
+		Raises ValueError if any of the non-empty intervals [starts, ends)
+		overlap, as an offset could then be in more than one.
+		"""
+	order = numpy.flatnonzero(ends > starts)
+	if len(order) == 0:
+		return numpy.full(len(offsets), -1, dtype=numpy.int64)
+	order = order[numpy.argsort(starts[order], kind="stable")]
+	if numpy.any(ends[order[:-1]] > starts[order[1:]]):
+		raise ValueError("The intervals overlap")
+	position = numpy.searchsorted(starts[order], offsets, side="right") - 1
+	index = order[numpy.maximum(position, 0)]
+	covered = (position >= 0) & (ends[index] > offsets)
+	return numpy.where(covered, index, -1)
+
+class Evaluation:
+
+	"""
+		Evaluation scores predicted sections against the true sections of a
+		test corpus, weighting every section by its length in bytes.
+
+		The boundaries of the true and predicted sections of a firmware split
+		it into pieces that lie within at most one true and one predicted
+		section each.  Every piece is labelled by a search over the sorted
+		section starts, and its length is added to the confusion matrix.  Bytes
+		outside any true section aren't scored, and scored bytes outside any
+		predicted section are predicted as NO_PREDICTION, which has a name and
+		column of its own but no figures.  Firmware whose true or predicted
+		sections overlap can't be scored.
+
+		Public parameters:
+			names - the filetype names, in the order of the confusion matrix
+			confusion - bytes of each true filetype (row) predicted as each
+				filetype (column)
+			sectionsCorrect - the number of true sections whose bytes were mostly
+				predicted as their own filetype
+			sectionsTotal - the number of non-empty true sections scored
+			unpredictedBytes - the number of scored bytes without a prediction
+
+		Public Functions:
+			Evaluation.addFirmware(firmware, predicted) - score the predicted
+				(starts, ends, filetypes) of a firmware against its sections
+			Evaluation.byteAccuracy() - the fraction of bytes predicted right
+			Evaluation.precision() - the byte precision of each filetype
+			Evaluation.recall() - the byte recall of each filetype
+			Evaluation.report() - return a JSON-serializable report
+			Evaluation.writeJSON(filename) - write the report as JSON
+			Evaluation.writeCSV(filename) - write per-filetype figures as CSV
+		"""
+
+	def __init__(self):
+		self.names = list()
+		self.confusion = numpy.zeros((0, 0), dtype=numpy.int64)
+		self.sectionsCorrect = 0
+		self.sectionsTotal = 0
+		self._nameIds = dict()
+
+	@property
+	def unpredictedBytes(self):
+		"""The number of scored bytes predicted as NO_PREDICTION."""
+		if NO_PREDICTION not in self._nameIds:
+			return 0
+		return int(self.confusion[:, self._nameIds[NO_PREDICTION]].sum())
+
+	def _addNames(self, names):
+		"""Add any new names, growing the confusion matrix to match."""
+		for name in names:
+			if name not in self._nameIds:
+				self._nameIds[name] = len(self.names)
+				self.names.append(name)
+		if len(self.names) > len(self.confusion):
+			grown = numpy.zeros((len(self.names), len(self.names)),
+					dtype=numpy.int64)
+			grown[:len(self.confusion), :len(self.confusion)] = self.confusion
+			self.confusion = grown
+
+	def _nameIdsOf(self, filetypes):
+		"""Return an array of the name id of each filetype, adding new names."""
+		unique, inverse = numpy.unique(numpy.array(filetypes, dtype=object),
+				return_inverse=True)
+		self._addNames(unique.tolist())
+		ids = numpy.array([self._nameIds[name] for name in unique.tolist()],
+				dtype=numpy.int64)
+		return ids[inverse.reshape(-1)]
+
+	def addFirmware(self, firmware, predicted):
+		"""Score predicted sections against a Firmware's true sections.
+
+			predicted is a tuple of the starts and ends of the predicted
+			sections, as numpy arrays, and a list of their filetypes, as
+			loadPredictions returns.
+			"""
+		with Instrumentation.stage("Evaluate"):
+			self._addFirmware(firmware, predicted)
+
+	def _addFirmware(self, firmware, predicted):
+		trueStarts, trueEnds, trueTypes = _columns(firmware.sections)
+		nonEmpty = trueEnds > trueStarts
+		trueStarts = trueStarts[nonEmpty]
+		trueEnds = trueEnds[nonEmpty]
+		trueTypes = [filetype for filetype, keep
+				in zip(trueTypes, nonEmpty.tolist()) if keep]
+		if len(trueStarts) == 0:
+			return
+		predStarts, predEnds, predTypes = predicted
+
+		# Cut the firmware at every boundary, and label the pieces
+		points = numpy.unique(numpy.concatenate((trueStarts, trueEnds,
+				predStarts, predEnds)))
+		lengths = numpy.diff(points)
+		try:
+			trueIndex = _cover(trueStarts, trueEnds, points[:-1])
+		except ValueError:
+			raise ValueError("The sections of firmware %s overlap, so it can't "
+					"be scored" % firmware.name)
+		scored = trueIndex >= 0
+		trueIndex = trueIndex[scored]
+		lengths = lengths[scored]
+		try:
+			predIndex = _cover(predStarts, predEnds, points[:-1][scored])
+		except ValueError:
+			raise ValueError("The predicted sections of firmware %s overlap, so "
+					"it can't be scored" % firmware.name)
+		trueIds = self._nameIdsOf(trueTypes)
+		predIds = self._nameIdsOf(predTypes)
+		if numpy.any(predIndex < 0):
+			self._addNames([NO_PREDICTION])
+			predIndex[predIndex < 0] = len(predIds)
+			predIds = numpy.append(predIds, self._nameIds[NO_PREDICTION])
+		pieceTrue = trueIds[trueIndex]
+		piecePred = predIds[predIndex]
+
+		size = len(self.names)
+		self.confusion += numpy.bincount(pieceTrue * size + piecePred,
+				weights=lengths, minlength=size * size).astype(
+				numpy.int64).reshape(size, size)
+
+		# Each true section's majority prediction
+		sectionVotes = numpy.bincount(trueIndex * size + piecePred,
+				weights=lengths, minlength=len(trueIds) * size).reshape(
+				len(trueIds), size)
+		self.sectionsCorrect += int(numpy.count_nonzero(
+				numpy.argmax(sectionVotes, axis=1) == trueIds))
+		self.sectionsTotal += len(trueIds)
+
+	def byteAccuracy(self):
+		"""Return the fraction of scored bytes predicted as their filetype."""
+		total = self.confusion.sum()
+		if total == 0:
+			return 0.0
+		return float(numpy.trace(self.confusion) / total)
+
+	@staticmethod
+	def _ratio(numerators, denominators):
+		ratios = numpy.zeros(len(numerators))
+		nonZero = denominators > 0
+		ratios[nonZero] = numerators[nonZero] / denominators[nonZero]
+		return ratios
+
+	def precision(self):
+		"""Return the byte precision of each filetype, in the order of names."""
+		return self._ratio(numpy.diag(self.confusion), self.confusion.sum(axis=0))
+
+	def recall(self):
+		"""Return the byte recall of each filetype, in the order of names."""
+		return self._ratio(numpy.diag(self.confusion), self.confusion.sum(axis=1))
+
+	def _perFiletype(self):
+		"""Yield the index, name, bytes, precision, recall and F1 of each
+			filetype, leaving out NO_PREDICTION."""
+		precision = self.precision()
+		recall = self.recall()
+		f1 = self._ratio(2 * precision * recall, precision + recall)
+		trueBytes = self.confusion.sum(axis=1)
+		for i, name in enumerate(self.names):
+			if name is not NO_PREDICTION:
+				yield (i, name, int(trueBytes[i]), float(precision[i]),
+						float(recall[i]), float(f1[i]))
+
+	def report(self):
+		"""Return a JSON-serializable dictionary of the results."""
+		report = dict()
+		report["Filetypes"] = list(self.names)
+		report["Confusion Matrix"] = self.confusion.tolist()
+		report["Bytes"] = int(self.confusion.sum())
+		report["Byte Accuracy"] = self.byteAccuracy()
+		report["Unpredicted Bytes"] = self.unpredictedBytes
+		report["Sections"] = self.sectionsTotal
+		report["Section Accuracy"] = (self.sectionsCorrect / self.sectionsTotal
+				if self.sectionsTotal > 0 else 0.0)
+		perFiletype = dict()
+		for _, name, trueBytes, precision, recall, f1 in self._perFiletype():
+			perFiletype[name] = {"Bytes": trueBytes, "Precision": precision,
+					"Recall": recall, "F1": f1}
+		report["Per Filetype"] = perFiletype
+		return report
+
+	def writeJSON(self, filename):
+		"""Write the report out as JSON."""
+		with open(filename, "w") as outputFile:
+			json.dump(self.report(), outputFile, indent=2)
+
+	def writeCSV(self, filename):
+		"""Write a row per true filetype: its figures, then its confusion row."""
+		with open(filename, "w", newline="") as outputFile:
+			writer = csv.writer(outputFile)
+			writer.writerow(["Filetype", "Bytes", "Precision", "Recall", "F1"] +
+					["Unpredicted" if name is NO_PREDICTION else "Predicted " + name
+					for name in self.names])
+			for row in self._perFiletype():
+				writer.writerow(list(row[1:]) + self.confusion[row[0]].tolist())
+
+def evaluate(testCorpus, predictions):
+	"""Return an Evaluation of predictions against a TestCorpus.
+
+		predictions is as loadPredictions returns.  Firmware with no
+		predictions count as wholly unpredicted.
+		"""
+	evaluation = Evaluation()
+	nothing = (numpy.zeros(0, dtype=numpy.int64),
+			numpy.zeros(0, dtype=numpy.int64), list())
+	for firmware in testCorpus.firmwareDefinitions:
+		evaluation.addFirmware(firmware, predictions.get(
+				_firmwareKey(firmware.filename), nothing))
+	return evaluation
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(
+			description="Score predicted sections against a test corpus.")
+	parser.add_argument("testCorpus", help="the ground truth test corpus config")
+	parser.add_argument("predictions",
+			help="Tester output, or a test corpus config of proposed sections")
+	parser.add_argument("--json", help="file to write the JSON report to")
+	parser.add_argument("--csv", help="file to write the CSV report to")
+	Instrumentation.addArguments(parser)
+	args = parser.parse_args(argv)
+
+	with Instrumentation.session(args):
+		try:
+			evaluation = evaluate(TestCorpus(filename=args.testCorpus),
+					loadPredictions(args.predictions))
+		except ValueError as exception:
+			parser.error(str(exception))
+	if args.json is not None:
+		evaluation.writeJSON(args.json)
+	if args.csv is not None:
+		evaluation.writeCSV(args.csv)
+	print("Byte accuracy %.4f over %d bytes, section accuracy %.4f over %d "
+			"sections" % (evaluation.byteAccuracy(), evaluation.confusion.sum(),
+			evaluation.report()["Section Accuracy"], evaluation.sectionsTotal))
+
+if __name__ == "__main__":
+	main()
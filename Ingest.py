@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+
+import argparse
+import collections
+import hashlib
+import json
+import os
+
+import numpy
+
+from Corpus import TestCorpus
+from SectionReader import FirmwareReader, ReaderCache
+
+# Files are hashed this many bytes at a time
+HASH_CHUNK_SIZE = 1024 * 1024
+# Content-defined chunks average 2**CHUNK_BITS bytes
+CHUNK_BITS = 13
+# The rolling hash covers this many bytes, one bit of the hash per byte
+_ROLLING_WINDOW = 32
+# Rolling hashes are computed this many at a time
+_SCAN_BYTES = 1 << 20
+# The random value each byte contributes to the rolling hash
+_GEAR = numpy.random.RandomState(0x5eed).randint(0, 1 << 32, 256,
+		dtype=numpy.uint64).astype(numpy.uint32)
+
+def hashFile(filename, progressCallback=None):
+	"""Return the hex SHA-256 of a file's contents.
+
+		progressCallback, if given, is called with the bytes hashed so far and
+		the file size after each chunk.  An exception it raises stops hashing.
+		"""
+	hasher = hashlib.sha256()
+	buf = bytearray(HASH_CHUNK_SIZE)
+	view = memoryview(buf)
+	hashed = 0
+	try:
+		with open(filename, "rb") as inputFile:
+			fileSize = os.fstat(inputFile.fileno()).st_size
+			while True:
+				size = inputFile.readinto(buf)
+				if size == 0:
+					break
+				hasher.update(view[:size])
+				hashed += size
+				if progressCallback is not None:
+					progressCallback(hashed, fileSize)
+	finally:
+		view.release()
+	return hasher.hexdigest()
+
+def _candidates(buf, chunkBits):
+	"""Yield the chunk ends whose window hashes to zero in its low chunkBits
+		bits, a block of _SCAN_BYTES ends at a time, so that the temporaries
+		stay small however large buf is."""
+	size = len(buf)
+	mask = numpy.uint32((1 << chunkBits) - 1)
+	rolling = numpy.empty(_SCAN_BYTES, dtype=numpy.uint32)
+	gears = numpy.empty(_SCAN_BYTES, dtype=numpy.uint32)
+	for blockStart in range(_ROLLING_WINDOW, size + 1, _SCAN_BYTES):
+		blockEnd = min(blockStart + _SCAN_BYTES, size + 1)
+		blockRolling = rolling[:blockEnd - blockStart]
+		blockGears = gears[:blockEnd - blockStart]
+		# blockRolling[i] is the hash of the window ending before byte
+		# blockStart + i, with the byte age places back shifted by age
+		blockRolling.fill(0)
+		for age in range(_ROLLING_WINDOW):
+			numpy.take(_GEAR, buf[blockStart - 1 - age:blockEnd - 1 - age],
+					out=blockGears)
+			numpy.left_shift(blockGears, numpy.uint32(age), out=blockGears)
+			blockRolling += blockGears
+		blockRolling &= mask
+		for candidate in (numpy.flatnonzero(blockRolling == 0) +
+				blockStart).tolist():
+			yield candidate
+
+def chunkBoundaries(data, chunkBits=CHUNK_BITS):
+	"""Return the content-defined chunk boundaries of data.
+
+		A gear rolling hash is taken over every 32 byte window, and a chunk ends
+		wherever its low chunkBits bits are zero, as long as the chunk is at
+		least a quarter of the average size.  Chunks are cut at 4 times the
+		average size regardless.  Since cuts depend on the bytes near them and
+		not on their offset, identical byte runs in different images are mostly
+		cut at the same places.  The boundaries
+		returned include 0 and len(data).
+		"""
+	buf = numpy.frombuffer(data, dtype=numpy.uint8)
+	size = len(buf)
+	minSize = 1 << (chunkBits - 2)
+	maxSize = 1 << (chunkBits + 2)
+	boundaries = [0]
+	for candidate in _candidates(buf, chunkBits):
+		while candidate - boundaries[-1] > maxSize:
+			boundaries.append(boundaries[-1] + maxSize)
+		if candidate - boundaries[-1] >= minSize:
+			boundaries.append(candidate)
+	while size - boundaries[-1] > maxSize:
+		boundaries.append(boundaries[-1] + maxSize)
+	if boundaries[-1] != size:
+		boundaries.append(size)
+	return boundaries
+
+def sectionHashes(firmwares, readers=None):
+	"""Return the sections of some Firmware grouped by the hash of their bytes.
+
+		firmwares may be any iterable of Firmware, such as a corpus's
+		firmwareDefinitions or TestCorpus.iterFirmware(filename).  The result
+		maps each SHA-256 digest to a list of (firmware, section) pairs with
+		exactly those bytes.
+		"""
+	ownReaders = readers is None
+	if ownReaders:
+		readers = ReaderCache()
+	groups = collections.OrderedDict()
+	for firmware in firmwares:
+		reader = readers.get(firmware.filename)
+		for section in firmware.sections:
+			with reader.section(section) as data:
+				digest = hashlib.sha256(data).digest()
+			groups.setdefault(digest, list()).append((firmware, section))
+	if ownReaders:
+		readers.close()
+	return groups
+
+class CorpusIngest:
+
+	"""
+		CorpusIngest finds the duplicate content within a test corpus: images
+		with the same contents, sections with the same bytes, and byte ranges
+		that appear in more than one image.
+
+		Public parameters:
+			firmwareByHash - the first Firmware seen with each content hash
+
+		Public Functions:
+			CorpusIngest.addFirmware(firmware, progressCallback) - record an
+				image, returning the Firmware it duplicates, or None
+			CorpusIngest.removeFirmware(firmware) - forget an image, so one
+				with the same contents can be added again
+			CorpusIngest.ingest(testCorpus) - record every image in a corpus,
+				returning (duplicate, original) Firmware pairs
+			CorpusIngest.sharedChunks(testCorpus) - return the byte ranges
+				found in more than one place in the corpus
+		"""
+
+	def __init__(self, chunkBits=CHUNK_BITS):
+		self.chunkBits = chunkBits
+		self.firmwareByHash = dict()
+
+	def addFirmware(self, firmware, progressCallback=None):
+		"""Record an image, returning the Firmware it duplicates, or None.
+
+			progressCallback is passed on to hashFile.
+			"""
+		digest = hashFile(firmware.filename, progressCallback)
+		if digest in self.firmwareByHash:
+			return self.firmwareByHash[digest]
+		self.firmwareByHash[digest] = firmware
+		return None
+
+	def removeFirmware(self, firmware):
+		"""Forget an image recorded by addFirmware, without hashing it again."""
+		for digest, recorded in list(self.firmwareByHash.items()):
+			if recorded is firmware:
+				del self.firmwareByHash[digest]
+
+	def ingest(self, testCorpus):
+		"""Record every image in a corpus, returning the duplicate pairs."""
+		duplicates = list()
+		for firmware in testCorpus.firmwareDefinitions:
+			original = self.addFirmware(firmware)
+			if original is not None:
+				duplicates.append((firmware, original))
+		return duplicates
+
+	def sharedChunks(self, testCorpus):
+		"""Return the content-defined chunks found more than once.
+
+			The result maps each repeated chunk's SHA-256 digest to a list of
+			(firmware, start, end) places it is found.  Images with the same
+			contents are only scanned once.
+			"""
+		places = dict()
+		scanned = set()
+		for firmware in testCorpus.firmwareDefinitions:
+			with FirmwareReader(firmware.filename) as reader:
+				with reader.section((0, reader.size)) as data:
+					digest = hashlib.sha256(data).digest()
+					if digest in scanned:
+						continue
+					scanned.add(digest)
+					boundaries = chunkBoundaries(data, self.chunkBits)
+					for start, end in zip(boundaries[:-1], boundaries[1:]):
+						chunkDigest = hashlib.sha256(data[start:end]).digest()
+						places.setdefault(chunkDigest, list()).append((firmware,
+								start, end))
+		return dict((chunkDigest, chunkPlaces)
+				for chunkDigest, chunkPlaces in places.items()
+				if len(chunkPlaces) > 1)
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(
+			description="Report duplicate content in a test corpus.")
+	parser.add_argument("testCorpus", help="the test corpus config file")
+	args = parser.parse_args(argv)
+
+	testCorpus = TestCorpus(filename=args.testCorpus)
+	ingest = CorpusIngest()
+	report = dict()
+	report["Duplicate Firmware"] = [[duplicate.filename, original.filename]
+			for duplicate, original in ingest.ingest(testCorpus)]
+	report["Duplicate Sections"] = [[[firmware.filename, section.bounds[0],
+			section.bounds[1]] for firmware, section in group]
+			for group in sectionHashes(testCorpus.firmwareDefinitions).values() if len(group) > 1]
+	shared = ingest.sharedChunks(testCorpus)
+	report["Shared Chunks"] = len(shared)
+	report["Shared Bytes"] = sum((end - start) * (len(chunkPlaces) - 1)
+			for chunkPlaces in shared.values()
+			for _, start, end in chunkPlaces[:1])
+	print(json.dumps(report, indent=2))
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,219 @@
+import contextlib
+import cProfile
+import io
+import os
+import pstats
+import sys
+import time
+import tracemalloc
+
+# Set this environment variable to instrument a run: "1" for stage timers and
+# counters, or a comma separated list that may include "profile" to also run
+# cProfile and "memory" to also run tracemalloc
+ENVIRONMENT_VARIABLE = "FIRMWARE_INSTRUMENT"
+
+# The options --instrument-with and the environment variable take
+OPTIONS = ("profile", "memory")
+
+# Returned by stage() when instrumentation is off, so a disabled stage costs
+# one call and a flag check
+_NULL_STAGE = contextlib.nullcontext()
+
+# Whether stages and counters are being recorded
+_enabled = False
+# Each stage name maps to [calls, seconds, {counter name: amount}]
+_stages = dict()
+_profiler = None
+
+class _Stage:
+
+	"""Times one run of a stage, adding it to the stage's totals."""
+
+	__slots__ = ("name", "start")
+
+	def __init__(self, name):
+		self.name = name
+
+	def __enter__(self):
+		self.start = time.perf_counter()
+		return self
+
+	def __exit__(self, excType, excValue, traceback):
+		totals = _totals(self.name)
+		totals[0] += 1
+		totals[1] += time.perf_counter() - self.start
+		return False
+
+def _totals(name):
+	if name not in _stages:
+		_stages[name] = [0, 0.0, dict()]
+	return _stages[name]
+
+def enabled():
+	"""Return whether instrumentation is on."""
+	return _enabled
+
+def enable(profile=False, memory=False):
+	"""Start recording stages and counters, and optionally profile or trace
+		memory allocations until disable() is called."""
+	global _enabled, _profiler
+	_enabled = True
+	if profile and _profiler is None:
+		_profiler = cProfile.Profile()
+		_profiler.enable()
+	if memory and not tracemalloc.is_tracing():
+		tracemalloc.start()
+
+def disable():
+	"""Stop recording, and forget everything recorded."""
+	global _enabled, _profiler
+	_enabled = False
+	_stages.clear()
+	if _profiler is not None:
+		_profiler.disable()
+		_profiler = None
+	if tracemalloc.is_tracing():
+		tracemalloc.stop()
+
+def initWorker(instrument):
+	"""Start a worker process's instrumentation afresh, with timers and
+		counters on if instrument is set.  Pass as a pool initializer."""
+	disable()
+	if instrument:
+		enable()
+
+def stage(name):
+	"""Return a context manager timing a run of the named stage."""
+	if not _enabled:
+		return _NULL_STAGE
+	return _Stage(name)
+
+def count(stageName, counterName, amount=1):
+	"""Add amount to one of a stage's counters, such as the bytes it handled."""
+	if _enabled:
+		counters = _totals(stageName)[2]
+		counters[counterName] = counters.get(counterName, 0) + amount
+
+def timedIter(name, iterable):
+	"""Return iterable, timing each item it produces as a run of a stage.
+
+		Only the time taken to produce each item counts, not the time spent on
+		it by the caller.
+		"""
+	if not _enabled:
+		return iterable
+	return _timedIter(name, iterable)
+
+def _timedIter(name, iterable):
+	iterator = iter(iterable)
+	while True:
+		with _Stage(name):
+			try:
+				item = next(iterator)
+			except StopIteration:
+				return
+		count(name, "Items")
+		yield item
+
+def drain():
+	"""Return the stages recorded so far and forget them, or None if
+		instrumentation is off.  Worker processes return this to be merged."""
+	if not _enabled:
+		return None
+	stages = dict((name, (totals[0], totals[1], dict(totals[2])))
+			for name, totals in _stages.items())
+	_stages.clear()
+	return stages
+
+def merge(stages):
+	"""Add stages from drain(), such as a worker process's, to this process's."""
+	if stages is None or not _enabled:
+		return
+	for name, (calls, seconds, counters) in stages.items():
+		totals = _totals(name)
+		totals[0] += calls
+		totals[1] += seconds
+		for counterName, amount in counters.items():
+			totals[2][counterName] = totals[2].get(counterName, 0) + amount
+
+def summary():
+	"""Return a dictionary of each stage's calls, seconds, counters and rates.
+
+		Stages recorded in worker processes count the time spent in every
+		worker, so may add up to more than the time the run took.
+		"""
+	stages = dict()
+	for name, (calls, seconds, counters) in _stages.items():
+		result = {"Calls": calls, "Seconds": seconds}
+		for counterName, amount in counters.items():
+			result[counterName] = amount
+			if seconds > 0:
+				result[counterName + " Per Second"] = amount / seconds
+		stages[name] = result
+	return stages
+
+def report(outputFile=None):
+	"""Write a summary of the stages, and any profile or memory trace."""
+	if outputFile is None:
+		outputFile = sys.stderr
+	outputFile.write("Stage summary:\n")
+	for name, result in sorted(summary().items()):
+		figures = ", ".join("%s %.6g" % (key, value)
+				for key, value in sorted(result.items())
+				if key not in ("Calls", "Seconds"))
+		outputFile.write("  %-20s %8d calls %10.4f s  %s\n" % (name,
+				result["Calls"], result["Seconds"], figures))
+	if _profiler is not None:
+		_profiler.disable()
+		profileText = io.StringIO()
+		pstats.Stats(_profiler, stream=profileText).sort_stats(
+				"cumulative").print_stats(25)
+		outputFile.write(profileText.getvalue())
+	if tracemalloc.is_tracing():
+		current, peak = tracemalloc.get_traced_memory()
+		outputFile.write("Memory: %d bytes allocated, %d bytes at peak\n" %
+				(current, peak))
+		for statistic in tracemalloc.take_snapshot().statistics("lineno")[:10]:
+			outputFile.write("  %s\n" % statistic)
+
+def addArguments(parser):
+	"""Add the --instrument and --instrument-with options to an argparse
+		parser.
+
+		Neither takes a variable number of values, so they can't swallow the
+		positional arguments that follow them.
+		"""
+	parser.add_argument("--instrument", action="store_true",
+			help="report stage timings and counters at the end of the run " +
+			"(also switched on by the %s environment variable)" %
+			ENVIRONMENT_VARIABLE)
+	parser.add_argument("--instrument-with", action="append", choices=OPTIONS,
+			metavar="{%s}" % ",".join(OPTIONS),
+			help="instrument the run, also with a cProfile profile or " +
+			"tracemalloc memory trace, may be given more than once")
+
+def configure(args=None):
+	"""Enable instrumentation if parsed args or the environment ask for it."""
+	options = None
+	if args is not None and (getattr(args, "instrument", False) or
+			getattr(args, "instrument_with", None)):
+		options = set(getattr(args, "instrument_with", None) or ())
+	environment = os.environ.get(ENVIRONMENT_VARIABLE, "")
+	if environment not in ("", "0"):
+		options = (options or set()) | set(environment.split(","))
+	if options is not None:
+		enable(profile="profile" in options, memory="memory" in options)
+
+@contextlib.contextmanager
+def session(args=None, outputFile=None):
+	"""Instrument a run as configured by args and the environment, writing
+		the report at the end."""
+	configure(args)
+	if not _enabled:
+		yield
+		return
+	try:
+		yield
+	finally:
+		report(outputFile)
+		disable()
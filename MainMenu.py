@@ -1,7 +1,15 @@
 #!/usr/bin/env python3
 
-from GenericWidgets import Frame, Root, Button, Image
+import os
+
+from GenericWidgets import Frame, Root, Button, Image, FileDialog, Label
 import Icon
+from BackgroundTasks import TaskRunner
+from Corpus import TestCorpus, TrainingCorpus
+from NGramClassifier import NGramClassifier
+from Segmenter import Segmenter
+from Tester import Tester, DEFAULT_CLASSIFIER
+from Trainer import Trainer
 from TrainingCorpusDescriber import TrainingCorpusDescriberSubwindow
 from TestCorpusDescriber import TestCorpusDescriberSubwindow
 
@@ -43,6 +51,18 @@ class MainMenuWindow(Frame):
 		self.__invokeFWDisassemblerButton.grid({"row": 4, "column": 1,
 				"columnspan": 2, "rowspan": 2, "sticky": "nsew"})
 
+		self.__statusLabel = Label(self, text="")
+		self.__statusLabel.grid({"row": 6, "column": 0, "columnspan": 2,
+				"sticky": "w"})
+
+		self.__cancelButton = Button(self, text="Cancel",
+				callback=self.__cancelButtonCallback)
+		self.__cancelButton.grid({"row": 6, "column": 2, "sticky": "nsew"})
+
+	def setStatus(self, message):
+		"""Show a message about the background work."""
+		self.__statusLabel.text = message
+
 	def __testerButtonCallback(self):
 		self.coordinator.invokeTester()
 
@@ -58,6 +78,9 @@ class MainMenuWindow(Frame):
 	def __fwDisassemblerButtonCallback(self):
 		self.coordinator.invokeFirmwareDisassembler()
 
+	def __cancelButtonCallback(self):
+		self.coordinator.cancelTasks()
+
 class MainMenuCoordinator():
 	def __init__(self, window=None):
 		# Initialize class variables
@@ -67,12 +90,77 @@ class MainMenuCoordinator():
 		self.trainingCorpusDescriber = None
 		self.testCorpusDescriber = None
 		self.firmwareDisassembler = None
+		self.testerClassifier = DEFAULT_CLASSIFIER
+		self.tasks = None
+
+	def _runTask(self, name, job, finished):
+		"""Run job(task) in the background, showing its progress.
+
+			finished is called from the main loop however the job ends.
+			"""
+		if self.tasks is None:
+			self.tasks = TaskRunner(self.window)
+
+		def done(result):
+			finished()
+			self.window.setStatus(name + " finished")
+
+		def failed(error):
+			finished()
+			self.window.setStatus("%s failed: %s" % (name, error))
+
+		def cancelled():
+			finished()
+			self.window.setStatus(name + " cancelled")
+
+		def progress(done, total, message):
+			self.window.setStatus("%s: %s" % (name, message))
+
+		self.window.setStatus(name + " running")
+		self.tasks.submit(job, name=name, onDone=done, onError=failed,
+				onCancelled=cancelled, onProgress=progress)
+
+	def cancelTasks(self):
+		"""Stop the background work."""
+		if self.tasks is not None:
+			self.tasks.cancelAll()
 
 	def invokeTester(self):
-		pass
+		if self.tester is not None:
+			return
+		fd = FileDialog(self.window)
+		testCorpusFile = fd.getFilenameToOpen()
+		trainingCorpusFile = fd.getFilenameToOpen()
+		outputFile = fd.getFilenameToSave()
+		if "" not in (testCorpusFile, trainingCorpusFile, outputFile):
+			self.tester = Tester(testCorpusFile, trainingCorpusFile,
+					self.testerClassifier)
+			tester = self.tester
+			self._runTask("Tester", lambda task: tester.run(outputFile,
+					lambda count: task.progress(count, None,
+					"%d sections classified" % count)),
+					self._testerFinished)
+
+	def _testerFinished(self):
+		self.tester = None
 
 	def invokeTrainer(self):
-		pass
+		if self.trainer is not None:
+			return
+		fd = FileDialog(self.window)
+		trainingCorpusFile = fd.getFilenameToOpen()
+		if trainingCorpusFile != "":
+			# Counted across a pool of processes, as from the command line
+			self.trainer = Trainer(TrainingCorpus(filename=trainingCorpusFile),
+					workers=os.cpu_count())
+			trainer = self.trainer
+			self._runTask("Trainer", lambda task: trainer.run(
+					lambda counted, total: task.progress(counted, total,
+					"%d of %d files counted" % (counted, total))),
+					self._trainerFinished)
+
+	def _trainerFinished(self):
+		self.trainer = None
 
 	def invokeTestCorpusDesc(self):
 		if self.testCorpusDescriber is None:
@@ -87,7 +175,29 @@ class MainMenuCoordinator():
 					closeCallback=self._trainingCorpusDescriberClosedCallback)
 
 	def invokeFirmwareDisassembler(self):
-		pass
+		if self.firmwareDisassembler is not None:
+			return
+		fd = FileDialog(self.window)
+		firmwareFile = fd.getFilenameToOpen()
+		trainingCorpusFile = fd.getFilenameToOpen()
+		outputFile = fd.getFilenameToSave()
+		if "" not in (firmwareFile, trainingCorpusFile, outputFile):
+			self.firmwareDisassembler = Segmenter(NGramClassifier(
+					TrainingCorpus(filename=trainingCorpusFile)))
+			segmenter = self.firmwareDisassembler
+
+			def disassemble(task):
+				corpus = TestCorpus(name="Proposed sections")
+				corpus.appendFirmware(segmenter.segmentFile(firmwareFile))
+				# Don't write the result out if cancelled while segmenting
+				task.checkCancelled()
+				corpus.writeOut(outputFile)
+
+			self._runTask("Firmware Disassembler", disassemble,
+					self._firmwareDisassemblerFinished)
+
+	def _firmwareDisassemblerFinished(self):
+		self.firmwareDisassembler = None
 
 	def _trainingCorpusDescriberClosedCallback(self):
 		self.trainingCorpusDescriber = None
@@ -0,0 +1,163 @@
+import json
+import os
+import struct
+
+import numpy
+
+import Instrumentation
+from NGram import NGramVector
+
+# Model files start with this header:
+#   magic, format version, n, hash bits (-1 for none), total count,
+#   number of entries, metadata offset, metadata length
+_MAGIC = b"FTMODEL\0"
+_VERSION = 1
+_HEADER = struct.Struct("<8sHHiQQQQ")
+# Arrays are placed on this alignment, so they can be mapped directly
+_ALIGNMENT = 8
+
+def _align(offset):
+	return (offset + _ALIGNMENT - 1) // _ALIGNMENT * _ALIGNMENT
+
+def _arrayAt(mapping, dtype, offset, length):
+	"""Return a read-only view of an array within a mapped file."""
+	itemSize = numpy.dtype(dtype).itemsize
+	return mapping[offset:offset + itemSize * length].view(dtype)
+
+class FileTypeModel:
+
+	"""
+		FileTypeModel stores the trained n-gram counts for one filetype.
+
+		Models are stored in a compact binary file: a fixed header, then the
+		sorted n-gram codes as uint32 and their counts as uint64, then the same
+		for each training file, then a small JSON block naming the filetype and
+		describing the training files.  load() maps the file once with
+		numpy.memmap and views the arrays within it rather than reading them, so
+		loading is nearly instant, per-file records cost no pages until they are
+		read, and the pages are shared between every process using the model.
+
+		Public parameters:
+			name - the name of the filetype
+			vector - an NGramVector of the n-gram counts over every training file
+			files - a dictionary of TrainingRecords by training filename, holding
+				what each file contributed to vector
+
+		Public Functions:
+			FileTypeModel.writeOut(filename) - write the model out to a file
+			FileTypeModel.load(filename) - map a model from a file
+		"""
+
+	def __init__(self, name, vector, files=None):
+		self.name = name
+		self.vector = vector
+		self.files = dict() if files is None else files
+
+	@property
+	def n(self):
+		return self.vector.n
+
+	def writeOut(self, filename):
+		"""Write the model out to a file.
+
+			The file is replaced atomically, so processes that have the old model
+			mapped keep seeing it intact.
+			"""
+		tempFilename = filename + ".tmp"
+		with open(tempFilename, "wb") as outputFile:
+			outputFile.seek(_HEADER.size)
+			self._writeVector(outputFile, self.vector)
+			fileDefs = list()
+			for recordFilename, record in self.files.items():
+				fileDef = record._toDict()
+				fileDef["Filename"] = recordFilename
+				fileDef["Offset"] = self._writeVector(outputFile, record.vector)
+				fileDef["Entries"] = len(record.vector)
+				fileDefs.append(fileDef)
+
+			metadata = json.dumps({"Name": self.name, "Files": fileDefs}).encode()
+			metadataOffset = outputFile.tell()
+			outputFile.write(metadata)
+
+			hashBits = -1 if self.vector.hashBits is None else self.vector.hashBits
+			outputFile.seek(0)
+			outputFile.write(_HEADER.pack(_MAGIC, _VERSION, self.vector.n, hashBits,
+					self.vector.total, len(self.vector), metadataOffset,
+					len(metadata)))
+		os.replace(tempFilename, filename)
+
+	@staticmethod
+	def _writeVector(outputFile, vector):
+		"""Write a vector's indices and counts, returning where they start."""
+		offset = _align(outputFile.tell())
+		outputFile.seek(offset)
+		outputFile.write(vector.indices.astype("<u4").tobytes())
+		outputFile.seek(_align(outputFile.tell()))
+		outputFile.write(vector.counts.astype("<u8").tobytes())
+		return offset
+
+	@staticmethod
+	def _mapVector(mapping, offset, entries, n, hashBits):
+		"""Return a vector written by _writeVector, as views of the mapped
+			file."""
+		indices = _arrayAt(mapping, "<u4", offset, entries)
+		counts = _arrayAt(mapping, "<u8", _align(offset + 4 * entries), entries)
+		return NGramVector(n, indices, counts, hashBits)
+
+	@classmethod
+	def load(cls, filename):
+		"""Map a model written by writeOut."""
+		with Instrumentation.stage("Model Load"):
+			return cls._load(filename)
+
+	@classmethod
+	def _load(cls, filename):
+		with open(filename, "rb") as inputFile:
+			header = inputFile.read(_HEADER.size)
+			if len(header) != _HEADER.size:
+				raise ValueError("Truncated model file: " + filename)
+			(magic, version, n, hashBits, total, entries, metadataOffset,
+					metadataLength) = _HEADER.unpack(header)
+			if magic != _MAGIC or version != _VERSION:
+				raise ValueError("Not a version %d model file: %s" % (_VERSION,
+						filename))
+			inputFile.seek(metadataOffset)
+			metadata = json.loads(inputFile.read(metadataLength).decode())
+
+		hashBits = None if hashBits < 0 else hashBits
+		# One mapping of the whole file, which every vector is a view of, so a
+		# model with many training files doesn't use a mapping for each
+		mapping = numpy.memmap(filename, dtype=numpy.uint8, mode="r")
+		vector = cls._mapVector(mapping, _align(_HEADER.size), entries, n,
+				hashBits)
+		files = dict()
+		for fileDef in metadata.get("Files", ()):
+			files[fileDef["Filename"]] = TrainingRecord(fileDef["Hash"],
+					fileDef["Mtime"], fileDef["Size"], cls._mapVector(mapping,
+					fileDef["Offset"], fileDef["Entries"], n, hashBits))
+		return cls(metadata["Name"], vector, files)
+
+class TrainingRecord:
+
+	"""
+		TrainingRecord stores what one training file contributed to a model.
+
+		Public parameters:
+			contentHash - the hex SHA-256 of the file's contents
+			mtime - the file's modification time in ns when it was counted
+			size - the file's size in bytes when it was counted
+			vector - an NGramVector of the file's n-gram counts
+		"""
+
+	def __init__(self, contentHash, mtime, size, vector):
+		self.contentHash = contentHash
+		self.mtime = mtime
+		self.size = size
+		self.vector = vector
+
+	def _toDict(self):
+		outputDict = dict()
+		outputDict["Hash"] = self.contentHash
+		outputDict["Mtime"] = self.mtime
+		outputDict["Size"] = self.size
+		return outputDict
@@ -0,0 +1,456 @@
+#!/usr/bin/env python3
+
+import argparse
+import bz2
+import collections
+import concurrent.futures
+import hashlib
+import json
+import lzma
+import os
+import random
+import time
+import zlib
+
+import numpy
+
+import Instrumentation
+from Corpus import TestCorpus, TrainingCorpus
+from SectionReader import FirmwareReader, ReaderCache
+
+# Functions returning the compressed size of some data, by compressor name.
+# All of these release the GIL while compressing, so they run well in threads.
+COMPRESSORS = {
+	"zlib": lambda data: len(zlib.compress(data, 9)),
+	"bz2": lambda data: len(bz2.compress(data, 9)),
+	"lzma": lambda data: len(lzma.compress(data)),
+}
+
+# The compressed sizes of a filetype's training files are kept in a file named
+# after its filetypeFile, with this suffix
+SIZE_CACHE_SUFFIX = ".ncd"
+
+# selectPrototypes picks medoids from a sample of at most this many files
+DEFAULT_MAX_CANDIDATES = 200
+
+def ncd(cx, cy, cxy):
+	"""Return the normalized compression distance from compressed sizes."""
+	return (cxy - min(cx, cy)) / float(max(cx, cy))
+
+class CompressedSizeCache:
+
+	"""
+		CompressedSizeCache persists C(y), the compressed size of each training
+		file of a filetype, so it is only computed when a file changes.  It also
+		holds the filetype's prototypes, when they have been selected, along
+		with a digest of the training files they were selected from, so they
+		are not used once those files change.  A cache with a filename of None
+		is kept in memory only.
+
+		Public Functions:
+			CompressedSizeCache.prototypesDigest(filename) - return a digest of
+				the prototypes saved in a cache file
+			CompressedSizeCache.size(filename) - return C(y) for a training file
+			CompressedSizeCache.setPrototypes(prototypes, filenames) - set the
+				prototypes selected from filenames
+			CompressedSizeCache.prototypesFor(filenames) - return the prototypes
+				if they were selected from filenames, or None
+			CompressedSizeCache.writeOut() - save any newly computed sizes
+		"""
+
+	def __init__(self, filename, compressor):
+		self.filename = filename
+		self.compressor = compressor
+		self._prototypes = None
+		self._prototypeFiles = None
+		self._sizes = dict()
+		self._changed = False
+		if filename is not None and os.path.exists(filename):
+			with open(filename, "r") as cacheFile:
+				cacheDef = json.load(cacheFile)
+			if cacheDef.get("Compressor") == compressor:
+				self._sizes = cacheDef["Files"]
+				self._prototypes = cacheDef.get("Prototypes")
+				self._prototypeFiles = cacheDef.get("Prototype Files")
+
+	@staticmethod
+	def _filesDigest(filenames):
+		return hashlib.sha256("\n".join(sorted(set(filenames))).encode(
+				"utf-8", "surrogateescape")).hexdigest()
+
+	@staticmethod
+	def prototypesDigest(filename):
+		"""Return a hex digest of the compressor and prototypes saved in a cache
+			file, which unlike its compressed sizes change what is classified."""
+		hasher = hashlib.sha256()
+		if os.path.exists(filename):
+			with open(filename, "r") as cacheFile:
+				cacheDef = json.load(cacheFile)
+			if cacheDef.get("Prototypes") is not None:
+				hasher.update(json.dumps([cacheDef["Compressor"],
+						cacheDef["Prototypes"], cacheDef["Prototype Files"]]).encode())
+		return hasher.hexdigest()
+
+	def setPrototypes(self, prototypes, filenames):
+		"""Set the prototype filenames selected from filenames, to be saved by
+			writeOut."""
+		self._prototypes = prototypes
+		self._prototypeFiles = self._filesDigest(filenames)
+		self._changed = True
+
+	def prototypesFor(self, filenames):
+		"""Return the prototype filenames, or None if none were selected from
+			exactly these training files."""
+		if (self._prototypes is None or
+				self._prototypeFiles != self._filesDigest(filenames)):
+			return None
+		return self._prototypes
+
+	def size(self, filename, data=None):
+		"""Return the compressed size of a training file.
+
+			Supply data if the file's contents are already at hand.
+			"""
+		fileStat = os.stat(filename)
+		entry = self._sizes.get(filename)
+		if (entry is not None and entry["Mtime"] == fileStat.st_mtime_ns and
+				entry["Size"] == fileStat.st_size):
+			return entry["Compressed Size"]
+		if data is None:
+			with open(filename, "rb") as inputFile:
+				data = inputFile.read()
+		entry = dict()
+		entry["Mtime"] = fileStat.st_mtime_ns
+		entry["Size"] = fileStat.st_size
+		entry["Compressed Size"] = COMPRESSORS[self.compressor](data)
+		self._sizes[filename] = entry
+		self._changed = True
+		return entry["Compressed Size"]
+
+	def writeOut(self):
+		"""Save the cache, if anything was added to it."""
+		if self._changed:
+			cacheDef = dict()
+			cacheDef["Compressor"] = self.compressor
+			cacheDef["Files"] = self._sizes
+			if self._prototypes is not None:
+				cacheDef["Prototypes"] = self._prototypes
+				cacheDef["Prototype Files"] = self._prototypeFiles
+			# Named for this process, since worker processes may save the same
+			# filetype's cache at once, and replaced so none reads it half written
+			tempFilename = "%s.%d.tmp" % (self.filename, os.getpid())
+			with open(tempFilename, "w") as cacheFile:
+				json.dump(cacheDef, cacheFile)
+			os.replace(tempFilename, self.filename)
+			self._changed = False
+
+def selectPrototypes(filenames, k, compressor="zlib", sizeCache=None,
+		threads=None, maxCandidates=DEFAULT_MAX_CANDIDATES):
+	"""Return the filenames of k medoids of the given files under NCD.
+
+		The pairwise NCD of the candidates is computed, so this is quadratic in
+		their number.  With more than maxCandidates files, the medoids are
+		picked from a fixed random sample of maxCandidates of them, so the cost
+		is bounded however many files there are.  A greedy build picks the
+		initial medoids, then each cluster's medoid is moved to its most
+		central member until none move.
+		"""
+	if len(filenames) <= k:
+		return list(filenames)
+	if len(filenames) > max(maxCandidates, k):
+		# Seeded, so the same files always give the same prototypes
+		chosen = random.Random(0).sample(range(len(filenames)),
+				max(maxCandidates, k))
+		filenames = [filenames[i] for i in sorted(chosen)]
+	compress = COMPRESSORS[compressor]
+	if sizeCache is None:
+		sizeCache = CompressedSizeCache(None, compressor)
+	sizes = [sizeCache.size(filename) for filename in filenames]
+	readers = [FirmwareReader(filename) for filename in filenames]
+
+	def pairDistance(pair):
+		i, j = pair
+		with readers[i].section((0, readers[i].size)) as x:
+			with readers[j].section((0, readers[j].size)) as y:
+				return ncd(sizes[i], sizes[j], compress(b"".join((x, y))))
+
+	m = len(filenames)
+	pairs = [(i, j) for i in range(m) for j in range(m) if i != j]
+	distances = numpy.zeros((m, m))
+	try:
+		with concurrent.futures.ThreadPoolExecutor(threads) as pool:
+			for (i, j), distance in zip(pairs, pool.map(pairDistance, pairs)):
+				distances[i, j] = distance
+	finally:
+		for reader in readers:
+			reader.close()
+	# NCD is only roughly symmetric
+	distances = (distances + distances.T) / 2
+
+	# Build: start from the most central file, then add whichever file cuts
+	# the total distance to the nearest medoid the most
+	medoids = [int(numpy.argmin(distances.sum(axis=1)))]
+	nearest = distances[medoids[0]].copy()
+	while len(medoids) < k:
+		gains = numpy.maximum(nearest[None, :] - distances, 0).sum(axis=1)
+		gains[medoids] = -1
+		medoid = int(numpy.argmax(gains))
+		medoids.append(medoid)
+		nearest = numpy.minimum(nearest, distances[medoid])
+
+	# Refine: move each medoid to the most central member of its cluster
+	for _ in range(100):
+		assignment = numpy.argmin(distances[medoids], axis=0)
+		newMedoids = list()
+		for cluster in range(k):
+			members = numpy.flatnonzero(assignment == cluster)
+			if len(members) == 0:
+				# No file is nearer this medoid than another, so it stays put
+				newMedoids.append(medoids[cluster])
+				continue
+			costs = distances[numpy.ix_(members, members)].sum(axis=1)
+			newMedoids.append(int(members[numpy.argmin(costs)]))
+		if newMedoids == medoids:
+			break
+		medoids = newMedoids
+	return [filenames[i] for i in sorted(medoids)]
+
+def _trainingFilenames(filetype):
+	"""Return a filetype's training filenames, without repeats."""
+	return list(collections.OrderedDict.fromkeys(
+			trainingFile.filename for trainingFile in filetype.files))
+
+def choosePrototypes(trainingCorpus, k, compressor="zlib", threads=None,
+		saveSizes=True):
+	"""Return k prototypes for every filetype in a training corpus, as a
+		dictionary of filenames by filetype name, without saving them.
+
+		Newly computed compressed sizes are saved unless saveSizes is False.
+		"""
+	prototypes = dict()
+	for filetype in trainingCorpus.filetypeDefinitions:
+		sizeCache = CompressedSizeCache(filetype.filetypeFile + SIZE_CACHE_SUFFIX,
+				compressor)
+		prototypes[filetype.name] = selectPrototypes(
+				_trainingFilenames(filetype), k, compressor, sizeCache, threads)
+		if saveSizes:
+			sizeCache.writeOut()
+	return prototypes
+
+def trainPrototypes(trainingCorpus, k, compressor="zlib", threads=None):
+	"""Select and save k prototypes for every filetype in a training corpus."""
+	for filetype in trainingCorpus.filetypeDefinitions:
+		sizeCache = CompressedSizeCache(filetype.filetypeFile + SIZE_CACHE_SUFFIX,
+				compressor)
+		filenames = _trainingFilenames(filetype)
+		sizeCache.setPrototypes(selectPrototypes(filenames, k, compressor,
+				sizeCache, threads), filenames)
+		sizeCache.writeOut()
+
+class NCDClassifier:
+
+	"""
+		NCDClassifier labels data with the filetype of the training file it has
+		the smallest normalized compression distance to.
+
+		C(y) for each training file is computed once and persisted next to the
+		filetype's model.  For each section, the compressions of the section
+		concatenated with every training file are run across a thread pool, and
+		results are kept in an LRU cache keyed by the section's content hash.
+
+		With prototypes set, each section is only compared against the
+		prototypes chosen for each filetype by trainPrototypes, rather than
+		every training file.  Prototypes chosen before a filetype's training
+		files last changed are not used.  prototypes may instead be a
+		dictionary of prototype filenames by filetype name, such as
+		choosePrototypes returns, to compare against without saving them.
+
+		Training files are opened as they are compared against, through a
+		ReaderCache keeping at most maxOpen of them open, so a large training
+		corpus doesn't hold a file descriptor and mapping per file.
+
+		Public parameters:
+			trainingCorpus - the TrainingCorpus whose files are compared against
+			compressor - the name of the compressor in COMPRESSORS to use
+			prototypes - whether to compare against prototypes only, or the
+				prototype filenames to use by filetype name
+			saveSizes - whether to save newly computed compressed sizes
+
+		Public Functions:
+			NCDClassifier.classify(data) - return the best filetype name
+			NCDClassifier.distances(data) - return the smallest NCD to each
+				filetype, in the order of the corpus's filetypeDefinitions
+			NCDClassifier.close() - close the training files and thread pool
+		"""
+
+	def __init__(self, trainingCorpus, compressor="zlib", threads=None,
+			cacheSize=1024, prototypes=False, maxOpen=64, saveSizes=True):
+		self.trainingCorpus = trainingCorpus
+		self.compressor = compressor
+		self.prototypes = prototypes
+		self._compress = COMPRESSORS[compressor]
+		self._threads = threads
+		self._pool = None
+		self._cacheSize = cacheSize
+		self._cache = collections.OrderedDict()
+		self._readers = ReaderCache(maxOpen)
+
+		# Each sample is (filetype index, filename, C(y))
+		self._samples = list()
+		for i, filetype in enumerate(trainingCorpus.filetypeDefinitions):
+			sizeCache = CompressedSizeCache(
+					filetype.filetypeFile + SIZE_CACHE_SUFFIX, compressor)
+			filenames = [trainingFile.filename for trainingFile in filetype.files]
+			if isinstance(prototypes, dict):
+				filenames = prototypes[filetype.name]
+			elif prototypes:
+				filenames = sizeCache.prototypesFor(_trainingFilenames(filetype))
+				if filenames is None:
+					raise ValueError("No prototypes trained for filetype %s "
+							"since its training files last changed" % filetype.name)
+			for filename in filenames:
+				with Instrumentation.stage("Model Load"):
+					cy = sizeCache.size(filename)
+				self._samples.append((i, filename, cy))
+			if saveSizes:
+				sizeCache.writeOut()
+
+	def distances(self, data):
+		"""Return the smallest NCD from data to each filetype's files."""
+		key = hashlib.sha256(data).digest()
+		if key in self._cache:
+			self._cache.move_to_end(key)
+			return self._cache[key]
+
+		if self._pool is None:
+			self._pool = concurrent.futures.ThreadPoolExecutor(self._threads)
+		cx = self._compress(data)
+
+		def compareSample(sample):
+			filetypeIndex, filename, cy = sample
+			# Held, so another thread can't close it while it's compared
+			reader = self._readers.hold(filename)
+			try:
+				with reader.section((0, reader.size)) as sampleData:
+					cxy = self._compress(b"".join((data, sampleData)))
+			finally:
+				self._readers.release(filename)
+			return filetypeIndex, ncd(cx, cy, cxy)
+
+		distances = [float("inf")] * len(self.trainingCorpus.filetypeDefinitions)
+		for filetypeIndex, distance in self._pool.map(compareSample,
+				self._samples):
+			distances[filetypeIndex] = min(distances[filetypeIndex], distance)
+
+		self._cache[key] = distances
+		if len(self._cache) > self._cacheSize:
+			self._cache.popitem(last=False)
+		return distances
+
+	def classify(self, data):
+		"""Return the name of the filetype data is closest to."""
+		distances = self.distances(data)
+		if len(distances) == 0:
+			return ""
+		best = min(range(len(distances)), key=distances.__getitem__)
+		return self.trainingCorpus.filetypeDefinitions[best].name
+
+	def close(self):
+		"""Close the training files and thread pool."""
+		if self._pool is not None:
+			self._pool.shutdown()
+			self._pool = None
+		self._readers.close()
+		self._samples = list()
+
+class PrototypeNCDClassifier(NCDClassifier):
+
+	"""
+		PrototypeNCDClassifier is an NCDClassifier comparing against prototypes
+		only, for naming as the tester's classifier.
+		"""
+
+	def __init__(self, trainingCorpus, **kwargs):
+		super(PrototypeNCDClassifier, self).__init__(trainingCorpus,
+				prototypes=True, **kwargs)
+
+def benchmarkPrototypes(trainingCorpus, testCorpus, ks, compressor="zlib"):
+	"""Compare full NCD classification against prototypes for each k.
+
+		The prototypes are chosen and compared against in memory, so nothing is
+		written, and the prototypes already trained are left as they are.
+		Returns a list of result dictionaries, the first for the full comparison
+		and then one per k, holding the section accuracy and timings.
+		"""
+	sections = list()
+	readers = ReaderCache()
+	for firmware in testCorpus.firmwareDefinitions:
+		for section in firmware.sections:
+			sections.append((firmware.filename, section))
+
+	def runClassifier(classifier):
+		correct = 0
+		start = time.perf_counter()
+		for filename, section in sections:
+			with readers.get(filename).section(section) as data:
+				if classifier.classify(data) == section.filetype:
+					correct += 1
+		seconds = time.perf_counter() - start
+		classifier.close()
+		result = dict()
+		result["Accuracy"] = correct / float(max(len(sections), 1))
+		result["Seconds"] = seconds
+		result["Sections Per Second"] = len(sections) / max(seconds, 1e-9)
+		return result
+
+	results = list()
+	result = runClassifier(NCDClassifier(trainingCorpus, compressor,
+			saveSizes=False))
+	result["k"] = None
+	results.append(result)
+	for k in ks:
+		start = time.perf_counter()
+		prototypes = choosePrototypes(trainingCorpus, k, compressor,
+				saveSizes=False)
+		trainingSeconds = time.perf_counter() - start
+		result = runClassifier(NCDClassifier(trainingCorpus, compressor,
+				prototypes=prototypes, saveSizes=False))
+		result["k"] = k
+		result["Training Seconds"] = trainingSeconds
+		results.append(result)
+	readers.close()
+	return results
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(
+			description="Train NCD prototypes, or benchmark them.")
+	parser.add_argument("--compressor", choices=sorted(COMPRESSORS),
+			default="zlib", help="the compressor to use (default: %(default)s)")
+	subparsers = parser.add_subparsers(dest="command", required=True)
+	trainParser = subparsers.add_parser("train",
+			help="select k prototypes per filetype")
+	trainParser.add_argument("trainingCorpus", help="the training corpus config")
+	trainParser.add_argument("-k", type=int, required=True,
+			help="the number of prototypes per filetype")
+	benchParser = subparsers.add_parser("benchmark",
+			help="compare prototype accuracy and speed against full NCD")
+	benchParser.add_argument("trainingCorpus", help="the training corpus config")
+	benchParser.add_argument("testCorpus", help="the test corpus config")
+	benchParser.add_argument("-k", type=int, nargs="+", required=True,
+			help="the numbers of prototypes per filetype to try")
+	for subparser in (trainParser, benchParser):
+		Instrumentation.addArguments(subparser)
+	args = parser.parse_args(argv)
+
+	with Instrumentation.session(args):
+		trainingCorpus = TrainingCorpus(filename=args.trainingCorpus)
+		if args.command == "train":
+			with Instrumentation.stage("Train"):
+				trainPrototypes(trainingCorpus, args.k, args.compressor)
+		else:
+			results = benchmarkPrototypes(trainingCorpus,
+					TestCorpus(filename=args.testCorpus), args.k, args.compressor)
+			print(json.dumps(results, indent=2))
+
+if __name__ == "__main__":
+	main()
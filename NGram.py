@@ -0,0 +1,425 @@
+import numpy
+
+import Instrumentation
+
+# The largest n supported, every n-gram is packed into one uint32 code
+MAX_N = 4
+# Up to this n, large amounts of data are counted into a dense array of every
+# possible code, rather than sorted
+DENSE_MAX_N = 3
+# The smallest unsigned type able to hold the code of an n-gram, by n
+_CODE_DTYPES = {1: numpy.uint8, 2: numpy.uint16, 3: numpy.uint32, 4: numpy.uint32}
+# Data is always counted densely if there are at most this many possible codes
+_SMALL_DIMENSION = 1 << 16
+# Dense counts are taken this many codes at a time, or a dense array's worth if
+# that is more, so each block's codes are still cached when they are counted
+_BLOCK_CODES = 1 << 20
+
+# Hashed codes are folded into 2**hashBits buckets, for hashBits in this range.
+# A dense array of 2**24 counts takes 128 MB
+MAX_HASH_BITS = 24
+
+def checkHashBits(hashBits):
+	"""Raise ValueError unless hashBits is None or from 1 to MAX_HASH_BITS."""
+	if hashBits is not None and not (isinstance(hashBits,
+			(int, numpy.integer)) and 1 <= hashBits <= MAX_HASH_BITS):
+		raise ValueError("hashBits must be between 1 and %d, not %r" %
+				(MAX_HASH_BITS, hashBits))
+
+def dimension(n, hashBits=None):
+	"""Return the number of possible n-gram codes."""
+	checkHashBits(hashBits)
+	if hashBits is not None:
+		return 1 << hashBits
+	return 1 << (8 * n)
+
+def _countsDensely(codes, n, hashBits):
+	"""Return whether to count this many codes with bincount, rather than by
+		sorting them: only if the dense array is small, or no bigger than the
+		codes themselves."""
+	if n > DENSE_MAX_N and hashBits is None:
+		return False
+	size = dimension(n, hashBits)
+	return size <= _SMALL_DIMENSION or size <= codes
+
+def nGramCodes(data, n):
+	"""Return the packed integer code of every n-gram in data.
+
+		data is any bytes-like object.  The code of an n-gram is its bytes read
+		as a big-endian integer, so the i'th code covers data[i:i+n].  Codes are
+		stored in the smallest unsigned type that holds them.
+		"""
+	if not (1 <= n <= MAX_N):
+		raise ValueError("n must be between 1 and %d, not %d" % (MAX_N, n))
+	buf = numpy.frombuffer(data, dtype=numpy.uint8)
+	if len(buf) < n:
+		return numpy.zeros(0, dtype=_CODE_DTYPES[n])
+	if n == 1:
+		return buf
+	count = len(buf) - n + 1
+	codes = buf[:count].astype(_CODE_DTYPES[n])
+	for i in range(1, n):
+		codes <<= 8
+		codes |= buf[i:i + count]
+	return codes
+
+def hashCodes(codes, hashBits):
+	"""Fold n-gram codes into 2**hashBits buckets."""
+	checkHashBits(hashBits)
+	hashed = codes.astype(numpy.uint32)
+	hashed *= numpy.uint32(2654435761)
+	hashed >>= numpy.uint32(32 - hashBits)
+	return hashed
+
+def _countDense(data, n, hashBits=None, dense=None):
+	"""Return a dense array of the counts of data's n-grams, hashed if hashBits
+		is given, counting a block of codes at a time.  Given dense, data's
+		counts are added to it."""
+	buf = numpy.frombuffer(data, dtype=numpy.uint8)
+	codes = len(buf) - n + 1
+	size = dimension(n, hashBits)
+	block = max(_BLOCK_CODES, size)
+	for start in range(0, max(codes, 0), block):
+		blockCodes = nGramCodes(buf[start:min(start + block, codes) + n - 1], n)
+		if hashBits is not None:
+			blockCodes = hashCodes(blockCodes, hashBits)
+		counts = numpy.bincount(blockCodes, minlength=size)
+		if dense is None:
+			dense = counts
+		else:
+			numpy.add(dense, counts, out=dense, casting="unsafe")
+	if dense is None:
+		dense = numpy.zeros(size, dtype=numpy.uint64)
+	return dense
+
+def countCodes(codes, n, hashBits=None):
+	"""Return an NGramVector counting the given n-gram codes."""
+	if hashBits is not None:
+		codes = hashCodes(codes, hashBits)
+	if _countsDensely(len(codes), n, hashBits):
+		counts = numpy.bincount(codes, minlength=dimension(n, hashBits))
+		return NGramVector.fromDense(n, counts, hashBits)
+	indices, counts = numpy.unique(codes, return_counts=True)
+	return NGramVector(n, indices, counts, hashBits)
+
+def countNGrams(data, n, hashBits=None):
+	"""Return an NGramVector of the n-gram counts in data.
+
+		Up to DENSE_MAX_N, or with hashBits, the n-grams are counted with
+		bincount into a dense array of every possible code, or of 2**hashBits
+		buckets, as long as that array is no bigger than the data.  Otherwise
+		they are counted sparsely, by sorting them with numpy.unique.
+		Benchmark.py times both.
+		"""
+	with Instrumentation.stage("Feature Extraction"):
+		Instrumentation.count("Feature Extraction", "Bytes", len(data))
+		if _countsDensely(len(data) - n + 1, n, hashBits):
+			return NGramVector.fromDense(n, _countDense(data, n, hashBits),
+					hashBits)
+		return countCodes(nGramCodes(data, n), n, hashBits)
+
+class NGramVector:
+
+	"""
+		NGramVector stores the n-gram counts of some data, sparsely.
+
+		Public parameters:
+			n - the n-gram order
+			hashBits - the number of hash bits for hashed vectors, or None
+			indices - the sorted, distinct n-gram codes present, as uint32
+			counts - the number of occurrences of each code, as uint64
+			total - the total number of n-grams counted
+			dimension - the number of possible codes
+
+		Public Functions:
+			NGramVector.toDense() - return the counts as a dense array
+			NGramVector.frequencies() - return the counts divided by the total
+			NGramVector.merge(vectors) - return the sum of several vectors
+			NGramVector.treeMerge(vectors) - sum many vectors by merging pairs
+			NGramVector.subtract(other) - return these counts less other's
+		"""
+
+	def __init__(self, n, indices=None, counts=None, hashBits=None):
+		self.n = n
+		self.hashBits = hashBits
+		if indices is None:
+			indices = numpy.zeros(0, dtype=numpy.uint32)
+			counts = numpy.zeros(0, dtype=numpy.uint64)
+		self.indices = numpy.asarray(indices, dtype=numpy.uint32)
+		self.counts = numpy.asarray(counts, dtype=numpy.uint64)
+
+	@classmethod
+	def fromDense(cls, n, counts, hashBits=None):
+		"""Build a vector from a dense array of counts indexed by code."""
+		indices = numpy.flatnonzero(counts)
+		return cls(n, indices, counts[indices], hashBits)
+
+	@property
+	def total(self):
+		return int(self.counts.sum())
+
+	@property
+	def dimension(self):
+		return dimension(self.n, self.hashBits)
+
+	def __len__(self):
+		return len(self.indices)
+
+	def __eq__(self, other):
+		return (isinstance(other, NGramVector) and self.n == other.n and
+				self.hashBits == other.hashBits and
+				numpy.array_equal(self.indices, other.indices) and
+				numpy.array_equal(self.counts, other.counts))
+
+	def __add__(self, other):
+		return NGramVector.merge([self, other])
+
+	def __sub__(self, other):
+		return self.subtract(other)
+
+	def subtract(self, other):
+		"""Return a vector of these counts less the counts in other.
+
+			other must have been counted from data included in this vector, so
+			none of its counts may exceed the matching count here.
+			"""
+		if (self.n, self.hashBits) != (other.n, other.hashBits):
+			raise ValueError("Can't subtract vectors of different n or hashing")
+		pos = numpy.searchsorted(self.indices, other.indices)
+		valid = pos < len(self.indices)
+		valid[valid] = self.indices[pos[valid]] == other.indices[valid]
+		if (not valid.all()) or (self.counts[pos] < other.counts).any():
+			raise ValueError("Subtracted counts are not contained in this vector")
+		counts = self.counts.copy()
+		counts[pos] -= other.counts
+		keep = counts != 0
+		return NGramVector(self.n, self.indices[keep], counts[keep], self.hashBits)
+
+	def toDense(self):
+		"""Return the counts as a dense uint64 array indexed by code."""
+		dense = numpy.zeros(self.dimension, dtype=numpy.uint64)
+		dense[self.indices] = self.counts
+		return dense
+
+	def frequencies(self):
+		"""Return each count as a fraction of the total, as float64."""
+		total = self.total
+		if total == 0:
+			return numpy.zeros(len(self.counts), dtype=numpy.float64)
+		return self.counts / float(total)
+
+	@staticmethod
+	def merge(vectors):
+		"""Return a vector holding the summed counts of several vectors."""
+		vectors = list(vectors)
+		if len(vectors) == 0:
+			raise ValueError("Nothing to merge")
+		n, hashBits = vectors[0].n, vectors[0].hashBits
+		for vector in vectors:
+			if (vector.n, vector.hashBits) != (n, hashBits):
+				raise ValueError("Can't merge vectors of different n or hashing")
+		indices = numpy.concatenate([v.indices for v in vectors])
+		counts = numpy.concatenate([v.counts for v in vectors])
+		if len(indices) == 0:
+			return NGramVector(n, hashBits=hashBits)
+		order = numpy.argsort(indices, kind="stable")
+		indices = indices[order]
+		counts = counts[order]
+		starts = numpy.flatnonzero(numpy.concatenate(([True],
+				indices[1:] != indices[:-1])))
+		return NGramVector(n, indices[starts], numpy.add.reduceat(counts, starts),
+				hashBits)
+
+	@staticmethod
+	def treeMerge(vectors):
+		"""Return the sum of several vectors, merging neighbours pairwise.
+
+			Each vector takes part in log2(len(vectors)) merges, rather than the
+			running total being re-merged once per vector.
+			"""
+		vectors = list(vectors)
+		if len(vectors) == 0:
+			raise ValueError("Nothing to merge")
+		while len(vectors) > 1:
+			vectors = [NGramVector.merge(vectors[i:i + 2])
+					for i in range(0, len(vectors), 2)]
+		return vectors[0]
+
+class NGramCounter:
+
+	"""
+		NGramCounter accumulates n-gram counts over data fed to it in pieces.
+
+		Each piece is treated as the continuation of the previous one, so the
+		n-grams spanning two pieces are counted once, exactly as if all of the
+		data had been counted at once.
+
+		Each piece's counts are folded into the running counts as soon as it is
+		counted.  For n up to DENSE_MAX_N, or with hashBits, the running counts
+		move to one dense array of dimension(n, hashBits) counts once as many
+		n-grams have been seen as it has counts, and from then on memory stays
+		the same however much more data is fed in.  Otherwise they stay sparse,
+		and grow with the number of distinct n-grams seen.
+
+		Public Functions:
+			NGramCounter.update(data) - count the n-grams in the next piece
+			NGramCounter.vector() - return the NGramVector counted so far
+		"""
+
+	def __init__(self, n, hashBits=None):
+		self.n = n
+		self.hashBits = hashBits
+		self._carry = b""
+		self._seen = 0
+		self._dense = None
+		self._sparse = NGramVector(n, hashBits=hashBits)
+		checkHashBits(hashBits)
+
+	def update(self, data):
+		"""Count the n-grams in data, continuing on from the last piece."""
+		with Instrumentation.stage("Feature Extraction"):
+			Instrumentation.count("Feature Extraction", "Bytes", len(data))
+			self._update(data)
+
+	def _update(self, data):
+		if len(self._carry) > 0:
+			data = self._carry + data
+		self._seen += max(len(data) - self.n + 1, 0)
+		if self._dense is None and _countsDensely(self._seen, self.n,
+				self.hashBits):
+			self._dense = self._sparse.toDense()
+			self._sparse = None
+		if self._dense is not None:
+			_countDense(data, self.n, self.hashBits, self._dense)
+		else:
+			codes = nGramCodes(data, self.n)
+			if self.hashBits is not None:
+				codes = hashCodes(codes, self.hashBits)
+			elif self.n == 1:
+				# The codes of 1-grams are data itself, which mustn't be sorted
+				codes = codes.copy()
+			self._countSparse(codes)
+		if self.n > 1:
+			self._carry = bytes(data[max(len(data) - (self.n - 1), 0):])
+
+	def _countSparse(self, codes):
+		if len(codes) > 0:
+			codes.sort()
+			starts = numpy.flatnonzero(numpy.concatenate(([True],
+					codes[1:] != codes[:-1])))
+			indices = codes[starts]
+			counts = numpy.diff(starts, append=len(codes)).view(numpy.uint64)
+			del codes, starts
+			self._fold(indices, counts)
+
+	def _fold(self, indices, counts):
+		"""Add a piece's sorted, distinct codes and their counts into the
+			running counts straight away, so only one piece's counts are ever
+			held apart from them."""
+		total = self._sparse
+		if len(total) == 0:
+			self._sparse = NGramVector(self.n, indices, counts, self.hashBits)
+			return
+		pos = numpy.searchsorted(total.indices, indices)
+		found = pos < len(total.indices)
+		found[found] = total.indices[pos[found]] == indices[found]
+		hits = pos[found]
+		total.counts[hits] += counts[found]
+		del hits
+		new = ~found
+		if not new.any():
+			return
+		# Each new code lands before the old codes from its position on, and
+		# after the new codes before it
+		newPos = pos[new]
+		del pos, found
+		newPos += numpy.arange(len(newPos))
+		merged = NGramVector(self.n, numpy.empty(len(total) + len(newPos),
+				dtype=numpy.uint32), numpy.empty(len(total) + len(newPos),
+				dtype=numpy.uint64), self.hashBits)
+		old = numpy.ones(len(merged), dtype=bool)
+		old[newPos] = False
+		merged.indices[newPos] = indices[new]
+		merged.indices[old] = total.indices
+		merged.counts[newPos] = counts[new]
+		merged.counts[old] = total.counts
+		self._sparse = merged
+
+	def vector(self):
+		"""Return an NGramVector of everything counted so far."""
+		if self._dense is not None:
+			return NGramVector.fromDense(self.n, self._dense, self.hashBits)
+		return NGramVector(self.n, self._sparse.indices.copy(),
+				self._sparse.counts.copy(), self.hashBits)
+
+class CSRMatrix:
+
+	"""
+		CSRMatrix stores n-gram vectors as the rows of a compressed sparse row
+		matrix, with one column per possible n-gram code.
+
+		Public parameters:
+			indptr - row i's entries are indices/data[indptr[i]:indptr[i+1]]
+			indices - the n-gram code of each entry, sorted within each row
+			data - the value of each entry, as float64
+			rows - the number of rows
+
+		Public Functions:
+			CSRMatrix.fromVectors(vectors) - stack NGramVectors into a matrix
+			CSRMatrix.rowIds() - return the row of each entry
+			CSRMatrix.dot(features, weights) - multiply by a sparse weight matrix
+		"""
+
+	def __init__(self, indptr, indices, data):
+		self.indptr = indptr
+		self.indices = indices
+		self.data = data
+
+	@property
+	def rows(self):
+		return len(self.indptr) - 1
+
+	@classmethod
+	def fromVectors(cls, vectors, normalize=True):
+		"""Stack NGramVectors as rows, scaling each to unit length if normalize."""
+		vectors = list(vectors)
+		indptr = numpy.zeros(len(vectors) + 1, dtype=numpy.int64)
+		numpy.cumsum([len(vector) for vector in vectors], out=indptr[1:])
+		if len(vectors) == 0:
+			return cls(indptr, numpy.zeros(0, dtype=numpy.uint32),
+					numpy.zeros(0, dtype=numpy.float64))
+		indices = numpy.concatenate([vector.indices for vector in vectors])
+		data = numpy.concatenate([vector.counts for vector in vectors]).astype(
+				numpy.float64)
+		matrix = cls(indptr, indices, data)
+		if normalize and len(data) > 0:
+			norms = numpy.sqrt(numpy.bincount(matrix.rowIds(), weights=data * data,
+					minlength=matrix.rows))
+			norms[norms == 0] = 1
+			matrix.data /= norms[matrix.rowIds()]
+		return matrix
+
+	def rowIds(self):
+		"""Return the row number of every entry."""
+		return numpy.repeat(numpy.arange(self.rows), numpy.diff(self.indptr))
+
+	def dot(self, features, weights):
+		"""Return this matrix times a sparse weight matrix, as a dense array.
+
+			The weight matrix is given as features, a sorted array of n-gram
+			codes, and weights, a dense array with one row per code in features
+			and one column per output.  Codes not in features weigh nothing.
+			"""
+		result = numpy.zeros((self.rows, weights.shape[1]), dtype=numpy.float64)
+		if len(features) == 0 or len(self.indices) == 0:
+			return result
+		pos = numpy.searchsorted(features, self.indices)
+		pos[pos == len(features)] = 0
+		match = features[pos] == self.indices
+		rowIds = self.rowIds()[match]
+		data = self.data[match]
+		pos = pos[match]
+		for column in range(weights.shape[1]):
+			result[:, column] = numpy.bincount(rowIds,
+					weights=data * weights[pos, column], minlength=self.rows)
+		return result
@@ -0,0 +1,89 @@
+import numpy
+
+from Model import FileTypeModel
+from NGram import countNGrams, dimension, hashCodes
+
+class NGramClassifier:
+
+	"""
+		NGramClassifier labels data with the filetype whose n-gram frequencies
+		are most similar to its own, by cosine similarity.
+
+		Public parameters:
+			trainingCorpus - the TrainingCorpus the models were trained from
+			models - the FileTypeModel of each filetype
+			hashBits - the hash bits the models were counted with, or None
+
+		Public Functions:
+			NGramClassifier.classify(data) - return the best filetype name
+			NGramClassifier.scores(vector) - return the similarity of an
+				NGramVector to each model, in the order of models
+			NGramClassifier.profiles(hashBits) - return the models as rows of
+				a dense matrix, each scaled to unit length
+		"""
+
+	def __init__(self, trainingCorpus):
+		self.trainingCorpus = trainingCorpus
+		self.models = list()
+		self._norms = list()
+		for filetype in trainingCorpus.filetypeDefinitions:
+			model = FileTypeModel.load(filetype.filetypeFile)
+			self.models.append(model)
+			self._norms.append(numpy.sqrt(numpy.dot(model.vector.counts,
+					model.vector.counts.astype(numpy.float64))))
+		self.hashBits = None
+		if len(self.models) > 0:
+			self.hashBits = self.models[0].vector.hashBits
+		if any(model.vector.hashBits != self.hashBits for model in self.models):
+			raise ValueError("The models were trained with different hashBits")
+
+	def scores(self, vector):
+		"""Return the cosine similarity of vector to each model."""
+		scores = numpy.zeros(len(self.models), dtype=numpy.float64)
+		counts = vector.counts.astype(numpy.float64)
+		norm = numpy.sqrt(numpy.dot(counts, counts))
+		if norm == 0:
+			return scores
+		for i, model in enumerate(self.models):
+			modelIndices = model.vector.indices
+			if self._norms[i] == 0 or len(modelIndices) == 0:
+				continue
+			pos = numpy.searchsorted(modelIndices, vector.indices)
+			pos[pos == len(modelIndices)] = 0
+			match = modelIndices[pos] == vector.indices
+			dot = numpy.dot(counts[match], model.vector.counts[pos[match]])
+			scores[i] = dot / (norm * self._norms[i])
+		return scores
+
+	def profiles(self, hashBits=None):
+		"""Return a dense matrix with a row per model, each of unit length.
+
+			The dot product of a row with a dense n-gram histogram is that
+			model's score, up to the histogram's own length, which is the same
+			for every model.  Give hashBits to fold the models into 2**hashBits
+			buckets, as NGram.countNGrams does.  Models already trained with
+			hashBits can only be given their own hashBits.
+			"""
+		if self.hashBits is not None and hashBits != self.hashBits:
+			raise ValueError("The models were trained with hashBits %d" %
+					self.hashBits)
+		n = self.trainingCorpus.nValue
+		profiles = numpy.zeros((len(self.models), dimension(n, hashBits)))
+		for i, model in enumerate(self.models):
+			indices = model.vector.indices
+			if hashBits is not None and self.hashBits is None:
+				indices = hashCodes(indices, hashBits)
+			profiles[i] = numpy.bincount(indices,
+					weights=model.vector.counts.astype(numpy.float64),
+					minlength=profiles.shape[1])
+			norm = numpy.sqrt(numpy.dot(profiles[i], profiles[i]))
+			if norm > 0:
+				profiles[i] /= norm
+		return profiles
+
+	def classify(self, data):
+		"""Return the name of the filetype data is most similar to."""
+		if len(self.models) == 0:
+			return ""
+		vector = countNGrams(data, self.trainingCorpus.nValue, self.hashBits)
+		return self.models[int(numpy.argmax(self.scores(vector)))].name
@@ -0,0 +1,116 @@
+import hashlib
+import json
+import os
+import sqlite3
+import time
+
+from NCD import SIZE_CACHE_SUFFIX, CompressedSizeCache
+
+# Files alongside a filetypeFile that also make up a trained model
+_MODEL_SIDECAR_SUFFIXES = (".svm.npz",)
+
+def contentHash(data):
+	"""Return the SHA-256 digest of a bytes-like object."""
+	return hashlib.sha256(data).digest()
+
+def modelFingerprint(trainingCorpus):
+	"""Return a hex digest that changes whenever a trained model changes.
+
+		It covers the corpus's n value and, for every filetype, its name, the
+		size and modification time of its model files, and its NCD prototypes.
+		The compressed sizes cached alongside the prototypes are left out, as
+		classifiers save them as they go without changing any result.
+		"""
+	hasher = hashlib.sha256()
+	hasher.update(str(trainingCorpus.nValue).encode())
+	for filetype in trainingCorpus.filetypeDefinitions:
+		hasher.update(b"\0" + filetype.name.encode())
+		for suffix in ("",) + _MODEL_SIDECAR_SUFFIXES:
+			filename = filetype.filetypeFile + suffix
+			if os.path.exists(filename):
+				fileStat = os.stat(filename)
+				hasher.update(("\0%s\0%d\0%d" % (suffix, fileStat.st_size,
+						fileStat.st_mtime_ns)).encode())
+		hasher.update(("\0%s\0%s" % (SIZE_CACHE_SUFFIX,
+				CompressedSizeCache.prototypesDigest(filetype.filetypeFile +
+				SIZE_CACHE_SUFFIX))).encode())
+	return hasher.hexdigest()
+
+class ResultCache:
+
+	"""
+		ResultCache is an on-disk cache of classification results, keyed by the
+		hash of the bytes classified, the model fingerprint and the classifier.
+
+		It is backed by SQLite, so several processes may share one cache file.
+		Entries made with a different fingerprint for the same classifier are
+		dropped when the cache is opened, and the least recently used entries
+		are evicted once there are more than maxEntries.
+
+		Public parameters:
+			classifierName - the name of the classifier the results come from
+			fingerprint - the fingerprint of the model the results come from
+
+		Public Functions:
+			ResultCache.get(data) - return the cached result for data, or None
+			ResultCache.put(data, result) - cache the result for data
+			ResultCache.evict() - drop the least recently used entries over
+				maxEntries
+			ResultCache.close() - close the cache file
+		"""
+
+	# Eviction is checked every this many puts
+	EVICT_INTERVAL = 1024
+
+	def __init__(self, filename, classifierName, fingerprint,
+			maxEntries=1000000):
+		self.classifierName = classifierName
+		self.fingerprint = fingerprint
+		self.maxEntries = maxEntries
+		self._puts = 0
+		self._db = sqlite3.connect(filename, timeout=60, isolation_level=None)
+		self._db.execute("PRAGMA journal_mode=WAL")
+		self._db.execute("CREATE TABLE IF NOT EXISTS results (" +
+				"hash BLOB, classifier TEXT, fingerprint TEXT, result TEXT, " +
+				"lastUsed INTEGER, PRIMARY KEY (hash, classifier, fingerprint))")
+		self._db.execute("CREATE INDEX IF NOT EXISTS resultsLastUsed " +
+				"ON results (lastUsed)")
+		self._db.execute("DELETE FROM results WHERE classifier = ? AND " +
+				"fingerprint != ?", (classifierName, fingerprint))
+
+	def get(self, data, dataHash=None):
+		"""Return the cached result for data, or None if there isn't one.
+
+			Supply dataHash if contentHash(data) is already known.
+			"""
+		if dataHash is None:
+			dataHash = contentHash(data)
+		key = (dataHash, self.classifierName, self.fingerprint)
+		row = self._db.execute("SELECT result FROM results WHERE hash = ? AND " +
+				"classifier = ? AND fingerprint = ?", key).fetchone()
+		if row is None:
+			return None
+		self._db.execute("UPDATE results SET lastUsed = ? WHERE hash = ? AND " +
+				"classifier = ? AND fingerprint = ?", (time.time_ns(),) + key)
+		return json.loads(row[0])
+
+	def put(self, data, result, dataHash=None):
+		"""Cache a JSON-serializable result for data."""
+		if dataHash is None:
+			dataHash = contentHash(data)
+		self._db.execute("INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?)",
+				(dataHash, self.classifierName, self.fingerprint,
+				json.dumps(result), time.time_ns()))
+		self._puts += 1
+		if self._puts % self.EVICT_INTERVAL == 0:
+			self.evict()
+
+	def evict(self):
+		"""Drop the least recently used entries beyond maxEntries."""
+		self._db.execute("DELETE FROM results WHERE rowid IN (SELECT rowid " +
+				"FROM results ORDER BY lastUsed DESC LIMIT -1 OFFSET ?)",
+				(self.maxEntries,))
+
+	def close(self):
+		"""Close the cache file."""
+		self._db.close()
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+
+import argparse
+
+import numpy
+
+import Instrumentation
+from Corpus import TrainingCorpus
+from Model import FileTypeModel
+from NGram import CSRMatrix, countNGrams
+
+# Each filetype's SVM weights are kept in a file named after its filetypeFile,
+# with this suffix
+WEIGHTS_SUFFIX = ".svm.npz"
+
+def trainSVM(trainingCorpus, regularization=1e-4, iterations=100):
+	"""Train a one-vs-rest linear SVM per filetype, and write the weights out.
+
+		Each training file is one sample, its n-gram counts taken from the
+		per-file records of the trained filetype models, scaled to unit length.
+		Every filetype is trained at once with full-batch Pegasos subgradient
+		steps over the sparse sample matrix.
+		"""
+	filetypes = trainingCorpus.filetypeDefinitions
+	vectors = list()
+	labels = list()
+	hashBits = None
+	for i, filetype in enumerate(filetypes):
+		model = FileTypeModel.load(filetype.filetypeFile)
+		hashBits = model.vector.hashBits
+		for record in model.files.values():
+			vectors.append(record.vector)
+			labels.append(i)
+	samples = CSRMatrix.fromVectors(vectors)
+	features = numpy.unique(samples.indices)
+	columns = numpy.searchsorted(features, samples.indices)
+	rowIds = samples.rowIds()
+
+	targets = -numpy.ones((samples.rows, len(filetypes)))
+	targets[numpy.arange(samples.rows), labels] = 1
+	weights = numpy.zeros((len(features), len(filetypes)))
+	radius = 1 / numpy.sqrt(regularization)
+	for step in range(1, iterations + 1):
+		rate = 1 / (regularization * step)
+		margins = targets * samples.dot(features, weights)
+		# Each sample inside its margin pulls the weights towards its label
+		pulls = (margins < 1) * targets / max(samples.rows, 1)
+		weights *= 1 - rate * regularization
+		for column in range(len(filetypes)):
+			weights[:, column] += rate * numpy.bincount(columns,
+					weights=samples.data * pulls[rowIds, column],
+					minlength=len(features))
+		norms = numpy.sqrt((weights * weights).sum(axis=0))
+		norms[norms == 0] = 1
+		weights *= numpy.minimum(1, radius / norms)
+
+	for i, filetype in enumerate(filetypes):
+		used = numpy.flatnonzero(weights[:, i])
+		numpy.savez(filetype.filetypeFile + WEIGHTS_SUFFIX,
+				features=features[used].astype(numpy.uint32),
+				weights=weights[used, i].astype(numpy.float32),
+				hashBits=-1 if hashBits is None else hashBits)
+
+class SVMClassifier:
+
+	"""
+		SVMClassifier labels data by scoring its n-gram vector against the
+		linear SVM weights of every filetype, keeping the highest score.
+
+		The weights of every filetype are held as one sparse matrix, so a batch
+		of sections is scored against all filetypes with a single sparse matrix
+		product.
+
+		Public parameters:
+			trainingCorpus - the TrainingCorpus the SVMs were trained from
+			features - the sorted n-gram codes with a weight for any filetype
+			weights - a float32 array, one row per feature, one column per filetype
+			hashBits - the hash bits the models were counted with, or None
+
+		Public Functions:
+			SVMClassifier.classify(data) - return the best filetype name
+			SVMClassifier.classifyBatch(datas) - return the best filetype name
+				for each of several pieces of data
+			SVMClassifier.scores(datas) - return each piece of data's score for
+				each filetype
+		"""
+
+	def __init__(self, trainingCorpus):
+		self.trainingCorpus = trainingCorpus
+		self.names = list()
+		self.hashBits = None
+		perFiletype = list()
+		for filetype in trainingCorpus.filetypeDefinitions:
+			with Instrumentation.stage("Model Load"):
+				with numpy.load(filetype.filetypeFile + WEIGHTS_SUFFIX) as svm:
+					perFiletype.append((svm["features"], svm["weights"]))
+					if "hashBits" in svm and int(svm["hashBits"]) >= 0:
+						self.hashBits = int(svm["hashBits"])
+			self.names.append(filetype.name)
+
+		self.features = numpy.zeros(0, dtype=numpy.uint32)
+		for features, _ in perFiletype:
+			self.features = numpy.union1d(self.features, features)
+		self.weights = numpy.zeros((len(self.features), len(perFiletype)),
+				dtype=numpy.float32)
+		for i, (features, weights) in enumerate(perFiletype):
+			self.weights[numpy.searchsorted(self.features, features), i] = weights
+
+	def scores(self, datas):
+		"""Return an array of scores, a row per data, a column per filetype."""
+		n = self.trainingCorpus.nValue
+		samples = CSRMatrix.fromVectors(countNGrams(data, n, self.hashBits)
+				for data in datas)
+		return samples.dot(self.features, self.weights)
+
+	def classifyBatch(self, datas):
+		"""Return the name of the best scoring filetype for each data."""
+		if len(self.names) == 0:
+			return [""] * len(datas)
+		return [self.names[i] for i in numpy.argmax(self.scores(datas), axis=1)]
+
+	def classify(self, data):
+		"""Return the name of the best scoring filetype for data."""
+		return self.classifyBatch([data])[0]
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(
+			description="Train linear SVMs from trained filetype models.")
+	parser.add_argument("trainingCorpus", help="the training corpus config file")
+	parser.add_argument("--regularization", type=float, default=1e-4,
+			help="the SVM regularization strength (default: %(default)s)")
+	parser.add_argument("--iterations", type=int, default=100,
+			help="the number of training steps (default: %(default)s)")
+	Instrumentation.addArguments(parser)
+	args = parser.parse_args(argv)
+
+	with Instrumentation.session(args):
+		with Instrumentation.stage("Train"):
+			trainSVM(TrainingCorpus(filename=args.trainingCorpus),
+					args.regularization, args.iterations)
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,139 @@
+import collections
+import mmap
+import threading
+
+import Instrumentation
+
+class FirmwareReader:
+
+	"""
+		FirmwareReader maps a firmware image into memory once, and hands out
+		zero-copy views of its sections.
+
+		Public parameters:
+			filename - the path to the firmware image
+			size - the size of the image in bytes
+
+		Public Functions:
+			FirmwareReader.section(section) - return a memoryview of a section,
+				section may be a FirmwareSection or a (start, end) bounds tuple
+			FirmwareReader.close() - unmap and close the image
+		"""
+
+	def __init__(self, filename):
+		self.filename = filename
+		self._file = open(filename, "rb")
+		self._map = None
+		try:
+			self.size = self._file.seek(0, 2)
+			if self.size > 0:
+				# mmap can't map empty files
+				self._map = mmap.mmap(self._file.fileno(), 0,
+						access=mmap.ACCESS_READ)
+				self._view = memoryview(self._map)
+			else:
+				self._view = memoryview(b"")
+		except:
+			self._file.close()
+			raise
+
+	def section(self, section):
+		"""Return a memoryview of the bytes in the section's [start, end)."""
+		start, end = getattr(section, "bounds", section)
+		if not (0 <= start <= end <= self.size):
+			raise ValueError("Section bounds (%d, %d) outside of %s (%d bytes)"
+					% (start, end, self.filename, self.size))
+		Instrumentation.count("Section Read", "Sections")
+		Instrumentation.count("Section Read", "Bytes", end - start)
+		return self._view[start:end]
+
+	def close(self):
+		"""Unmap and close the image.
+
+			Every view handed out by section() must be released first.
+			"""
+		self._view.release()
+		if self._map is not None:
+			self._map.close()
+		self._file.close()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *excInfo):
+		self.close()
+
+class ReaderCache:
+
+	"""
+		ReaderCache keeps the most recently used FirmwareReaders open, so that
+		sections of one image share a single mapping.
+
+		A reader can't be closed while views of it are in use, so a caller
+		keeping views past its next get() should hold() the reader instead,
+		and release() it once its views are released.  Held readers are never
+		closed to make room, so more than maxOpen may be open while they are
+		held.  A ReaderCache may be shared between threads.
+
+		Public Functions:
+			ReaderCache.get(filename) - return an open reader for filename
+			ReaderCache.hold(filename) - return an open reader for filename, kept
+				open until released
+			ReaderCache.release(filename) - let a held reader be closed again
+			ReaderCache.close() - close every cached reader
+		"""
+
+	def __init__(self, maxOpen=8):
+		self.maxOpen = maxOpen
+		self._readers = collections.OrderedDict()
+		self._holds = collections.Counter()
+		self._lock = threading.RLock()
+
+	def get(self, filename):
+		"""Return an open FirmwareReader for filename."""
+		with self._lock:
+			return self._get(filename)
+
+	def _get(self, filename):
+		if filename in self._readers:
+			self._readers.move_to_end(filename)
+			return self._readers[filename]
+		self._evict(1)
+		reader = FirmwareReader(filename)
+		self._readers[filename] = reader
+		return reader
+
+	def hold(self, filename):
+		"""Return an open FirmwareReader for filename, which stays open until
+			release(filename) is called as many times as hold(filename)."""
+		with self._lock:
+			reader = self._get(filename)
+			self._holds[filename] += 1
+			return reader
+
+	def release(self, filename):
+		"""Undo one hold(filename), closing readers beyond maxOpen if they
+			are no longer held."""
+		with self._lock:
+			self._holds[filename] -= 1
+			if self._holds[filename] <= 0:
+				del self._holds[filename]
+				self._evict()
+
+	def _evict(self, room=0):
+		"""Close the least recently used readers that aren't held, until
+			there's room for this many more without going over maxOpen."""
+		excess = len(self._readers) + room - self.maxOpen
+		for filename in list(self._readers):
+			if excess <= 0:
+				break
+			if self._holds[filename] == 0:
+				self._readers.pop(filename).close()
+				excess -= 1
+
+	def close(self):
+		"""Close every cached reader."""
+		with self._lock:
+			self._holds.clear()
+			while len(self._readers) > 0:
+				self._readers.popitem()[1].close()
@@ -0,0 +1,332 @@
+#!/usr/bin/env python3
+
+import argparse
+import os
+
+import numpy
+
+import Instrumentation
+from Corpus import TestCorpus, Firmware, FirmwareSection, TrainingCorpus
+from NGram import dimension, hashCodes, nGramCodes
+from NGramClassifier import NGramClassifier
+from ResultCache import ResultCache, contentHash, modelFingerprint
+from SectionReader import FirmwareReader
+
+# Window histograms with more possible n-grams than 2**DEFAULT_HASH_BITS are
+# hashed into that many buckets
+DEFAULT_HASH_BITS = 16
+# The stride of the first pass of coarse-to-fine segmentation
+DEFAULT_COARSE_STRIDE = 64 * 1024
+
+class SlidingHistogram:
+
+	"""
+		SlidingHistogram keeps the n-gram histogram of a window sliding over
+		some data, and the window's score against a set of profiles.
+
+		Advancing the window removes the n-grams leaving it and adds those
+		entering it, so each step costs the size of the step, not the window.
+
+		Public parameters:
+			start - the offset of the window in the data
+			counts - the dense n-gram histogram of the window
+			scores - the dot product of counts with each profile
+
+		Public Functions:
+			SlidingHistogram.advance(step) - move the window step bytes on
+		"""
+
+	# Scores are recomputed exactly this often, so rounding can't build up
+	RESYNC_STEPS = 1024
+	# N-gram codes are computed this many offsets ahead of the window at once
+	CODE_BLOCK = 1 << 20
+
+	def __init__(self, data, n, windowSize, profiles, hashBits=None):
+		self.data = data
+		self.n = n
+		self.windowSize = windowSize
+		self.hashBits = hashBits
+		self.profiles = profiles
+		self.start = 0
+		self._codeStart = 0
+		self._codeBlock = numpy.zeros(0, dtype=numpy.intp)
+		self.counts = numpy.bincount(self._codes(0, windowSize - n + 1),
+				minlength=dimension(n, hashBits)).astype(numpy.int64)
+		self.scores = profiles.dot(self.counts)
+		self._steps = 0
+
+	def _codes(self, start, end):
+		"""Return the codes of the n-grams starting at offsets [start, end)."""
+		if (start < self._codeStart or
+				end > self._codeStart + len(self._codeBlock)):
+			# Work out the codes from here to a block past the window's end
+			blockEnd = start + self.windowSize + self.CODE_BLOCK
+			codes = nGramCodes(self.data[start:blockEnd + self.n - 1], self.n)
+			if self.hashBits is not None:
+				codes = hashCodes(codes, self.hashBits)
+			self._codeStart = start
+			self._codeBlock = codes.astype(numpy.intp)
+		return self._codeBlock[start - self._codeStart:end - self._codeStart]
+
+	def advance(self, step):
+		"""Move the window step bytes further into the data."""
+		leaving = self._codes(self.start, self.start + step)
+		entering = self._codes(self.start + self.windowSize - self.n + 1,
+				self.start + self.windowSize - self.n + 1 + step)
+		self.start += step
+		numpy.subtract.at(self.counts, leaving, 1)
+		numpy.add.at(self.counts, entering, 1)
+		self._steps += 1
+		if self._steps % self.RESYNC_STEPS == 0:
+			self.scores = self.profiles.dot(self.counts)
+		else:
+			self.scores += (self.profiles[:, entering].sum(axis=1) -
+					self.profiles[:, leaving].sum(axis=1))
+
+def mergeLabels(centres, labels, names, size):
+	"""Return FirmwareSections covering [0, size) from labelled points.
+
+		centres are the sorted offsets the labels were taken at.  Neighbouring
+		points with the same label are merged, and a section boundary is placed
+		halfway between neighbouring points whose labels differ.
+		"""
+	sections = list()
+	if len(labels) == 0:
+		return sections
+	changes = numpy.flatnonzero(labels[1:] != labels[:-1]) + 1
+	boundaries = [0]
+	boundaries.extend(int((centres[i - 1] + centres[i]) // 2) for i in changes)
+	boundaries.append(size)
+	firsts = numpy.concatenate(([0], changes))
+	for start, end, first in zip(boundaries[:-1], boundaries[1:], firsts):
+		sections.append(FirmwareSection({"Start": start, "End": end,
+				"Filetype": names[labels[first]]}))
+	return sections
+
+def boundaryError(sections, referenceSections):
+	"""Return the mean distance from each reference boundary to the nearest
+		boundary in sections, in bytes.
+
+		Only the boundaries between sections count, not the start and end of
+		the image.  Returns 0 when the reference has no boundaries.
+		"""
+	reference = numpy.array([section.bounds[0]
+			for section in referenceSections[1:]])
+	proposed = numpy.array([section.bounds[0] for section in sections[1:]])
+	if len(reference) == 0:
+		return 0.0
+	if len(proposed) == 0:
+		return float("inf")
+	pos = numpy.searchsorted(proposed, reference)
+	before = proposed[numpy.maximum(pos - 1, 0)]
+	after = proposed[numpy.minimum(pos, len(proposed) - 1)]
+	nearest = numpy.minimum(numpy.abs(before - reference),
+			numpy.abs(after - reference))
+	return float(nearest.mean())
+
+class Segmenter:
+
+	"""
+		Segmenter proposes the sections of a firmware image, by sliding a window
+		over it, labelling each window position with the most similar filetype,
+		and merging neighbouring windows with the same label.
+
+		In coarse-to-fine mode, windows are first labelled coarseStride bytes
+		apart, and then only the gaps between windows with different labels are
+		bisected, until the labelled windows are no more than step bytes apart.
+		Long uniform regions cost a handful of window labels, rather than one per
+		step.
+
+		Given a cache file, the sections proposed for an image are cached by the
+		image's contents, the model fingerprint and the segmentation settings, so
+		an unchanged image is not segmented again.
+
+		Public parameters:
+			classifier - the NGramClassifier whose models label the windows
+			windowSize - the number of bytes in a window
+			step - the number of bytes the window moves each time
+			coarseStride - the first stride of coarse-to-fine segmentation
+			cacheFilename - the ResultCache file to use, or None
+			calls - the number of windows labelled by the last segmentation
+
+		Public Functions:
+			Segmenter.labelWindows(data) - return the centre offset and label
+				index of each window position
+			Segmenter.labelCoarseToFine(data) - the same, in coarse-to-fine mode
+			Segmenter.segment(data, coarseToFine) - return a list of proposed
+				FirmwareSections
+			Segmenter.segmentFile(filename) - return a Firmware with the
+				proposed sections of an image
+		"""
+
+	def __init__(self, classifier, windowSize=4096, step=512,
+			hashBits=DEFAULT_HASH_BITS, coarseStride=DEFAULT_COARSE_STRIDE,
+			cacheFilename=None):
+		self.classifier = classifier
+		self.windowSize = windowSize
+		self.step = step
+		self.coarseStride = coarseStride
+		self.cacheFilename = cacheFilename
+		self.calls = 0
+		self._caches = dict()
+		self._fingerprint = None
+		if cacheFilename is not None:
+			self._fingerprint = modelFingerprint(classifier.trainingCorpus)
+		self.n = classifier.trainingCorpus.nValue
+		self.hashBits = None
+		if dimension(self.n) > dimension(self.n, hashBits):
+			self.hashBits = hashBits
+		if classifier.hashBits is not None:
+			# Hashed models can only be matched against the same hashing
+			self.hashBits = classifier.hashBits
+		self.names = [model.name for model in classifier.models]
+		self.profiles = classifier.profiles(self.hashBits)
+
+	def labelWindows(self, data):
+		"""Return arrays of each window's centre offset and label index."""
+		size = len(data)
+		if size < self.windowSize:
+			if size < self.n or len(self.names) == 0:
+				return numpy.zeros(0, dtype=int), numpy.zeros(0, dtype=int)
+			window = SlidingHistogram(data, self.n, size, self.profiles,
+					self.hashBits)
+			self.calls = 1
+			return (numpy.array([size // 2]),
+					numpy.array([numpy.argmax(window.scores)]))
+
+		if len(self.names) == 0:
+			return numpy.zeros(0, dtype=int), numpy.zeros(0, dtype=int)
+		positions = (size - self.windowSize) // self.step + 1
+		self.calls = positions
+		labels = numpy.zeros(positions, dtype=int)
+		window = SlidingHistogram(data, self.n, self.windowSize, self.profiles,
+				self.hashBits)
+		labels[0] = numpy.argmax(window.scores)
+		for i in range(1, positions):
+			window.advance(self.step)
+			labels[i] = numpy.argmax(window.scores)
+		centres = numpy.arange(positions) * self.step + self.windowSize // 2
+		return centres, labels
+
+	def _labelAt(self, data, centre):
+		"""Return the label index of the window centred on centre."""
+		start = min(max(centre - self.windowSize // 2, 0),
+				max(len(data) - self.windowSize, 0))
+		codes = nGramCodes(data[start:start + self.windowSize], self.n)
+		if self.hashBits is not None:
+			codes = hashCodes(codes, self.hashBits)
+		self.calls += 1
+		return int(numpy.argmax(self.profiles[:, codes].sum(axis=1)))
+
+	def labelCoarseToFine(self, data):
+		"""Return arrays of window centres and label indices, coarse-to-fine."""
+		size = len(data)
+		if size < self.windowSize:
+			return self.labelWindows(data)
+		if len(self.names) == 0:
+			return numpy.zeros(0, dtype=int), numpy.zeros(0, dtype=int)
+		self.calls = 0
+		first = self.windowSize // 2
+		last = size - self.windowSize // 2
+		centres = list(range(first, last, self.coarseStride)) + [last]
+		labels = dict((centre, self._labelAt(data, centre)) for centre in centres)
+
+		# Bisect every gap whose ends disagree, until it is within a step
+		gaps = list(zip(centres[:-1], centres[1:]))
+		while len(gaps) > 0:
+			left, right = gaps.pop()
+			if labels[left] == labels[right] or right - left <= self.step:
+				continue
+			middle = (left + right) // 2
+			labels[middle] = self._labelAt(data, middle)
+			gaps.append((left, middle))
+			gaps.append((middle, right))
+
+		centres = numpy.array(sorted(labels))
+		return centres, numpy.array([labels[centre] for centre in centres])
+
+	def segment(self, data, coarseToFine=False):
+		"""Return the proposed FirmwareSections of data."""
+		with Instrumentation.stage("Segment"):
+			if coarseToFine:
+				centres, labels = self.labelCoarseToFine(data)
+			else:
+				centres, labels = self.labelWindows(data)
+			Instrumentation.count("Segment", "Bytes", len(data))
+			Instrumentation.count("Segment", "Windows", self.calls)
+			return mergeLabels(centres, labels, self.names, len(data))
+
+	def _resultCache(self, coarseToFine):
+		"""Return the result cache for the current settings."""
+		name = "Segmenter(window=%d, step=%d, coarseStride=%s)" % (
+				self.windowSize, self.step,
+				self.coarseStride if coarseToFine else None)
+		if name not in self._caches:
+			self._caches[name] = ResultCache(self.cacheFilename, name,
+					self._fingerprint)
+		return self._caches[name]
+
+	def segmentFile(self, filename, coarseToFine=False):
+		"""Return a Firmware holding the proposed sections of an image."""
+		firmware = Firmware({"Name": os.path.basename(filename),
+				"Filename": filename})
+		with FirmwareReader(filename) as reader:
+			with reader.section((0, reader.size)) as data:
+				if self.cacheFilename is None:
+					sections = self.segment(data, coarseToFine)
+				else:
+					cache = self._resultCache(coarseToFine)
+					dataHash = contentHash(data)
+					sections = cache.get(data, dataHash)
+					if sections is None:
+						sections = [section._toDict()
+								for section in self.segment(data, coarseToFine)]
+						cache.put(data, sections, dataHash)
+				for section in sections:
+					firmware.appendFirmwareSection(section)
+		return firmware
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(
+			description="Propose the sections of firmware images.")
+	parser.add_argument("trainingCorpus", help="the training corpus config file")
+	parser.add_argument("output", help="the test corpus config to write")
+	parser.add_argument("firmware", nargs="+", help="the firmware images")
+	parser.add_argument("-w", "--window", type=int, default=4096,
+			help="window size in bytes (default: %(default)s)")
+	parser.add_argument("-s", "--step", type=int, default=512,
+			help="window step in bytes (default: %(default)s)")
+	parser.add_argument("--coarse", type=int, metavar="STRIDE",
+			help="segment coarse-to-fine, starting at this stride")
+	parser.add_argument("--cache", help="a result cache file to use")
+	parser.add_argument("--compare", action="store_true",
+			help="also run the full scan, and report the coarse-to-fine " +
+			"window count and boundary error against it (needs --coarse, " +
+			"and doesn't use the cache, so the window counts are measured)")
+	Instrumentation.addArguments(parser)
+	args = parser.parse_args(argv)
+	if args.compare and args.coarse is None:
+		# Otherwise the full scan would only be compared against itself
+		parser.error("--compare needs --coarse")
+
+	with Instrumentation.session(args):
+		# A cached result has no window count to compare
+		segmenter = Segmenter(NGramClassifier(TrainingCorpus(
+				filename=args.trainingCorpus)), args.window, args.step,
+				cacheFilename=None if args.compare else args.cache)
+		if args.coarse is not None:
+			segmenter.coarseStride = args.coarse
+		corpus = TestCorpus(name="Proposed sections")
+		for filename in args.firmware:
+			firmware = segmenter.segmentFile(filename, args.coarse is not None)
+			corpus.appendFirmware(firmware)
+			if args.compare:
+				coarseCalls = segmenter.calls
+				fullSections = segmenter.segmentFile(filename).sections
+				print("%s: %d windows coarse-to-fine, %d full, boundary error "
+						"%.1f bytes" % (filename, coarseCalls, segmenter.calls,
+						boundaryError(firmware.sections, fullSections)))
+		corpus.writeOut(args.output)
+
+if __name__ == "__main__":
+	main()
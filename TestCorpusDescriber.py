@@ -3,8 +3,11 @@
 import os.path
 
 from GenericWidgets import Frame, Root, Checkbutton, Button, Entry, Label
-from GenericWidgets import Listbox, FileDialog, Toplevel
+from GenericWidgets import FileDialog, Toplevel
+from BackgroundTasks import TaskRunner
 from Corpus import TestCorpus, Firmware, FirmwareSection
+from Ingest import CorpusIngest
+from VirtualList import VirtualListbox
 
 class TestCorpusDescriberWindow(Frame):
 	def __init__(self, parent, coordinator=None):
@@ -15,10 +18,14 @@ class TestCorpusDescriberWindow(Frame):
 		self.coordinator = coordinator
 		self.firmwareDict = dict() # firmware objects by key basename
 		self.sectionDict = dict() # section objects by key bounds
+		self.corpus = TestCorpus() # kept between saves, to save just changes
+		self.ingest = CorpusIngest() # spots firmware added twice
+		self.tasks = TaskRunner(self) # runs file work off the main loop
+		self.pendingFirmware = set() # basenames still being ingested
 
 		# Setup the window objects
 		# First, the firmware list
-		self.__firmwareList = Listbox(self,
+		self.__firmwareList = VirtualListbox(self,
 				listChangeCallback=self._firmwareSelectionChangeCallback)
 		self.__firmwareList.grid({"row": 0, "column": 0, "rowspan": 10,
 				"sticky": "nswe"})
@@ -36,8 +43,9 @@ class TestCorpusDescriberWindow(Frame):
 		self.__addFirmwareButton.grid({"row": 0, "column": 2})
 		
 		# Second, the section list
-		self.__sectionList = Listbox(self,
-				listChangeCallback=self._sectionSelectionChangeCallback)
+		self.__sectionList = VirtualListbox(self,
+				listChangeCallback=self._sectionSelectionChangeCallback,
+				formatItem=lambda bounds: "%d - %d" % bounds)
 		self.__sectionList.grid({"row": 0, "column": 1, "rowspan": 9,
 				"sticky": "nsew"})
 
@@ -125,6 +133,17 @@ class TestCorpusDescriberWindow(Frame):
 				text="Write Config", callback = self._writeConfigButtonCallback)
 		self.__writeConfigButton.grid({"row": 0, "column": 0})
 
+		self.__cancelButton = Button(self.__globalButtonFrame,
+				text="Cancel", callback=self._cancelButtonCallback)
+		self.__cancelButton.grid({"row": 0, "column": 1})
+
+		self.__statusLabel = Label(self.__globalButtonFrame, text="")
+		self.__statusLabel.grid({"row": 1, "column": 0, "columnspan": 2})
+
+	def setStatus(self, message):
+		"""Show a message about the background work."""
+		self.__statusLabel.text = message
+
 	def getCorpusOutputFile(self):
 		"""Return the filename to save the config to."""
 		fd = FileDialog(self)
@@ -137,12 +156,12 @@ class TestCorpusDescriberWindow(Frame):
 		if len(curSelection) > 0:
 			self._storeCurrentFirmwareEntries(curSelection[0])
 		# Build the corpus object
-		name = self.__corpusNameEntry.text
-		description = self.__corpusDescriptionEntry.text
-		corpus = TestCorpus(name, description)
-		for firmwareKey in self.firmwareDict:
-			corpus.appendFirmware(self.firmwareDict[firmwareKey])
-		return corpus
+		# The same Firmware objects are used each time, so unchanged ones stay
+		# clean and aren't written again by an incremental save
+		self.corpus.name = self.__corpusNameEntry.text
+		self.corpus.description = self.__corpusDescriptionEntry.text
+		self.corpus.firmwareDefinitions = list(self.firmwareDict.values())
+		return self.corpus
 
 	def _clearFirmwareScreenEntries(self):
 		self.__firmwareNameEntry.text = ""
@@ -185,29 +204,35 @@ class TestCorpusDescriberWindow(Frame):
 			self.__sectionFiletypeEntry.text = ""
 
 	def _storeCurrentFirmwareEntries(self, firmwareKey):
-		"""Store the current screen info into the firmwareDict, at the key."""
+		"""Store the current screen info into the firmwareDict, at the key.
+
+			The firmware is updated in place, and only what was edited is set,
+			so it is only marked dirty if something changed.
+			"""
 		curSelection = self.__sectionList.getSelected()
 		if len(curSelection) > 0:
 			self._storeCurrentSectionEntries(curSelection[0])
-		firmwareDef = dict()
-		firmwareDef["Name"] = self.__firmwareNameEntry.text
-		firmwareDef["Filename"] = self.__firmwareFileNameEntry.text
-		firmwareDef["Sections"] = list(self.sectionDict.values())
-		self.firmwareDict[firmwareKey] = Firmware(firmwareDef)
+		firmware = self.firmwareDict[firmwareKey]
+		if firmware.name != self.__firmwareNameEntry.text:
+			firmware.name = self.__firmwareNameEntry.text
+		if firmware.filename != self.__firmwareFileNameEntry.text:
+			firmware.filename = self.__firmwareFileNameEntry.text
+		# Section edits already went to the firmware's own sections
 
 	def _storeCurrentSectionEntries(self, sectionKey):
 		"""Store the current section info on the screen."""
 		if sectionKey in self.sectionDict:
 			sectionDef = self.sectionDict[sectionKey]
-			sectionDef.filetype = self.__sectionFiletypeEntry.text
-			self.sectionDict[sectionKey] = sectionDef
+			if sectionDef.filetype != self.__sectionFiletypeEntry.text:
+				sectionDef.filetype = self.__sectionFiletypeEntry.text
 
 	def _deleteFirmwareButtonCallback(self):
 		# Delete the selected firmware
 		firmware = self.__firmwareList.getSelected()
 		self.__firmwareList.removeSelected()
 		for fw in firmware:
-			self.firmwareDict.pop(fw)
+			# So the same image can be added again
+			self.ingest.removeFirmware(self.firmwareDict.pop(fw))
 		self._clearFirmwareScreenEntries()
 
 	def _addFirmwareButtonCallback(self):
@@ -216,28 +241,93 @@ class TestCorpusDescriberWindow(Frame):
 		firmwareName = fd.getFilenameToOpen()
 		firmwarePath = os.path.realpath(firmwareName)
 		basename = os.path.basename(firmwarePath)
-		if (firmwareName != "") and (basename not in self.firmwareDict):
-			self.firmwareDict[basename] = Firmware({"Name": basename,
-					"Filename": firmwarePath})
-			self.__firmwareList.append(basename)
+		if ((firmwareName != "") and (basename not in self.firmwareDict) and
+				(basename not in self.pendingFirmware)):
+			firmware = Firmware({"Name": basename, "Filename": firmwarePath})
+			self.pendingFirmware.add(basename)
+
+			def ingest(task):
+				return self.ingest.addFirmware(firmware,
+						lambda done, total: task.progress(done, total,
+						"Hashing " + basename))
+
+			def ingested(original):
+				self.pendingFirmware.discard(basename)
+				# Skip images with the same contents as one already added
+				if original is None:
+					self.firmwareDict[basename] = firmware
+					self.__firmwareList.append(basename)
+					self.setStatus("Added " + basename)
+				else:
+					self.setStatus(basename + " duplicates " + original.name)
+
+			def cancelled():
+				self.pendingFirmware.discard(basename)
+				self.setStatus("Didn't add " + basename)
+
+			def failed(error):
+				self.pendingFirmware.discard(basename)
+				self.setStatus("Couldn't add %s: %s" % (basename, error))
+
+			self.tasks.submit(ingest, name=basename, onDone=ingested,
+					onProgress=self._showProgress, onCancelled=cancelled,
+					onError=failed)
+
+	def _showProgress(self, done, total, message):
+		"""Show a background task's progress."""
+		if total:
+			self.setStatus("%s: %d%%" % (message, 100 * done // total))
+		else:
+			self.setStatus(message)
+
+	def _cancelButtonCallback(self):
+		"""Stop all the background work."""
+		self.tasks.cancelAll()
+
+	def _selectedFirmware(self):
+		"""Return the Firmware selected in the firmware list, or None."""
+		curSelection = self.__firmwareList.getSelected()
+		if len(curSelection) == 0:
+			return None
+		return self.firmwareDict[curSelection[0]]
 
 	def _deleteSectionCallback(self):
 		"""Delete the selected section."""
+		firmware = self._selectedFirmware()
 		curSelection = self.__sectionList.getSelected()
+		if firmware is None or len(curSelection) == 0:
+			return
 		self.__sectionList.removeSelected()
-		for sec in curSelection:
-			self.sectionDict.pop(sec)
+		# Highest row first, so the rows still to delete don't move
+		for index in sorted((self.sectionDict[sec].index for sec in curSelection),
+				reverse=True):
+			del firmware.sections[index]
+		# The rows after those deleted moved up, so their views are remade
+		self.sectionDict = dict([(sec.bounds, sec) for sec in firmware.sections])
 		self._clearSectionScreenEntries()
 
 	def _addSectionCallback(self):
-		"""Add a section to the section list."""
-		setupDict = dict()
-		setupDict["Start"] = int(self.__sectionStartEntry.text)
-		setupDict["End"] = int(self.__sectionEndEntry.text)
-		fw = FirmwareSection(setupDict)
-		if fw.bounds not in self.sectionDict:
-			self.sectionDict[fw.bounds] = fw
-			self.__sectionList.append(fw.bounds)
+		"""Add a section to the selected firmware and the section list."""
+		firmware = self._selectedFirmware()
+		if firmware is None:
+			self.setStatus("Select a firmware to add the section to")
+			return
+		try:
+			setupDict = dict()
+			setupDict["Start"] = int(self.__sectionStartEntry.text)
+			setupDict["End"] = int(self.__sectionEndEntry.text)
+			fw = FirmwareSection(setupDict)
+			if fw.bounds in self.sectionDict:
+				return
+			# The firmware's table finds any section it overlaps with a search,
+			# and refuses sections that run backwards
+			firmware.sections.append(fw)
+		except ValueError as error:
+			self.setStatus("Couldn't add section: %s" % error)
+			return
+		self.sectionDict[fw.bounds] = firmware.sections[len(firmware.sections) - 1]
+		self.__sectionList.append(fw.bounds)
+		self.setStatus("")
 
 	def _writeConfigButtonCallback(self):
 		# Tell the coordinator to write out the configuration
@@ -253,7 +343,18 @@ class TestCorpusDescriberCoordinator():
 		corpus = self.window.getDefinedCorpus()
 		outputFile = self.window.getCorpusOutputFile()
 		if outputFile != "":
-			corpus.writeOut(outputFile)
+			# Take what's to be written here, so edits made while the background
+			# task writes it are neither written half-done nor marked saved
+			save = corpus.prepareSave(outputFile)
+			self.window.setStatus("Writing " + outputFile)
+			self.window.tasks.submit(lambda task: save(),
+					name=outputFile,
+					onDone=lambda result: self.window.setStatus("Wrote " +
+					outputFile),
+					onCancelled=lambda: self.window.setStatus("Didn't write " +
+					outputFile),
+					onError=lambda error: self.window.setStatus(
+					"Couldn't write %s: %s" % (outputFile, error)))
 
 class TestCorpusDescriberSubwindow(Toplevel):
 	def __init__(self, parent, closeCallback=None):
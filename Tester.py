@@ -0,0 +1,336 @@
+#!/usr/bin/env python3
+
+import argparse
+import hashlib
+import importlib
+import json
+import multiprocessing
+import os
+import threading
+
+import Instrumentation
+from Corpus import TestCorpus, TrainingCorpus
+from ResultCache import ResultCache, contentHash, modelFingerprint
+from SectionReader import ReaderCache
+
+# The classifier used when none is named
+DEFAULT_CLASSIFIER = "NGramClassifier.NGramClassifier"
+
+# The classifier, open firmware images and result cache of each worker, set
+# by _initWorker
+_workerClassifier = None
+_workerReaders = None
+_workerCache = None
+
+def loadClassifierClass(classifierSpec):
+	"""Return the classifier class named by a "Module.Class" spec.
+
+		A classifier class is constructed with a TrainingCorpus, and must
+		provide classify(data) which returns the name of the filetype the bytes
+		in data most likely belong to.  data is a bytes-like object, usually a
+		memoryview into the mapped firmware image.  A classifier may also provide
+		classifyBatch(datas), returning a list of names, to classify many
+		sections at once.
+		"""
+	moduleName, _, className = classifierSpec.rpartition(".")
+	if moduleName == "":
+		raise ValueError("Classifier must be given as Module.Class: " +
+				classifierSpec)
+	return getattr(importlib.import_module(moduleName), className)
+
+def _initWorker(classifierSpec, trainingCorpusFile, cacheFilename=None,
+		fingerprint=None, instrument=False):
+	"""Load the trained model once per worker process."""
+	global _workerClassifier, _workerReaders, _workerCache
+	Instrumentation.initWorker(instrument)
+	_workerReaders = ReaderCache()
+	classifierClass = loadClassifierClass(classifierSpec)
+	_workerClassifier = classifierClass(TrainingCorpus(
+			filename=trainingCorpusFile))
+	if cacheFilename is not None:
+		_workerCache = ResultCache(cacheFilename, classifierSpec, fingerprint)
+
+def _classify(datas):
+	"""Classify several pieces of data with the worker's classifier."""
+	with Instrumentation.stage("Classify"):
+		Instrumentation.count("Classify", "Sections", len(datas))
+		if hasattr(_workerClassifier, "classifyBatch"):
+			return _workerClassifier.classifyBatch(datas)
+		return [_workerClassifier.classify(data) for data in datas]
+
+def _classifyBatch(jobs):
+	"""Classify a batch of section jobs, returning (sequence, result
+		dictionary) pairs, and the worker's instrumentation since its last
+		batch."""
+	sequences = list()
+	results = list()
+	datas = list()
+	# The readers of a batch are held until its views are released, so none
+	# is closed under them however many images the batch spans
+	held = list()
+	try:
+		for sequence, firmwareName, filename, bounds, filetype in jobs:
+			sequences.append(sequence)
+			result = dict()
+			result["Firmware"] = firmwareName
+			result["Filename"] = filename
+			result["Start"] = bounds[0]
+			result["End"] = bounds[1]
+			result["Filetype"] = filetype
+			results.append(result)
+			reader = _workerReaders.hold(filename)
+			held.append(filename)
+			datas.append(reader.section(bounds))
+		if _workerCache is None:
+			classifications = _classify(datas)
+		else:
+			hashes = [contentHash(data) for data in datas]
+			classifications = [_workerCache.get(data, dataHash)
+					for data, dataHash in zip(datas, hashes)]
+			misses = [i for i, classification in enumerate(classifications)
+					if classification is None]
+			for i, classification in zip(misses,
+					_classify([datas[i] for i in misses])):
+				classifications[i] = classification
+				_workerCache.put(datas[i], classification, hashes[i])
+	finally:
+		for data in datas:
+			data.release()
+		for filename in held:
+			_workerReaders.release(filename)
+	for result, classification in zip(results, classifications):
+		result["Classification"] = classification
+	return list(zip(sequences, results)), Instrumentation.drain()
+
+class _SectionDeduper:
+
+	"""
+		_SectionDeduper tracks the sections with each content hash during a
+		deduplicated run, so only the first is classified.
+
+		Sections are added from the pool's feeder thread as the firmware are
+		read, and results recorded from run(), so the state is under a lock.
+		A section whose bytes are still being classified joins that group, and
+		one whose bytes were already classified is ready to write at once.
+		"""
+
+	def __init__(self):
+		self._lock = threading.Lock()
+		self._groups = dict() # pairs waiting on a classification, by hash
+		self._results = dict() # classified results, by hash
+		self._ready = list() # (result, pairs) that can be written
+
+	def add(self, digest, pair):
+		"""Add a (firmware, section) pair, returning a new group to classify,
+			or None if its bytes are already being classified."""
+		with self._lock:
+			if digest in self._results:
+				self._ready.append((self._results[digest], [pair]))
+				return None
+			if digest in self._groups:
+				self._groups[digest].append(pair)
+				return None
+			group = [pair]
+			self._groups[digest] = group
+			return group
+
+	def finish(self, digest, result):
+		"""Record the result for a hash, returning every pair that has it."""
+		with self._lock:
+			self._results[digest] = result
+			return self._groups.pop(digest)
+
+	def takeReady(self):
+		"""Return the (result, pairs) whose bytes were already classified."""
+		with self._lock:
+			ready = self._ready
+			self._ready = list()
+			return ready
+
+class Tester:
+
+	"""
+		Tester classifies every section of every firmware in a test corpus.
+
+		The sections are classified across a pool of worker processes, and each
+		result is written to the output file as a line of JSON as soon as it is
+		available.  Given a cache file, sections whose bytes were already
+		classified with the same classifier and model are not classified again.
+		With dedupe set, each section is hashed as its firmware is read, and
+		sections with the same bytes are only classified once within the run.
+
+		testCorpus may be the filename of a test corpus config instead of a
+		TestCorpus, in which case its firmware are read from the config as
+		classification goes, so the workers start on the first sections while
+		the rest of the config is still being read.
+
+		Public parameters:
+			testCorpus - the TestCorpus to classify, or its config filename
+			trainingCorpusFile - the training corpus config the model is built from
+			classifierSpec - the "Module.Class" name of the classifier to use
+			workers - the number of worker processes, or None for one per CPU
+			batchSize - the number of sections handed to a worker at a time
+			cacheFilename - the ResultCache file to use, or None
+			dedupe - whether to classify identical sections only once
+
+		Public Functions:
+			Tester.run(outputFilename, progressCallback) - classify the corpus,
+				return the number of sections classified
+		"""
+
+	def __init__(self, testCorpus, trainingCorpusFile, classifierSpec,
+			workers=None, batchSize=16, cacheFilename=None, dedupe=False):
+		self.testCorpus = testCorpus
+		self.trainingCorpusFile = trainingCorpusFile
+		self.classifierSpec = classifierSpec
+		self.workers = workers
+		self.batchSize = batchSize
+		self.cacheFilename = cacheFilename
+		self.dedupe = dedupe
+
+	def _firmware(self):
+		"""Return an iterable of the Firmware in the test corpus."""
+		if isinstance(self.testCorpus, str):
+			return TestCorpus.iterFirmware(self.testCorpus)
+		return self.testCorpus.firmwareDefinitions
+
+	def _sectionGroups(self, deduper=None):
+		"""Yield (hash, group) for each list of (firmware, section) pairs to
+			classify together, as the firmware are read.
+
+			Without a deduper, every section is in a group of its own, and the
+			hash is None.  With one, each section is hashed and added to it,
+			and only the groups it starts are yielded.
+			"""
+		if deduper is None:
+			for firmware in self._firmware():
+				for section in firmware.sections:
+					yield None, [(firmware, section)]
+			return
+		readers = ReaderCache()
+		try:
+			for firmware in self._firmware():
+				reader = readers.get(firmware.filename)
+				for section in firmware.sections:
+					with reader.section(section) as data:
+						digest = hashlib.sha256(data).digest()
+					group = deduper.add(digest, (firmware, section))
+					if group is not None:
+						yield digest, group
+		finally:
+			readers.close()
+
+	def _batches(self, groups, groupBySequence):
+		"""Yield lists of up to batchSize jobs, one per (hash, group).
+
+			Each job starts with a sequence number, under which its hash and
+			group are added to groupBySequence, so its results can be found
+			again.  This
+			runs in the pool's feeder thread, so each key is only ever added
+			here and removed by run().
+			"""
+		batch = list()
+		for sequence, (digest, group) in enumerate(groups):
+			firmware, section = group[0]
+			job = (sequence, firmware.name, firmware.filename,
+					tuple(section.bounds), section.filetype)
+			groupBySequence[sequence] = (digest, group)
+			batch.append(job)
+			if len(batch) == self.batchSize:
+				yield batch
+				batch = list()
+		if len(batch) > 0:
+			yield batch
+
+	@staticmethod
+	def _groupResults(result, group):
+		"""Yield a copy of a group's classified result for each of its sections."""
+		for firmware, section in group:
+			groupResult = dict(result)
+			groupResult["Firmware"] = firmware.name
+			groupResult["Filename"] = firmware.filename
+			groupResult["Start"] = section.bounds[0]
+			groupResult["End"] = section.bounds[1]
+			groupResult["Filetype"] = section.filetype
+			yield groupResult
+
+	def run(self, outputFilename, progressCallback=None):
+		"""Classify the corpus, streaming results to outputFilename.
+
+			progressCallback, if given, is called with the number of sections
+			classified so far after each batch.  An exception it raises stops
+			the run.
+			"""
+		count = 0
+		fingerprint = None
+		if self.cacheFilename is not None:
+			fingerprint = modelFingerprint(TrainingCorpus(
+					filename=self.trainingCorpusFile))
+			# Create the cache, and drop stale entries, before the workers start
+			ResultCache(self.cacheFilename, self.classifierSpec,
+					fingerprint).close()
+		with multiprocessing.Pool(self.workers, initializer=_initWorker,
+				initargs=(self.classifierSpec, self.trainingCorpusFile,
+				self.cacheFilename, fingerprint,
+				Instrumentation.enabled())) as pool:
+			with open(outputFilename, "w") as outputFile:
+				# Groups are added as they are batched, and dropped once written
+				groupBySequence = dict()
+				deduper = _SectionDeduper() if self.dedupe else None
+				for results, workerStages in pool.imap_unordered(_classifyBatch,
+						self._batches(self._sectionGroups(deduper),
+						groupBySequence)):
+					Instrumentation.merge(workerStages)
+					for sequence, result in results:
+						digest, group = groupBySequence.pop(sequence)
+						if deduper is not None:
+							group = deduper.finish(digest, result)
+						count += self._writeResults(outputFile, result, group)
+					if deduper is not None:
+						for result, group in deduper.takeReady():
+							count += self._writeResults(outputFile, result, group)
+					outputFile.flush()
+					if progressCallback is not None:
+						progressCallback(count)
+				# Sections hashed after the last of their bytes were classified
+				if deduper is not None:
+					for result, group in deduper.takeReady():
+						count += self._writeResults(outputFile, result, group)
+		return count
+
+	def _writeResults(self, outputFile, result, group):
+		"""Write a group's results, returning how many were written."""
+		written = 0
+		for groupResult in self._groupResults(result, group):
+			outputFile.write(json.dumps(groupResult) + "\n")
+			written += 1
+		return written
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(
+			description="Classify each section of a test corpus.")
+	parser.add_argument("testCorpus", help="the test corpus config file")
+	parser.add_argument("trainingCorpus", help="the training corpus config file")
+	parser.add_argument("output", help="file to write the JSON line results to")
+	parser.add_argument("-c", "--classifier", default=DEFAULT_CLASSIFIER,
+			help="the classifier to use, as Module.Class (default: %(default)s)")
+	parser.add_argument("-j", "--workers", type=int, default=os.cpu_count(),
+			help="number of worker processes (default: one per CPU)")
+	parser.add_argument("-b", "--batch-size", type=int, default=16,
+			help="sections classified per batch (default: %(default)s)")
+	parser.add_argument("--cache", help="a result cache file to use")
+	parser.add_argument("--dedupe", action="store_true",
+			help="classify sections with identical bytes only once")
+	Instrumentation.addArguments(parser)
+	args = parser.parse_args(argv)
+
+	with Instrumentation.session(args):
+		tester = Tester(args.testCorpus, args.trainingCorpus,
+				args.classifier, workers=args.workers, batchSize=args.batch_size,
+				cacheFilename=args.cache, dedupe=args.dedupe)
+		with Instrumentation.stage("Test"):
+			count = tester.run(args.output)
+		print("Classified", count, "sections")
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,265 @@
+#!/usr/bin/env python3
+
+import argparse
+import hashlib
+import multiprocessing
+import os
+
+import Instrumentation
+from Corpus import TrainingCorpus
+from Model import FileTypeModel, TrainingRecord
+from NGram import NGramCounter, NGramVector, checkHashBits
+
+# Training files are read this many bytes at a time
+DEFAULT_CHUNK_SIZE = 16 * 1024 * 1024
+
+def countFile(filename, n, chunkSize=DEFAULT_CHUNK_SIZE, counter=None,
+		hasher=None, hashBits=None):
+	"""Count the n-grams in a file, reading it chunkSize bytes at a time.
+
+		Supply counter to add the file's counts to an existing NGramCounter, and
+		hasher to feed the file's contents to a hashlib object as it is read.
+		Give hashBits to count the n-grams hashed into 2**hashBits buckets.
+		Returns the counter.
+		"""
+	if counter is None:
+		counter = NGramCounter(n, hashBits)
+	buf = bytearray(chunkSize)
+	view = memoryview(buf)
+	with open(filename, "rb") as inputFile:
+		while True:
+			size = inputFile.readinto(buf)
+			if size == 0:
+				break
+			counter.update(view[:size])
+			if hasher is not None:
+				hasher.update(view[:size])
+	view.release()
+	return counter
+
+def recordFile(filename, n, chunkSize=DEFAULT_CHUNK_SIZE, hashBits=None):
+	"""Count and hash a training file, returning its TrainingRecord."""
+	fileStat = os.stat(filename)
+	hasher = hashlib.sha256()
+	counter = countFile(filename, n, chunkSize, hasher=hasher,
+			hashBits=hashBits)
+	return TrainingRecord(hasher.hexdigest(), fileStat.st_mtime_ns,
+			fileStat.st_size, counter.vector())
+
+def _recordJob(job):
+	"""Count one training file for a worker process."""
+	planIndex, filename, n, chunkSize, hashBits = job
+	return planIndex, filename, recordFile(filename, n, chunkSize, hashBits)
+
+def _recordWorkerJob(job):
+	"""Count one training file in a pool, also returning the instrumentation."""
+	return _recordJob(job) + (Instrumentation.drain(),)
+
+class _TrainingPlan:
+
+	"""
+		_TrainingPlan tracks the work needed to bring one filetype's model up to
+		date: the records that can be kept, and the files that must be counted.
+		"""
+
+	def __init__(self, filetype, existing):
+		self.filetype = filetype
+		self.existing = existing
+		self.oldRecords = dict() if existing is None else existing.files
+		self.records = dict() # records kept as they are, by filename
+		self.toCount = list() # filenames to count, in corpus order
+		self.counted = dict() # records of the counted files, by filename
+
+		toCount = set()
+		for trainingFile in filetype.files:
+			filename = trainingFile.filename
+			if filename in self.records or filename in toCount:
+				continue
+			oldRecord = self.oldRecords.get(filename)
+			if oldRecord is not None:
+				fileStat = os.stat(filename)
+				if (oldRecord.mtime == fileStat.st_mtime_ns and
+						oldRecord.size == fileStat.st_size):
+					self.records[filename] = oldRecord
+					continue
+			self.toCount.append(filename)
+			toCount.add(filename)
+
+	@property
+	def done(self):
+		return len(self.counted) == len(self.toCount)
+
+	def buildModel(self, n, hashBits=None):
+		"""Return the updated model, once every file has been counted."""
+		records = dict(self.records)
+		added = list()
+		removed = list()
+		for filename in self.toCount:
+			record = self.counted[filename]
+			oldRecord = self.oldRecords.get(filename)
+			if oldRecord is not None:
+				if oldRecord.contentHash == record.contentHash:
+					# Only touched, so the old counts still stand
+					record.vector = oldRecord.vector
+					records[filename] = record
+					continue
+				removed.append(oldRecord.vector)
+			records[filename] = record
+			added.append(record.vector)
+		for filename, oldRecord in self.oldRecords.items():
+			if filename not in records:
+				removed.append(oldRecord.vector)
+
+		# Keep the corpus's file order, so the model file is deterministic
+		records = dict((trainingFile.filename, records[trainingFile.filename])
+				for trainingFile in self.filetype.files)
+		if self.existing is None:
+			vector = NGramVector.treeMerge([NGramVector(n, hashBits=hashBits)] +
+					added)
+		else:
+			vector = NGramVector.treeMerge([self.existing.vector] + added)
+			if len(removed) > 0:
+				vector = vector - NGramVector.treeMerge(removed)
+		return FileTypeModel(self.filetype.name, vector, records)
+
+class Trainer:
+
+	"""
+		Trainer builds the n-gram model for each filetype in a training corpus.
+
+		Training files are streamed in fixed-size chunks, and each chunk's counts
+		are folded into the file's running counts as soon as it is read.  For n
+		up to NGram.DENSE_MAX_N, or with hashBits, the running counts are a
+		fixed dense array, so peak memory does not depend on the size of the
+		files; otherwise it grows with the number of distinct n-grams in a file.
+		With more than one worker, the files of
+		every filetype are counted across a pool of processes, and each model is
+		written as soon as all of its files are counted.  The models are the same
+		whatever the number of workers.
+
+		Unless a FileType has ignoreExisting set, its existing model is updated
+		rather than rebuilt: only files that are new or whose contents changed
+		are counted, and the counts of files no longer in the type are removed.
+
+		Public parameters:
+			trainingCorpus - the TrainingCorpus to train on
+			chunkSize - the number of bytes of a training file read at a time
+			workers - the number of worker processes, 1 to train in this process
+			hashBits - count n-grams hashed into 2**hashBits buckets, or None to
+				count them exactly
+
+		Public Functions:
+			Trainer.run(progressCallback) - train every filetype in the corpus
+			Trainer.trainFileType(filetype) - train one FileType, writing its
+				model to its filetypeFile, and return the model
+		"""
+
+	def __init__(self, trainingCorpus, chunkSize=DEFAULT_CHUNK_SIZE, workers=1,
+			hashBits=None):
+		checkHashBits(hashBits)
+		self.trainingCorpus = trainingCorpus
+		self.chunkSize = chunkSize
+		self.workers = workers
+		self.hashBits = hashBits
+
+	def run(self, progressCallback=None):
+		"""Train every filetype in the corpus.
+
+			progressCallback, if given, is called with the number of files
+			counted so far and the number to count, after each file.  An
+			exception it raises stops training.
+			"""
+		n = self.trainingCorpus.nValue
+		plans = list()
+		jobs = list()
+		for filetype in self.trainingCorpus.filetypeDefinitions:
+			plan = _TrainingPlan(filetype, self._loadExisting(filetype))
+			for filename in plan.toCount:
+				jobs.append((len(plans), filename, n, self.chunkSize,
+						self.hashBits))
+			plans.append(plan)
+			if plan.done:
+				self._writeModel(plan)
+
+		if self.workers == 1:
+			for counted, job in enumerate(jobs, 1):
+				self._recordCounted(plans, *_recordJob(job))
+				if progressCallback is not None:
+					progressCallback(counted, len(jobs))
+		else:
+			with multiprocessing.Pool(self.workers,
+					initializer=Instrumentation.initWorker,
+					initargs=(Instrumentation.enabled(),)) as pool:
+				for counted, result in enumerate(pool.imap_unordered(
+						_recordWorkerJob, jobs), 1):
+					Instrumentation.merge(result[3])
+					self._recordCounted(plans, *result[:3])
+					if progressCallback is not None:
+						progressCallback(counted, len(jobs))
+
+	def trainFileType(self, filetype):
+		"""Train one filetype and write its model out."""
+		plan = _TrainingPlan(filetype, self._loadExisting(filetype))
+		for filename in plan.toCount:
+			plan.counted[filename] = recordFile(filename,
+					self.trainingCorpus.nValue, self.chunkSize, self.hashBits)
+		return self._writeModel(plan)
+
+	def _recordCounted(self, plans, planIndex, filename, record):
+		"""Store a counted file, writing its model if it was the last one."""
+		plan = plans[planIndex]
+		plan.counted[filename] = record
+		if plan.done:
+			self._writeModel(plan)
+
+	def _writeModel(self, plan):
+		model = plan.buildModel(self.trainingCorpus.nValue, self.hashBits)
+		model.writeOut(plan.filetype.filetypeFile)
+		return model
+
+	def _loadExisting(self, filetype):
+		"""Return the model to update for filetype, or None to rebuild it.
+
+			A model is only updated if its per-file records account for all of
+			its counts.  Otherwise, as for a model in an older format, or one
+			without records, the changes can't be worked out from the records,
+			so the model is rebuilt, as it is if it was counted with a different
+			n or hashBits.
+			"""
+		if filetype.ignoreExisting or not os.path.exists(filetype.filetypeFile):
+			return None
+		try:
+			model = FileTypeModel.load(filetype.filetypeFile)
+		except ValueError:
+			return None
+		if (model.n, model.vector.hashBits) != (self.trainingCorpus.nValue,
+				self.hashBits):
+			return None
+		if sum(record.vector.total for record in model.files.values()) != \
+				model.vector.total:
+			return None
+		return model
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(
+			description="Train the filetype models of a training corpus.")
+	parser.add_argument("trainingCorpus", help="the training corpus config file")
+	parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE,
+			help="bytes of each training file to read at a time")
+	parser.add_argument("-j", "--workers", type=int, default=os.cpu_count(),
+			help="number of worker processes (default: one per CPU)")
+	parser.add_argument("--hash-bits", type=int, default=None,
+			help="count n-grams hashed into 2**HASH_BITS buckets, keeping " +
+			"memory fixed for large corpora (default: count them exactly)")
+	Instrumentation.addArguments(parser)
+	args = parser.parse_args(argv)
+
+	with Instrumentation.session(args):
+		trainer = Trainer(TrainingCorpus(filename=args.trainingCorpus),
+				chunkSize=args.chunk_size, workers=args.workers,
+				hashBits=args.hash_bits)
+		with Instrumentation.stage("Train"):
+			trainer.run()
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,125 @@
+import threading
+import time
+
+import pytest
+
+from BackgroundTasks import TaskCancelled, TaskRunner
+
+class FakeWidget:
+
+	"""Stands in for a Tk widget, running what's scheduled with after() when
+		asked to."""
+
+	def __init__(self):
+		self.scheduled = list()
+
+	def after(self, delay, callback):
+		self.scheduled.append(callback)
+
+	def runScheduled(self):
+		scheduled, self.scheduled = self.scheduled, list()
+		for callback in scheduled:
+			callback()
+
+def _pollUntilFinished(widget, runner):
+	"""Run the runner's polls until no task is pending."""
+	deadline = time.time() + 10
+	while len(runner.pending()) > 0:
+		assert time.time() < deadline
+		time.sleep(0.01)
+		widget.runScheduled()
+
+def testCallbacksSeeResultsAndLatestProgress():
+	widget = FakeWidget()
+	runner = TaskRunner(widget)
+	release = threading.Event()
+	progress = list()
+	results = list()
+
+	def job(task, value):
+		for done in range(5):
+			task.progress(done, 5, "working")
+		release.wait(10)
+		return value * 2
+
+	runner.submit(job, 21, onDone=results.append,
+			onProgress=lambda *report: progress.append(report))
+	while runner._messages.qsize() < 5:
+		time.sleep(0.01)
+	widget.runScheduled()
+	assert progress == [(4, 5, "working")]
+	release.set()
+	_pollUntilFinished(widget, runner)
+	assert results == [42]
+	assert widget.scheduled == [] and not runner._polling
+	runner.shutdown()
+
+def testErrorsAndCancellation(capsys):
+	widget = FakeWidget()
+	runner = TaskRunner(widget)
+	started = threading.Event()
+	errors = list()
+	cancelled = list()
+
+	def fail(task):
+		raise ValueError("bad input")
+
+	def waitForCancel(task):
+		started.set()
+		while True:
+			task.progress(0)
+			time.sleep(0.01)
+
+	failing = runner.submit(fail, onError=errors.append)
+	unhandled = runner.submit(fail, name="unhandled")
+	waiting = runner.submit(waitForCancel, onCancelled=lambda: cancelled.append(1))
+	never = runner.submit(lambda task: cancelled.append("ran"),
+			onCancelled=lambda: cancelled.append(2))
+	started.wait(10)
+	never.cancel()
+	waiting.cancel()
+	_pollUntilFinished(widget, runner)
+	assert [str(error) for error in errors] == ["bad input"]
+	assert "Task unhandled failed" in capsys.readouterr().err
+	assert sorted(cancelled) == [1, 2]
+	assert all(task.finished for task in (failing, unhandled, waiting, never))
+	assert waiting.cancelled() and not failing.cancelled()
+	runner.shutdown()
+
+def testFailingCallbacksDontStopPolling(capsys):
+	widget = FakeWidget()
+	runner = TaskRunner(widget)
+	release = threading.Event()
+	results = list()
+
+	def broken(*args):
+		raise RuntimeError("callback bug")
+
+	def job(task):
+		task.progress(1, 2)
+		release.wait(10)
+		return "late"
+
+	runner.submit(lambda task: "early", onDone=broken)
+	runner.submit(lambda task: "also", onDone=results.append)
+	late = runner.submit(job, onDone=results.append, onProgress=broken)
+	while runner._messages.qsize() < 3:
+		time.sleep(0.01)
+	widget.runScheduled()
+	assert "callback bug" in capsys.readouterr().err
+	assert results == ["also"]
+	# The unfinished task is still polled for
+	assert runner._polling and len(widget.scheduled) == 1
+	release.set()
+	_pollUntilFinished(widget, runner)
+	assert results == ["also", "late"]
+	assert not runner._polling
+	runner.shutdown()
+
+def testTaskCancelledNamesTheTask():
+	runner = TaskRunner(FakeWidget())
+	task = runner.submit(lambda task: None, name="hashing")
+	task.cancel()
+	with pytest.raises(TaskCancelled, match="hashing"):
+		task.checkCancelled()
+	runner.shutdown()
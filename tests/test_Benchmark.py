@@ -0,0 +1,36 @@
+import Corpus
+from Benchmark import _classifierThroughput
+
+class _CachingClassifier:
+
+	"""Labels everything "text", remembering what it has labelled."""
+
+	def __init__(self):
+		self.seen = set()
+		self.labelled = 0
+
+	def classify(self, data):
+		if bytes(data) not in self.seen:
+			self.seen.add(bytes(data))
+			self.labelled += 1
+		return "text"
+
+def testEachRepeatClassifiesWithAFreshClassifier(tmp_path):
+	filename = str(tmp_path / "fw.bin")
+	with open(filename, "wb") as image:
+		image.write(b"abcd" * 64)
+	testCorpus = Corpus.TestCorpus("test", "")
+	testCorpus.appendFirmware({"Name": "fw", "Filename": filename,
+			"Sections": [{"Start": i * 16, "End": (i + 1) * 16, "Filetype": "text"}
+			for i in range(16)]})
+	classifiers = list()
+
+	def makeClassifier():
+		classifiers.append(_CachingClassifier())
+		return classifiers[-1]
+
+	result = _classifierThroughput(makeClassifier, testCorpus, repeat=3)
+	assert len(classifiers) == 3
+	assert [classifier.labelled for classifier in classifiers] == [1, 1, 1]
+	assert result["Accuracy"] == 1.0
+	assert result["Setup Seconds"] >= 0
@@ -0,0 +1,108 @@
+import os
+
+import pytest
+
+import Corpus
+from Corpus import TrainingCorpus, EDIT_LOG_SUFFIX
+
+def _testCorpus(count=5):
+	corpus = Corpus.TestCorpus("corpus", "a test corpus")
+	for i in range(count):
+		corpus.appendFirmware({"Name": "fw%d" % i, "Filename": "/fw/%d" % i,
+				"Sections": [{"Start": 0, "End": 10, "Filetype": "text"},
+				{"Start": 10, "End": 30 + i, "Filetype": "random"}]})
+	return corpus
+
+def _firmwareDicts(corpus):
+	return [firmware._toDict() for firmware in corpus.firmwareDefinitions]
+
+@pytest.fixture(params=[".json", ".jsonl"])
+def configFilename(request, tmp_path):
+	return str(tmp_path / ("corpus" + request.param))
+
+def testEditLogSavesOnlyChanges(configFilename):
+	corpus = _testCorpus()
+	corpus.save(configFilename)
+	assert not os.path.exists(configFilename + EDIT_LOG_SUFFIX)
+
+	corpus.firmwareDefinitions[1].name = "renamed"
+	corpus.firmwareDefinitions[2].sections[0].filetype = "code"
+	del corpus.firmwareDefinitions[3]
+	corpus.appendFirmware({"Name": "new", "Filename": "/fw/new"})
+	corpus.description = "changed"
+	corpus.save(configFilename)
+	with open(configFilename + EDIT_LOG_SUFFIX) as editLog:
+		assert len(editLog.readlines()) == 5
+
+	loaded = Corpus.TestCorpus(filename=configFilename)
+	assert loaded.description == "changed"
+	assert _firmwareDicts(loaded) == _firmwareDicts(corpus)
+	assert not any(firmware.isDirty() for firmware in loaded.firmwareDefinitions)
+
+def testUnchangedSaveWritesNothing(configFilename):
+	corpus = _testCorpus()
+	corpus.save(configFilename)
+	corpus.save(configFilename)
+	assert not os.path.exists(configFilename + EDIT_LOG_SUFFIX)
+
+def testEditLogIsCompacted(configFilename, monkeypatch):
+	monkeypatch.setattr(Corpus, "COMPACT_MINIMUM", 2)
+	corpus = _testCorpus()
+	corpus.save(configFilename)
+	for firmware in corpus.firmwareDefinitions[:3]:
+		firmware.name += "!"
+	corpus.save(configFilename)
+	assert not os.path.exists(configFilename + EDIT_LOG_SUFFIX)
+	assert _firmwareDicts(Corpus.TestCorpus(filename=configFilename)) == \
+			_firmwareDicts(corpus)
+
+def testEditsDuringABackgroundSaveAreKept(configFilename):
+	corpus = _testCorpus()
+	corpus.save(configFilename)
+	corpus.firmwareDefinitions[0].name = "first"
+	save = corpus.prepareSave(configFilename)
+	# Edited after the save was prepared, before it was written
+	corpus.firmwareDefinitions[0].name = "second"
+	corpus.firmwareDefinitions[1].name = "other"
+	save()
+	assert Corpus.TestCorpus(filename=configFilename).firmwareDefinitions[0].name == \
+			"first"
+	corpus.save(configFilename)
+	assert _firmwareDicts(Corpus.TestCorpus(filename=configFilename)) == \
+			_firmwareDicts(corpus)
+
+def testFullSaveWritesASnapshot(configFilename):
+	corpus = _testCorpus()
+	expected = _firmwareDicts(corpus)
+	save = corpus.prepareSave(configFilename)
+	corpus.firmwareDefinitions[0].sections[0].filetype = "code"
+	corpus.firmwareDefinitions = list()
+	save()
+	assert _firmwareDicts(Corpus.TestCorpus(filename=configFilename)) == expected
+	corpus.save(configFilename)
+	assert _firmwareDicts(Corpus.TestCorpus(filename=configFilename)) == []
+
+def testFailedSaveIsRetriedInFull(tmp_path):
+	filename = str(tmp_path / "missing" / "corpus.json")
+	corpus = _testCorpus()
+	with pytest.raises(OSError):
+		corpus.save(filename)
+	os.mkdir(str(tmp_path / "missing"))
+	corpus.save(filename)
+	assert _firmwareDicts(Corpus.TestCorpus(filename=filename)) == \
+			_firmwareDicts(corpus)
+
+def testTrainingCorpusEditLog(tmp_path):
+	filename = str(tmp_path / "training.json")
+	corpus = TrainingCorpus("training", "", 3)
+	corpus.appendFileType({"Name": "text", "Filetype File": "text.model",
+			"Files": ["a", "b"]})
+	corpus.appendFileType({"Name": "code", "Filetype File": "code.model"})
+	corpus.save(filename)
+	corpus.filetypeDefinitions[1].appendTrainingFile("c")
+	corpus.save(filename)
+	assert os.path.exists(filename + EDIT_LOG_SUFFIX)
+	loaded = TrainingCorpus(filename=filename)
+	assert loaded.nValue == 3
+	assert [filetype._toDict() for filetype in loaded.filetypeDefinitions] == \
+			[filetype._toDict() for filetype in corpus.filetypeDefinitions]
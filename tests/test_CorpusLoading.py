@@ -0,0 +1,120 @@
+import io
+import json
+
+import pytest
+
+import Corpus
+from Corpus import TrainingCorpus
+
+def _testCorpusDict(count=20):
+	return {"Name": "corpus ☃", "Description": "a \"test\" corpus",
+			"Firmware Definitions": [{"Name": "fw%d" % i,
+			"Filename": "/fw/%d" % i, "Sections": [{"Start": j * 100,
+			"End": (j + 1) * 100, "Filetype": "type%d" % (j % 3)}
+			for j in range(i)]} for i in range(count)]}
+
+def _firmwareDicts(firmwares):
+	return [firmware._toDict() for firmware in firmwares]
+
+@pytest.mark.parametrize("indent", [None, 4, "\t"])
+def testJSONConfigLoadsAsJSONLoad(tmp_path, indent):
+	filename = str(tmp_path / "corpus.json")
+	configDict = _testCorpusDict()
+	with open(filename, "w") as configFile:
+		json.dump(configDict, configFile, indent=indent)
+	corpus = Corpus.TestCorpus(filename=filename)
+	assert corpus.name == configDict["Name"]
+	assert corpus.description == configDict["Description"]
+	assert _firmwareDicts(corpus.firmwareDefinitions) == \
+			configDict["Firmware Definitions"]
+	assert _firmwareDicts(Corpus.TestCorpus.iterFirmware(filename)) == \
+			configDict["Firmware Definitions"]
+
+def testLineDelimitedConfig(tmp_path):
+	filename = str(tmp_path / "corpus.jsonl")
+	configDict = _testCorpusDict()
+	with open(filename, "w") as configFile:
+		configFile.write(json.dumps({"Name": configDict["Name"],
+				"Description": configDict["Description"]}) + "\n\n")
+		for definition in configDict["Firmware Definitions"]:
+			configFile.write(json.dumps(definition) + "\n")
+	assert Corpus.TestCorpus(filename=filename)._toDict() == configDict
+
+def testStreamDecodesValuesAcrossChunks():
+	text = ' { "a" : [1, 2, {"b": "c\\"d"}], "long": "%s", "n": 12345 } ' % (
+			"x" * 100)
+	stream = Corpus._JSONStream(io.StringIO(text), chunkSize=3)
+	stream.expect("{")
+	values = list()
+	while True:
+		key = stream.value()
+		stream.expect(":")
+		values.append((key, stream.value()))
+		if stream.expect(",}") == "}":
+			break
+	assert dict(values) == json.loads(text)
+	assert stream.peek() == ""
+
+def testTrainingDefinitionsKeyedByName(tmp_path):
+	filename = str(tmp_path / "training.json")
+	with open(filename, "w") as configFile:
+		json.dump({"Name": "training", "n Value": 3, "Filetype Definitions": {
+				"text": {"Name": "text", "Filetype File": "/m/text",
+				"Files": ["/t/a", "/t/b"]},
+				"code": {"Name": "code", "Filetype File": "/m/code", "Files": []}}},
+				configFile, indent=2)
+	corpus = TrainingCorpus(filename=filename)
+	assert corpus.nValue == 3
+	assert [filetype.name for filetype in corpus.filetypeDefinitions] == [
+			"text", "code"]
+	assert [trainingFile.filename
+			for trainingFile in corpus.filetypeDefinitions[0].files] == [
+			"/t/a", "/t/b"]
+	assert [filetype.name for filetype in
+			TrainingCorpus.iterFileTypes(filename)] == ["text", "code"]
+
+@pytest.mark.parametrize("text", ['{}', '{"Firmware Definitions": []}',
+		'{"Firmware Definitions": {}, "Name": "empty"}'])
+def testEmptyConfigs(tmp_path, text):
+	filename = str(tmp_path / "corpus.json")
+	with open(filename, "w") as configFile:
+		configFile.write(text)
+	assert Corpus.TestCorpus(filename=filename).firmwareDefinitions == []
+
+@pytest.mark.parametrize("text", ['', '[]', '{"Name": "a" "Description": ""}',
+		'{"Firmware Definitions": [{"Name": "fw"} {"Name": "fw2"}]}',
+		'{"Name": "truncated'])
+def testMalformedConfigsRaise(tmp_path, text):
+	filename = str(tmp_path / "corpus.json")
+	with open(filename, "w") as configFile:
+		configFile.write(text)
+	with pytest.raises(ValueError):
+		Corpus.TestCorpus(filename=filename)
+
+def testIterFirmwareReadsAsItGoes(tmp_path):
+	filename = str(tmp_path / "corpus.json")
+	text = json.dumps(_testCorpusDict())
+	with open(filename, "w") as configFile:
+		# Cut off part way, so only a full load would fail at the start
+		configFile.write(text[:len(text) // 2])
+	firmware = Corpus.TestCorpus.iterFirmware(filename)
+	assert next(firmware).name == "fw0"
+	assert next(firmware).name == "fw1"
+	with pytest.raises(ValueError):
+		list(firmware)
+
+def testEditLogIsReadOncePerLoad(tmp_path, monkeypatch):
+	filename = str(tmp_path / "corpus.json")
+	corpus = Corpus.TestCorpus("corpus", "")
+	corpus.appendFirmware({"Name": "fw", "Filename": "/fw/0"})
+	corpus.writeOut(filename)
+	corpus.firmwareDefinitions[0].name = "renamed"
+	corpus.save(filename)
+	reads = list()
+	readEditLog = Corpus._readEditLog
+	monkeypatch.setattr(Corpus, "_readEditLog",
+			lambda filename: reads.append(filename) or readEditLog(filename))
+	loaded = Corpus.TestCorpus(filename=filename)
+	assert loaded.firmwareDefinitions[0].name == "renamed"
+	assert loaded._editLogRecords == 1
+	assert len(reads) == 1
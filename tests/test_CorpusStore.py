@@ -0,0 +1,106 @@
+import os
+import sqlite3
+
+import pytest
+
+import Corpus
+import CorpusStore
+from Corpus import TrainingCorpus
+
+def _testCorpus():
+	corpus = Corpus.TestCorpus("corpus", "a test corpus")
+	for i in range(4):
+		corpus.appendFirmware({"Name": "fw%d" % i, "Filename": "/fw/%d" % i,
+				"Sections": [{"Start": 0, "End": 10, "Filetype": "text"},
+				{"Start": 10, "End": 30 + i, "Filetype": "random"}]})
+	return corpus
+
+def _firmwareDicts(corpus):
+	return [firmware._toDict() for firmware in corpus.firmwareDefinitions]
+
+def testTestCorpusRoundTrip(tmp_path):
+	filename = str(tmp_path / "corpus.db")
+	corpus = _testCorpus()
+	corpus.writeOut(filename)
+	loaded = Corpus.TestCorpus(filename=filename)
+	assert (loaded.name, loaded.description) == ("corpus", "a test corpus")
+	assert _firmwareDicts(loaded) == _firmwareDicts(corpus)
+	with CorpusStore.storeFor(filename, readOnly=True) as store:
+		assert store.kind() == "Firmware Definitions"
+		assert store.sectionsOfType("random", 22) == [("/fw/2", 10, 32),
+				("/fw/3", 10, 33)]
+		assert store.sectionsIn("/fw/1", 5, 15) == [(0, 10, "text"),
+				(10, 31, "random")]
+		assert store.firmware("/fw/0") == corpus.firmwareDefinitions[0]._toDict()
+		assert store.firmware("/fw/missing") is None
+
+def testSaveAppliesEditsToTheStore(tmp_path):
+	filename = str(tmp_path / "corpus.sqlite")
+	corpus = _testCorpus()
+	corpus.save(filename)
+	corpus.firmwareDefinitions[1].name = "renamed"
+	corpus.firmwareDefinitions[2].appendFirmwareSection({"Start": 40,
+			"End": 50, "Filetype": "new"})
+	corpus.appendFirmware({"Name": "added", "Filename": "/fw/added"})
+	corpus.description = "changed"
+	corpus.save(filename)
+	assert not os.path.exists(filename + Corpus.EDIT_LOG_SUFFIX)
+	loaded = Corpus.TestCorpus(filename=filename)
+	assert loaded.description == "changed"
+	assert _firmwareDicts(loaded) == _firmwareDicts(corpus)
+
+def testEmptyTrainingCorpusKeepsItsKind(tmp_path):
+	filename = str(tmp_path / "training.db")
+	TrainingCorpus("training", "", 3).writeOut(filename)
+	with CorpusStore.storeFor(filename, readOnly=True) as store:
+		assert store.kind() == "Filetype Definitions"
+	configFilename = str(tmp_path / "training.json")
+	CorpusStore.exportConfig(filename, configFilename)
+	assert TrainingCorpus(filename=configFilename).nValue == 3
+
+def testTrainingCorpusRoundTrip(tmp_path):
+	filename = str(tmp_path / "training.db")
+	corpus = TrainingCorpus("training", "", 2)
+	corpus.appendFileType({"Name": "text", "Filetype File": "/m/text",
+			"Files": ["/t/a", "/t/b"]})
+	corpus.appendFileType({"Name": "code", "Filetype File": "/m/code",
+			"Files": ["/t/b"], "Ignore Existing": True})
+	corpus.writeOut(filename)
+	loaded = TrainingCorpus(filename=filename)
+	assert loaded._toDict() == corpus._toDict()
+	with CorpusStore.storeFor(filename, readOnly=True) as store:
+		assert sorted(store.filetypesOf("/t/b")) == ["code", "text"]
+
+def testReadingAMissingDatabaseCreatesNothing(tmp_path):
+	filename = str(tmp_path / "mistyped.db")
+	with pytest.raises(FileNotFoundError):
+		Corpus.TestCorpus(filename=filename)
+	with pytest.raises(FileNotFoundError):
+		list(Corpus.TestCorpus.iterFirmware(filename))
+	assert not os.path.exists(filename)
+
+def testLoadingLeavesTheDatabaseUnchanged(tmp_path):
+	filename = str(tmp_path / "corpus.db")
+	_testCorpus().writeOut(filename)
+	with open(filename, "rb") as databaseFile:
+		before = databaseFile.read()
+	Corpus.TestCorpus(filename=filename)
+	with open(filename, "rb") as databaseFile:
+		assert databaseFile.read() == before
+
+def testPartlyReadStoreIsClosed(tmp_path, monkeypatch):
+	filename = str(tmp_path / "corpus.db")
+	_testCorpus().writeOut(filename)
+	stores = list()
+	storeFor = CorpusStore.storeFor
+
+	def recordingStoreFor(*args, **kwargs):
+		stores.append(storeFor(*args, **kwargs))
+		return stores[-1]
+
+	monkeypatch.setattr(CorpusStore, "storeFor", recordingStoreFor)
+	firmware = Corpus.TestCorpus.iterFirmware(filename)
+	assert next(firmware).name == "fw0"
+	firmware.close()
+	with pytest.raises(sqlite3.ProgrammingError):
+		stores[0].connection.execute("SELECT 1")
@@ -0,0 +1,57 @@
+import json
+import math
+
+import pytest
+
+import Corpus
+
+_VALUES = [
+	{"Name": "fw", "Filename": "/fw/1", "Sections": [{"Start": 0, "End": 10,
+			"Filetype": "text"}]},
+	{"Description": "café ☃ \U0001f600", "Quote": "\"\\\n\t"},
+	{"Big": 2 ** 70, "Negative": -2 ** 63, "Float": 0.1, "Bool": True,
+			"None": None, "Empty": [], "Nested": {"a": [1, [2, {"b": 3}]]}},
+	{"NaN": float("nan"), "Infinity": float("inf"),
+			"Negative Infinity": float("-inf")},
+	{"Not null": "nullable"},
+	[1.5, float("nan")],
+	"\x00\x1f",
+]
+
+@pytest.fixture(params=["orjson", "json"])
+def encoder(request, monkeypatch):
+	if request.param == "orjson":
+		if Corpus.orjson is None:
+			pytest.skip("orjson isn't installed")
+	else:
+		monkeypatch.setattr(Corpus, "orjson", None)
+	return request.param
+
+def _same(a, b):
+	"""Compare decoded JSON, with NaN equal to itself."""
+	if isinstance(a, float) and isinstance(b, float):
+		return a == b or (math.isnan(a) and math.isnan(b))
+	if isinstance(a, dict) and isinstance(b, dict):
+		return list(a) == list(b) and all(_same(a[key], b[key]) for key in a)
+	if isinstance(a, list) and isinstance(b, list):
+		return len(a) == len(b) and all(map(_same, a, b))
+	return type(a) == type(b) and a == b
+
+@pytest.mark.parametrize("value", _VALUES)
+def testEncodingMatchesJSONDump(encoder, value):
+	encoded = Corpus._encode(value)
+	assert encoded.isascii()
+	assert _same(json.loads(encoded), json.loads(json.dumps(value)))
+
+def testCorpusWritesMatchJSONDump(encoder, tmp_path):
+	corpus = Corpus.TestCorpus("corpus ☃", float("nan"))
+	for i in range(3):
+		corpus.appendFirmware({"Name": "fw%d é" % i, "Filename": "/fw/%d" % i,
+				"Sections": [{"Start": 0, "End": 10 + i, "Filetype": "text"}]})
+	baseline = json.loads(json.dumps(corpus._toDict()))
+	for extension in (".json", ".jsonl"):
+		filename = str(tmp_path / ("corpus" + extension))
+		corpus.writeOut(filename)
+		loaded = Corpus.TestCorpus(filename=filename)
+		assert _same(json.loads(json.dumps(loaded._toDict())), baseline)
+		assert math.isnan(loaded.description)
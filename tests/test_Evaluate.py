@@ -0,0 +1,150 @@
+import json
+import os
+import random
+
+import numpy
+import pytest
+
+import Corpus
+from Evaluate import NO_PREDICTION, Evaluation, evaluate, loadPredictions
+
+def _naiveConfusion(trueSections, predictedSections):
+	"""Label every byte, returning counts by (true, predicted) and the true
+		sections whose bytes were mostly predicted right."""
+	predictedAt = dict()
+	for start, end, filetype in predictedSections:
+		for offset in range(start, end):
+			predictedAt[offset] = filetype
+	confusion = dict()
+	correct = 0
+	for start, end, filetype in trueSections:
+		votes = dict()
+		for offset in range(start, end):
+			label = predictedAt.get(offset, NO_PREDICTION)
+			confusion[filetype, label] = confusion.get((filetype, label), 0) + 1
+			votes[label] = votes.get(label, 0) + 1
+		if len(votes) > 0 and votes.get(filetype, 0) == max(votes.values()):
+			correct += 1
+	return confusion, correct
+
+def _randomSections(rng, size, types, gaps):
+	sections = list()
+	offset = 0
+	while offset < size:
+		if gaps and rng.random() < 0.2:
+			offset += rng.randrange(1, 30)
+		end = min(size, offset + rng.randrange(1, 80))
+		sections.append((offset, end, rng.choice(types)))
+		offset = end
+	return sections
+
+def _columns(sections):
+	return (numpy.array([start for start, _, _ in sections], dtype=numpy.int64),
+			numpy.array([end for _, end, _ in sections], dtype=numpy.int64),
+			[filetype for _, _, filetype in sections])
+
+def _firmware(sections):
+	return Corpus.Firmware({"Name": "fw", "Filename": "/fw", "Sections": [
+			{"Start": start, "End": end, "Filetype": filetype}
+			for start, end, filetype in sections]})
+
+@pytest.mark.parametrize("seed", range(5))
+def testMatchesByteByByteScoring(seed):
+	rng = random.Random(seed)
+	trueSections = _randomSections(rng, 1000, ["a", "b", "c"], True)
+	# Predictions shuffled, as Tester output arrives
+	predicted = _randomSections(rng, 1100, ["a", "b", "d"], True)
+	rng.shuffle(predicted)
+	evaluation = Evaluation()
+	evaluation.addFirmware(_firmware(trueSections), _columns(predicted))
+	confusion, correct = _naiveConfusion(trueSections, predicted)
+	names = evaluation.names
+	assert dict(((names[i], names[j]), int(count))
+			for (i, j), count in numpy.ndenumerate(evaluation.confusion)
+			if count > 0) == confusion
+	assert evaluation.sectionsCorrect == correct
+	assert evaluation.sectionsTotal == len(trueSections)
+
+def testFigures():
+	evaluation = Evaluation()
+	trueSections = [(0, 10, "a"), (10, 20, "b"), (20, 20, "empty")]
+	predicted = [(0, 15, "a")]
+	evaluation.addFirmware(_firmware(trueSections), _columns(predicted))
+	assert evaluation.sectionsTotal == 2
+	assert evaluation.sectionsCorrect == 1
+	assert evaluation.byteAccuracy() == 0.5
+	report = evaluation.report()
+	assert report["Bytes"] == 20
+	assert report["Per Filetype"]["a"] == {"Bytes": 10,
+			"Precision": 10 / 15, "Recall": 1.0, "F1": 0.8}
+	assert report["Per Filetype"]["b"]["Recall"] == 0.0
+	assert report["Unpredicted Bytes"] == 5
+	assert NO_PREDICTION not in report["Per Filetype"]
+
+def testLoadsTesterOutputAndConfigs(tmp_path):
+	truth = Corpus.TestCorpus("truth", "")
+	truth.appendFirmware({"Name": "fw", "Filename": str(tmp_path / "fw.bin"),
+			"Sections": [{"Start": 0, "End": 10, "Filetype": "a"},
+			{"Start": 10, "End": 30, "Filetype": "b"}]})
+	truth.appendFirmware({"Name": "missing",
+			"Filename": str(tmp_path / "missing.bin"),
+			"Sections": [{"Start": 0, "End": 5, "Filetype": "a"}]})
+	testerOutput = str(tmp_path / "results.jsonl")
+	with open(testerOutput, "w") as outputFile:
+		for start, end, classification in ((10, 30, "a"), (0, 10, "a")):
+			outputFile.write(json.dumps({"Firmware": "fw",
+					"Filename": os.path.join(str(tmp_path), ".", "fw.bin"),
+					"Start": start, "End": end, "Filetype": "",
+					"Classification": classification}) + "\n")
+	proposed = Corpus.TestCorpus("proposed", "")
+	proposed.appendFirmware({"Name": "fw", "Filename": str(tmp_path / "fw.bin"),
+			"Sections": [{"Start": 0, "End": 10, "Filetype": "a"},
+			{"Start": 10, "End": 30, "Filetype": "a"}]})
+	proposedFile = str(tmp_path / "proposed.json")
+	proposed.writeOut(proposedFile)
+
+	reports = list()
+	for filename in (testerOutput, proposedFile):
+		evaluation = evaluate(truth, loadPredictions(filename))
+		reports.append(evaluation.report())
+		jsonFile = str(tmp_path / "report.json")
+		evaluation.writeJSON(jsonFile)
+		with open(jsonFile) as reportFile:
+			assert json.load(reportFile) == reports[-1]
+		csvFile = str(tmp_path / "report.csv")
+		evaluation.writeCSV(csvFile)
+		with open(csvFile) as reportFile:
+			lines = reportFile.read().splitlines()
+		assert lines[0].endswith(",Unpredicted")
+		assert len(lines) == len(evaluation.names)
+	assert reports[0] == reports[1]
+	# The firmware with no predictions counts as unpredicted
+	assert reports[0]["Bytes"] == 35
+	assert reports[0]["Byte Accuracy"] == 10 / 35
+	assert reports[0]["Section Accuracy"] == 1 / 3
+
+def testTheDefaultFiletypeIsntTakenForNoPrediction():
+	evaluation = Evaluation()
+	trueSections = [(0, 10, ""), (10, 20, ""), (20, 30, "a")]
+	predicted = [(10, 20, ""), (20, 27, "a")]
+	evaluation.addFirmware(_firmware(trueSections), _columns(predicted))
+	assert evaluation.sectionsCorrect == 2
+	assert evaluation.byteAccuracy() == 17 / 30
+	assert evaluation.unpredictedBytes == 13
+	report = evaluation.report()
+	assert report["Per Filetype"][""] == {"Bytes": 20, "Precision": 1.0,
+			"Recall": 0.5, "F1": 2 / 3}
+	assert json.loads(json.dumps(report)) == report
+
+def testOverlappingSectionsAreRejected():
+	evaluation = Evaluation()
+	with pytest.raises(ValueError, match="sections of firmware fw overlap"):
+		evaluation.addFirmware(_firmware([(0, 10, "a"), (5, 20, "b")]),
+				_columns([(0, 20, "a")]))
+	with pytest.raises(ValueError, match="predicted sections of firmware fw"):
+		evaluation.addFirmware(_firmware([(0, 10, "a"), (10, 20, "b")]),
+				_columns([(0, 12, "a"), (8, 20, "b")]))
+	# Empty sections within others don't overlap them
+	evaluation.addFirmware(_firmware([(0, 10, "a"), (5, 5, "b"), (10, 20, "b")]),
+			_columns([(0, 10, "a"), (3, 3, "b"), (10, 20, "b")]))
+	assert evaluation.byteAccuracy() == 1.0
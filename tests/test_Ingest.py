@@ -0,0 +1,79 @@
+import random
+
+import Corpus
+import Ingest
+from Corpus import Firmware
+from Ingest import CorpusIngest, chunkBoundaries
+
+def testRemovedFirmwareCanBeAddedAgain(tmp_path):
+	filename = str(tmp_path / "image.bin")
+	with open(filename, "wb") as imageFile:
+		imageFile.write(b"firmware" * 100)
+	ingest = CorpusIngest()
+	first = Firmware({"Name": "first", "Filename": filename})
+	second = Firmware({"Name": "second", "Filename": filename})
+	assert ingest.addFirmware(first) is None
+	assert ingest.addFirmware(second) is first
+	ingest.removeFirmware(first)
+	assert ingest.addFirmware(second) is None
+
+def _gearHash(data, end):
+	"""Return the rolling hash of the window ending before end, the slow way."""
+	value = 0
+	for age in range(Ingest._ROLLING_WINDOW):
+		value += int(Ingest._GEAR[data[end - 1 - age]]) << age
+	return value & 0xffffffff
+
+def testBoundariesAreWhereTheHashIsZero():
+	data = random.Random(0).randbytes(20000)
+	boundaries = chunkBoundaries(data, 8)
+	assert boundaries[0] == 0 and boundaries[-1] == len(data)
+	for previous, boundary in zip(boundaries[:-2], boundaries[1:-1]):
+		assert 1 << 6 <= boundary - previous <= 1 << 10
+		if boundary - previous < 1 << 10:
+			assert _gearHash(data, boundary) & 0xff == 0
+
+def testBoundariesDontDependOnTheScanBlocks(monkeypatch):
+	data = random.Random(0).randbytes(300000)
+	boundaries = chunkBoundaries(data, 10)
+	monkeypatch.setattr(Ingest, "_SCAN_BYTES", 1000)
+	assert chunkBoundaries(data, 10) == boundaries
+	assert chunkBoundaries(data[:20], 10) == [0, 20]
+	assert chunkBoundaries(b"", 10) == [0]
+
+def testBoundariesSurviveAnInsertion():
+	data = random.Random(0).randbytes(200000)
+	boundaries = chunkBoundaries(data, 10)
+	inserted = chunkBoundaries(data[:5000] + b"inserted" + data[5000:], 10)
+	# Past a chunk or two after the insertion, every cut is in the same place
+	later = [boundary for boundary in boundaries if boundary > 5000 + 2 * 4096]
+	assert len(later) > 100
+	assert set(boundary + 8 for boundary in later) <= set(inserted)
+	assert [boundary for boundary in boundaries if boundary < 5000] == \
+			[boundary for boundary in inserted if boundary < 5000]
+
+def testSharedChunksFindsDuplicateContent(tmp_path):
+	rng = random.Random(0)
+	shared = rng.randbytes(100000)
+	images = {"first": rng.randbytes(30000) + shared,
+			"second": rng.randbytes(7000) + shared + rng.randbytes(20000),
+			"copy": None, "unrelated": rng.randbytes(100000)}
+	images["copy"] = images["first"]
+	corpus = Corpus.TestCorpus("ingest", "")
+	for name, image in images.items():
+		filename = str(tmp_path / name)
+		with open(filename, "wb") as imageFile:
+			imageFile.write(image)
+		corpus.appendFirmware({"Name": name, "Filename": filename})
+	chunks = CorpusIngest(chunkBits=10).sharedChunks(corpus)
+	assert len(chunks) > 10
+	sharedBytes = 0
+	for places in chunks.values():
+		# The copy of first isn't scanned again
+		assert [firmware.name for firmware, _, _ in places] == ["first", "second"]
+		contents = set(images[firmware.name][start:end]
+				for firmware, start, end in places)
+		assert len(contents) == 1
+		assert contents.pop() in shared
+		sharedBytes += places[0][2] - places[0][1]
+	assert sharedBytes > 90000
@@ -0,0 +1,29 @@
+import argparse
+
+import Instrumentation
+
+def _parser():
+	parser = argparse.ArgumentParser()
+	parser.add_argument("corpus")
+	Instrumentation.addArguments(parser)
+	return parser
+
+def testInstrumentLeavesPositionalsAlone():
+	args = _parser().parse_args(["--instrument", "corpus.json"])
+	assert args.corpus == "corpus.json"
+	assert args.instrument
+
+def testInstrumentWith(monkeypatch):
+	monkeypatch.delenv(Instrumentation.ENVIRONMENT_VARIABLE, raising=False)
+	args = _parser().parse_args(["--instrument-with", "profile",
+			"corpus.json", "--instrument-with", "memory"])
+	assert args.corpus == "corpus.json"
+	assert args.instrument_with == ["profile", "memory"]
+	Instrumentation.configure(_parser().parse_args(["--instrument-with",
+			"memory", "corpus.json"]))
+	try:
+		assert Instrumentation.enabled()
+	finally:
+		Instrumentation.disable()
+	Instrumentation.configure(_parser().parse_args(["corpus.json"]))
+	assert not Instrumentation.enabled()
@@ -0,0 +1,43 @@
+import numpy
+
+from Model import FileTypeModel, TrainingRecord
+from NGram import NGramVector, countNGrams
+
+def _model(n=2, hashBits=None):
+	files = dict()
+	for i, data in enumerate((b"abcabcabc", b"hello world", b"")):
+		files["file%d" % i] = TrainingRecord("%064x" % i, 1000 + i, len(data),
+				countNGrams(data, n, hashBits))
+	vector = NGramVector.merge([record.vector for record in files.values()])
+	return FileTypeModel("text", vector, files)
+
+def testRoundTrip(tmp_path):
+	filename = str(tmp_path / "text.model")
+	for hashBits in (None, 12):
+		model = _model(3, hashBits)
+		model.writeOut(filename)
+		loaded = FileTypeModel.load(filename)
+		assert loaded.name == "text"
+		assert loaded.n == 3
+		assert loaded.vector == model.vector
+		assert loaded.vector.hashBits == hashBits
+		assert sorted(loaded.files) == sorted(model.files)
+		for name, record in model.files.items():
+			assert loaded.files[name].vector == record.vector
+			assert loaded.files[name].contentHash == record.contentHash
+			assert loaded.files[name].mtime == record.mtime
+			assert loaded.files[name].size == record.size
+
+def testOneMappingPerModel(tmp_path):
+	filename = str(tmp_path / "text.model")
+	_model().writeOut(filename)
+	loaded = FileTypeModel.load(filename)
+	arrays = [loaded.vector.indices, loaded.vector.counts]
+	for record in loaded.files.values():
+		arrays += [record.vector.indices, record.vector.counts]
+	mappings = set()
+	for array in arrays:
+		while isinstance(array.base, numpy.ndarray):
+			array = array.base
+		mappings.add(id(array.base))
+	assert len(mappings) == 1
@@ -0,0 +1,114 @@
+import os
+import random
+
+import pytest
+
+import Corpus
+import NCD
+from Corpus import TrainingCorpus
+from NCD import (SIZE_CACHE_SUFFIX, NCDClassifier, benchmarkPrototypes,
+		selectPrototypes, trainPrototypes)
+from ResultCache import modelFingerprint
+
+def _trainingCorpus(directory, filesPerType=6):
+	rng = random.Random(1)
+	corpus = TrainingCorpus("ncd", "", 1)
+	samples = {"text": lambda: " ".join(rng.choice(["the", "a", "firmware",
+			"section", "of"]) for _ in range(300)).encode(),
+			"random": lambda: bytes(rng.randrange(256) for _ in range(1500))}
+	for name, sample in samples.items():
+		files = list()
+		for i in range(filesPerType):
+			filename = str(directory / ("%s%d" % (name, i)))
+			with open(filename, "wb") as sampleFile:
+				sampleFile.write(sample())
+			files.append(filename)
+		corpus.appendFileType({"Name": name,
+				"Filetype File": str(directory / (name + ".model")),
+				"Files": files})
+	return corpus, samples
+
+def testFewOpenFilesGivesTheSameDistances(tmp_path):
+	corpus, samples = _trainingCorpus(tmp_path)
+	datas = [samples["text"]() for _ in range(3)] + [samples["random"]()
+			for _ in range(3)]
+	everyFile = NCDClassifier(corpus)
+	fewFiles = NCDClassifier(corpus, threads=4, maxOpen=2)
+	try:
+		for data in datas:
+			assert fewFiles.distances(data) == everyFile.distances(data)
+		assert len(fewFiles._readers._readers) <= 2
+		assert [fewFiles.classify(data) for data in datas] == ["text"] * 3 + [
+				"random"] * 3
+	finally:
+		everyFile.close()
+		fewFiles.close()
+
+def testNoFilesOpenUntilClassifying(tmp_path):
+	corpus, samples = _trainingCorpus(tmp_path)
+	classifier = NCDClassifier(corpus, maxOpen=4)
+	assert len(classifier._readers._readers) == 0
+	classifier.close()
+
+def testBenchmarkWritesNothing(tmp_path):
+	corpus, samples = _trainingCorpus(tmp_path)
+	trainPrototypes(corpus, 2)
+	before = dict((filename, os.stat(str(tmp_path / filename)).st_mtime_ns)
+			for filename in os.listdir(str(tmp_path)))
+	trained = NCDClassifier(corpus, prototypes=True)._samples
+
+	testCorpus = Corpus.TestCorpus("test", "")
+	filename = str(tmp_path / "text0")
+	testCorpus.appendFirmware({"Name": "fw", "Filename": filename,
+			"Sections": [{"Start": 0, "End": 200, "Filetype": "text"}]})
+	results = benchmarkPrototypes(corpus, testCorpus, [1, 3])
+	assert [result["k"] for result in results] == [None, 1, 3]
+	assert dict((filename, os.stat(str(tmp_path / filename)).st_mtime_ns)
+			for filename in os.listdir(str(tmp_path))) == before
+	assert NCDClassifier(corpus, prototypes=True)._samples == trained
+
+def testPrototypesAreDroppedWhenFilesChange(tmp_path):
+	corpus, samples = _trainingCorpus(tmp_path)
+	trainPrototypes(corpus, 2)
+	NCDClassifier(corpus, prototypes=True).close()
+	del corpus.filetypeDefinitions[0].files[0]
+	with pytest.raises(ValueError):
+		NCDClassifier(corpus, prototypes=True)
+
+def testPrototypesAreChosenFromAtMostMaxCandidates(tmp_path):
+	corpus, samples = _trainingCorpus(tmp_path, filesPerType=12)
+	filenames = [trainingFile.filename
+			for trainingFile in corpus.filetypeDefinitions[0].files]
+	prototypes = selectPrototypes(filenames, 2, maxCandidates=5)
+	assert len(prototypes) == 2
+	assert set(prototypes) <= set(filenames)
+	assert selectPrototypes(filenames, 2, maxCandidates=5) == prototypes
+
+def testSavingSizesKeepsTheFingerprint(tmp_path):
+	corpus, samples = _trainingCorpus(tmp_path)
+	trainPrototypes(corpus, 2)
+	fingerprint = modelFingerprint(corpus)
+	for filetype in corpus.filetypeDefinitions:
+		os.remove(filetype.filetypeFile + SIZE_CACHE_SUFFIX)
+	# Sizes are saved as classifiers compute them, as worker processes do
+	NCDClassifier(corpus).close()
+	assert modelFingerprint(corpus) != fingerprint
+	fingerprint = modelFingerprint(corpus)
+	with open(str(tmp_path / "text5"), "ab") as sampleFile:
+		sampleFile.write(b" appended")
+	NCDClassifier(corpus).close()
+	assert modelFingerprint(corpus) == fingerprint
+	assert not any(filename.endswith(".tmp")
+			for filename in os.listdir(str(tmp_path)))
+	# Selecting prototypes again does change it
+	trainPrototypes(corpus, 3)
+	assert modelFingerprint(corpus) != fingerprint
+
+def testEmptyClustersKeepTheirMedoids(tmp_path, monkeypatch):
+	corpus, samples = _trainingCorpus(tmp_path)
+	filenames = [trainingFile.filename
+			for trainingFile in corpus.filetypeDefinitions[0].files]
+	# Every file is the same distance from every other, so every file is
+	# assigned to the first medoid
+	monkeypatch.setitem(NCD.COMPRESSORS, "constant", lambda data: 10)
+	assert selectPrototypes(filenames, 3, "constant") == filenames[:3]
@@ -0,0 +1,118 @@
+import numpy
+import pytest
+
+import NGram
+from NGram import (CSRMatrix, NGramCounter, NGramVector, countCodes,
+		countNGrams, dimension, hashCodes, nGramCodes)
+
+_DATA = bytes(range(256)) * 3 + b"abcabcabcabd" * 50 + b"\x00\xff" * 40
+
+def _naiveCounts(data, n):
+	counts = dict()
+	for i in range(len(data) - n + 1):
+		code = int.from_bytes(data[i:i + n], "big")
+		counts[code] = counts.get(code, 0) + 1
+	return counts
+
+def _asDict(vector):
+	return dict(zip(vector.indices.tolist(), vector.counts.tolist()))
+
+@pytest.mark.parametrize("n", [1, 2, 3, 4])
+def testCountsMatchNaiveCounts(n):
+	vector = countNGrams(_DATA, n)
+	assert _asDict(vector) == _naiveCounts(_DATA, n)
+	assert vector.total == len(_DATA) - n + 1
+	assert list(vector.indices) == sorted(vector.indices)
+
+@pytest.mark.parametrize("n", [1, 2, 3])
+def testDenseCountsMatchNaiveCounts(n, monkeypatch):
+	# Count even the 3-grams of a little data densely
+	monkeypatch.setattr(NGram, "_SMALL_DIMENSION", 1 << 24)
+	vector = countNGrams(_DATA, n)
+	assert _asDict(vector) == _naiveCounts(_DATA, n)
+
+@pytest.mark.parametrize("n", [1, 3, 4])
+def testHashedCountsInBlocks(n, monkeypatch):
+	expected = countCodes(nGramCodes(_DATA, n), n, 4)
+	monkeypatch.setattr(NGram, "_BLOCK_CODES", 100)
+	assert countNGrams(_DATA, n, 4) == expected
+	assert expected.total == len(_DATA) - n + 1
+
+def testCounterMovesToDenseCounts(monkeypatch):
+	monkeypatch.setattr(NGram, "_SMALL_DIMENSION", 16)
+	counter = NGramCounter(4, 8)
+	counter.update(_DATA[:100])
+	assert counter._dense is None
+	counter.update(_DATA[100:])
+	assert counter._dense is not None
+	assert counter.vector() == countNGrams(_DATA, 4, 8)
+
+def testCodesOfShortData():
+	assert len(nGramCodes(b"ab", 3)) == 0
+	assert nGramCodes(b"abc", 2).tolist() == [0x6162, 0x6263]
+	with pytest.raises(ValueError):
+		nGramCodes(b"abc", 5)
+
+@pytest.mark.parametrize("n", [1, 3, 4])
+@pytest.mark.parametrize("chunkSize", [1, 2, 7, 1000])
+def testCounterMatchesCountingAtOnce(n, chunkSize):
+	counter = NGramCounter(n)
+	for start in range(0, len(_DATA), chunkSize):
+		counter.update(memoryview(_DATA)[start:start + chunkSize])
+	assert counter.vector() == countNGrams(_DATA, n)
+
+@pytest.mark.parametrize("n", [3, 4])
+def testHashedCountsFoldTheSparseCounts(n):
+	hashBits = 12
+	sparse = countNGrams(_DATA, n)
+	hashed = countNGrams(_DATA, n, hashBits)
+	assert hashed.hashBits == hashBits
+	assert hashed.dimension == dimension(n, hashBits) == 4096
+	expected = numpy.bincount(hashCodes(sparse.indices, hashBits),
+			weights=sparse.counts, minlength=4096)
+	assert numpy.array_equal(hashed.toDense(), expected)
+	counter = NGramCounter(n, hashBits)
+	counter.update(_DATA[:100])
+	counter.update(_DATA[100:])
+	assert counter.vector() == hashed
+
+@pytest.mark.parametrize("hashBits", [0, -1, 25, 1.5])
+def testBadHashBitsAreRejected(hashBits):
+	with pytest.raises(ValueError):
+		countNGrams(_DATA, 3, hashBits)
+	with pytest.raises(ValueError):
+		NGramCounter(3, hashBits)
+	with pytest.raises(ValueError):
+		hashCodes(nGramCodes(_DATA, 3), hashBits)
+
+def testMergeAndSubtract():
+	parts = [countNGrams(_DATA[i:i + 100], 3) for i in range(0, 700, 100)]
+	merged = NGramVector.merge(parts)
+	assert NGramVector.treeMerge(parts) == merged
+	assert merged.total == sum(part.total for part in parts)
+	assert merged - parts[0] == NGramVector.merge(parts[1:])
+	assert merged - merged == NGramVector(3)
+	with pytest.raises(ValueError):
+		parts[0] - merged
+	with pytest.raises(ValueError):
+		NGramVector.merge([parts[0], countNGrams(_DATA, 2)])
+	with pytest.raises(ValueError):
+		NGramVector.merge([])
+
+def testFrequencies():
+	vector = countNGrams(b"aab", 1)
+	assert vector.frequencies().tolist() == [2 / 3, 1 / 3]
+	assert len(NGramVector(1).frequencies()) == 0
+
+def testCSRDot():
+	vectors = [countNGrams(b"aab", 1), NGramVector(1), countNGrams(b"bc", 1)]
+	matrix = CSRMatrix.fromVectors(vectors, normalize=False)
+	assert matrix.rows == 3
+	assert matrix.rowIds().tolist() == [0, 0, 2, 2]
+	features = numpy.array([ord("a"), ord("c")], dtype=numpy.uint32)
+	weights = numpy.array([[1.0, 0.0], [10.0, 1.0]])
+	assert matrix.dot(features, weights).tolist() == [[2.0, 0.0], [0.0, 0.0],
+			[10.0, 1.0]]
+	normalized = CSRMatrix.fromVectors(vectors)
+	assert numpy.allclose(numpy.bincount(normalized.rowIds(),
+			weights=normalized.data ** 2, minlength=3), [1, 0, 1])
@@ -0,0 +1,74 @@
+import json
+import os
+
+from Corpus import TrainingCorpus
+from ResultCache import ResultCache, contentHash, modelFingerprint
+
+def testPutAndGet(tmp_path):
+	filename = str(tmp_path / "cache.db")
+	cache = ResultCache(filename, "Classifier", "fingerprint")
+	assert cache.get(b"data") is None
+	cache.put(b"data", "text")
+	cache.put(memoryview(b"other"), {"Label": "code"})
+	assert cache.get(b"data") == "text"
+	assert cache.get(b"data", contentHash(b"data")) == "text"
+	assert cache.get(b"other") == {"Label": "code"}
+	cache.close()
+	# Shared with other processes through the file
+	cache = ResultCache(filename, "Classifier", "fingerprint")
+	assert cache.get(b"data") == "text"
+	assert ResultCache(filename, "Other", "fingerprint").get(b"data") is None
+	cache.close()
+
+def testNewFingerprintDropsOldResults(tmp_path):
+	filename = str(tmp_path / "cache.db")
+	cache = ResultCache(filename, "Classifier", "old")
+	cache.put(b"data", "text")
+	other = ResultCache(filename, "Other", "old")
+	other.put(b"data", "code")
+	cache.close()
+	cache = ResultCache(filename, "Classifier", "new")
+	assert cache.get(b"data") is None
+	cache.close()
+	assert ResultCache(filename, "Classifier", "old").get(b"data") is None
+	assert other.get(b"data") == "code"
+	other.close()
+
+def testEvictionKeepsTheMostRecentlyUsed(tmp_path):
+	cache = ResultCache(str(tmp_path / "cache.db"), "Classifier", "fingerprint",
+			maxEntries=2)
+	for i in range(3):
+		cache.put(bytes([i]), i)
+	cache.get(bytes([0]))
+	cache.evict()
+	assert cache.get(bytes([0])) == 0
+	assert cache.get(bytes([1])) is None
+	assert cache.get(bytes([2])) == 2
+	cache.close()
+
+def testFingerprintFollowsTheModelFiles(tmp_path):
+	modelFile = str(tmp_path / "text.model")
+	corpus = TrainingCorpus("training", "", 2)
+	corpus.appendFileType({"Name": "text", "Filetype File": modelFile,
+			"Files": []})
+	empty = modelFingerprint(corpus)
+	with open(modelFile, "wb") as outputFile:
+		outputFile.write(b"model")
+	trained = modelFingerprint(corpus)
+	assert trained != empty
+	assert modelFingerprint(corpus) == trained
+	# Compressed sizes saved alongside the model don't change any result
+	with open(modelFile + ".ncd", "w") as outputFile:
+		json.dump({"Compressor": "zlib", "Files": {"a": {"Mtime": 1, "Size": 2,
+				"Compressed Size": 3}}}, outputFile)
+	assert modelFingerprint(corpus) == trained
+	with open(modelFile + ".ncd", "w") as outputFile:
+		json.dump({"Compressor": "zlib", "Files": {}, "Prototypes": ["a"],
+				"Prototype Files": "digest"}, outputFile)
+	withPrototypes = modelFingerprint(corpus)
+	assert withPrototypes != trained
+	os.utime(modelFile, ns=(1, 1))
+	retrained = modelFingerprint(corpus)
+	assert retrained != withPrototypes
+	corpus.nValue = 3
+	assert modelFingerprint(corpus) != retrained
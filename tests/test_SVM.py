@@ -0,0 +1,69 @@
+import random
+
+import numpy
+import pytest
+
+from Corpus import TrainingCorpus
+from SVM import WEIGHTS_SUFFIX, SVMClassifier, trainSVM
+from Trainer import Trainer
+
+def _samples(rng):
+	words = ["the", "a", "firmware", "section", "of", "boot"]
+	return {"text": lambda: " ".join(rng.choice(words)
+			for _ in range(400)).encode(),
+			"random": lambda: rng.randbytes(1500),
+			"zeros": lambda: bytes(rng.randrange(1000, 2000))}
+
+def _trainedCorpus(directory, hashBits=None):
+	samples = _samples(random.Random(0))
+	corpus = TrainingCorpus("svm", "", 2)
+	for name, sample in samples.items():
+		files = list()
+		for i in range(4):
+			filename = str(directory / ("%s%d" % (name, i)))
+			with open(filename, "wb") as sampleFile:
+				sampleFile.write(sample())
+			files.append(filename)
+		corpus.appendFileType({"Name": name,
+				"Filetype File": str(directory / (name + ".model")),
+				"Files": files})
+	Trainer(corpus, hashBits=hashBits).run()
+	trainSVM(corpus)
+	return corpus, samples
+
+@pytest.mark.parametrize("hashBits", [None, 10])
+def testTrainAndClassify(tmp_path, hashBits):
+	corpus, samples = _trainedCorpus(tmp_path, hashBits)
+	classifier = SVMClassifier(corpus)
+	assert classifier.names == ["text", "random", "zeros"]
+	assert classifier.hashBits == hashBits
+	datas = [samples[name]() for name in classifier.names for _ in range(3)]
+	expected = [name for name in classifier.names for _ in range(3)]
+	assert classifier.classifyBatch(datas) == expected
+	assert [classifier.classify(data) for data in datas] == expected
+	scores = classifier.scores(datas)
+	assert scores.shape == (len(datas), 3)
+	assert numpy.array_equal(numpy.argmax(scores, axis=1),
+			[i for i in range(3) for _ in range(3)])
+
+def testSavedWeightsRoundTrip(tmp_path):
+	corpus, samples = _trainedCorpus(tmp_path)
+	classifier = SVMClassifier(corpus)
+	for i, filetype in enumerate(corpus.filetypeDefinitions):
+		with numpy.load(filetype.filetypeFile + WEIGHTS_SUFFIX) as svm:
+			features, weights = svm["features"], svm["weights"]
+		assert list(features) == sorted(features)
+		assert numpy.all(weights != 0)
+		# The combined matrix holds each filetype's weights, and zeros elsewhere
+		column = numpy.zeros(len(classifier.features), dtype=numpy.float32)
+		column[numpy.searchsorted(classifier.features, features)] = weights
+		assert numpy.array_equal(classifier.weights[:, i], column)
+	# Training again from the same models writes the same weights
+	datas = [samples[name]() for name in classifier.names]
+	trainSVM(corpus)
+	assert numpy.array_equal(SVMClassifier(corpus).scores(datas),
+			classifier.scores(datas))
+
+def testNoFiletypes(tmp_path):
+	classifier = SVMClassifier(TrainingCorpus("empty", "", 2))
+	assert classifier.classifyBatch([b"abc", b"def"]) == ["", ""]
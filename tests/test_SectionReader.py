@@ -0,0 +1,55 @@
+import pytest
+
+from Corpus import FirmwareSection
+from SectionReader import FirmwareReader, ReaderCache
+
+@pytest.fixture
+def image(tmp_path):
+	filename = str(tmp_path / "image.bin")
+	with open(filename, "wb") as imageFile:
+		imageFile.write(bytes(range(256)))
+	return filename
+
+def testSectionsAreViewsOfTheImage(image):
+	with FirmwareReader(image) as reader:
+		assert reader.size == 256
+		with reader.section((16, 20)) as data:
+			assert isinstance(data, memoryview)
+			assert bytes(data) == bytes([16, 17, 18, 19])
+		section = FirmwareSection({"Start": 250, "End": 256})
+		with reader.section(section) as data:
+			assert bytes(data) == bytes(range(250, 256))
+		with reader.section((7, 7)) as data:
+			assert len(data) == 0
+
+@pytest.mark.parametrize("bounds", [(-1, 4), (4, 2), (250, 257)])
+def testBoundsOutsideTheImageAreRejected(image, bounds):
+	with FirmwareReader(image) as reader:
+		with pytest.raises(ValueError):
+			reader.section(bounds)
+
+def testEmptyImage(tmp_path):
+	filename = str(tmp_path / "empty.bin")
+	open(filename, "wb").close()
+	with FirmwareReader(filename) as reader:
+		assert reader.size == 0
+		with reader.section((0, 0)) as data:
+			assert bytes(data) == b""
+
+def testReaderCacheClosesTheLeastRecentlyUsed(tmp_path):
+	filenames = list()
+	for i in range(3):
+		filenames.append(str(tmp_path / ("image%d.bin" % i)))
+		with open(filenames[-1], "wb") as imageFile:
+			imageFile.write(bytes([i]) * 8)
+	readers = ReaderCache(maxOpen=2)
+	first = readers.get(filenames[0])
+	assert readers.get(filenames[0]) is first
+	readers.get(filenames[1])
+	readers.get(filenames[0])
+	readers.get(filenames[2])
+	assert list(readers._readers) == [filenames[0], filenames[2]]
+	with readers.get(filenames[1]).section((0, 1)) as data:
+		assert bytes(data) == b"\x01"
+	readers.close()
+	assert len(readers._readers) == 0
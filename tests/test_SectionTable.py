@@ -0,0 +1,151 @@
+import random
+
+import pytest
+
+import Corpus
+from Corpus import Firmware, SectionTable
+
+def _bounds(sections):
+	return [section.bounds for section in sections]
+
+def testAppendRejectsOverlaps():
+	table = SectionTable([{"Start": 0, "End": 10}, {"Start": 20, "End": 30}])
+	for bounds in ((5, 15), (15, 25), (0, 30), (5, 5), (25, 25)):
+		with pytest.raises(ValueError):
+			table.append({"Start": bounds[0], "End": bounds[1]})
+	table.append({"Start": 10, "End": 10})
+	table.append({"Start": 10, "End": 20})
+	assert len(table) == 4
+	assert not table.overlapping
+
+def testOverlappingConfigLoads(tmp_path):
+	corpus = Corpus.TestCorpus("corpus", "")
+	corpus.appendFirmware({"Name": "fw", "Filename": "/fw", "Sections": [
+			{"Start": 0, "End": 100, "Filetype": "outer"},
+			{"Start": 10, "End": 20, "Filetype": "nested"},
+			{"Start": 90, "End": 120, "Filetype": "overlapping"},
+			{"Start": 200, "End": 210, "Filetype": "apart"}]})
+	filename = str(tmp_path / "corpus.json")
+	corpus.save(filename)
+	firmware = Corpus.TestCorpus(filename=filename).firmwareDefinitions[0]
+	sections = firmware.sections
+	assert sections.overlapping
+	assert _bounds(sections) == [(0, 100), (10, 20), (90, 120), (200, 210)]
+	assert sections.sectionAt(15).filetype == "nested"
+	assert sections.sectionAt(50).filetype == "outer"
+	assert sections.sectionAt(110).filetype == "overlapping"
+	assert sections.sectionAt(150) is None
+	assert _bounds(firmware.sectionsIn(50, 95)) == [(0, 100), (90, 120)]
+	assert _bounds(firmware.sectionsIn(100, 205)) == [(90, 120), (200, 210)]
+	assert firmware.gaps(300) == [(120, 200), (210, 300)]
+	# New sections are still checked against every loaded one
+	with pytest.raises(ValueError):
+		firmware.appendFirmwareSection({"Start": 30, "End": 40})
+	firmware.appendFirmwareSection({"Start": 150, "End": 160})
+	assert _bounds(firmware.sectionsIn(130, 300)) == [(150, 160), (200, 210)]
+
+def testUnvalidatedAppendWithoutOverlap():
+	table = SectionTable([{"Start": 0, "End": 10}, {"Start": 10, "End": 20}],
+			validate=False)
+	assert not table.overlapping
+	assert table.copy().overlapping == table.overlapping
+
+def testSectionQueries():
+	firmware = Firmware({"Sections": [{"Start": 50, "End": 60},
+			{"Start": 0, "End": 10}, {"Start": 10, "End": 10},
+			{"Start": 20, "End": 30}]})
+	assert firmware.sectionAt(5).bounds == (0, 10)
+	assert firmware.sectionAt(10) is None
+	assert _bounds(firmware.sectionsIn(5, 25)) == [(0, 10), (10, 10), (20, 30)]
+	assert _bounds(firmware.sections.ordered()) == [(0, 10), (10, 10),
+			(20, 30), (50, 60)]
+	assert firmware.gaps(70) == [(10, 20), (30, 50), (60, 70)]
+
+def _table():
+	return SectionTable([{"Start": 20, "End": 30, "Filetype": "b"},
+			{"Start": 0, "End": 10, "Filetype": "a"},
+			{"Start": 40, "End": 50, "Filetype": "c"},
+			{"Start": 10, "End": 20, "Filetype": "d"}])
+
+def testDeleteAndRemove():
+	table = _table()
+	table.dirty = False
+	del table[0]
+	assert table.dirty
+	assert _bounds(table) == [(0, 10), (40, 50), (10, 20)]
+	assert _bounds(table.ordered()) == [(0, 10), (10, 20), (40, 50)]
+	assert table.sectionAt(15).filetype == "d"
+	assert table.sectionAt(25) is None
+	table.remove(Corpus.FirmwareSection({"Start": 40, "End": 50,
+			"Filetype": "c"}))
+	assert [section.filetype for section in table] == ["a", "d"]
+	with pytest.raises(ValueError):
+		table.remove(Corpus.FirmwareSection({"Start": 0, "End": 10,
+				"Filetype": "other"}))
+	del table[-1]
+	assert _bounds(table.sectionsIn(0, 100)) == [(0, 10)]
+	# The freed range can be used again
+	table.append({"Start": 10, "End": 40})
+	with pytest.raises(IndexError):
+		del table[5]
+
+def testSlicing():
+	table = _table()
+	assert [section.filetype for section in table[1:3]] == ["a", "c"]
+	assert [section.filetype for section in table[::-2]] == ["d", "a"]
+	del table[::2]
+	assert [section.filetype for section in table] == ["a", "d"]
+	assert _bounds(table.ordered()) == [(0, 10), (10, 20)]
+	del table[:]
+	assert len(table) == 0
+	assert table.sectionAt(5) is None
+
+def testViewEquality():
+	table = _table()
+	section = Corpus.FirmwareSection({"Start": 20, "End": 30, "Filetype": "b"})
+	assert table[0] == section
+	assert table[0] == table[0]
+	assert table[0] != table[1]
+	assert table[0] != (20, 30)
+	assert table[0] == _table()[0]
+	table[0].filetype = "changed"
+	assert table[0] != section
+
+@pytest.mark.parametrize("bounds", [(-1, 10), (0, -5), (0.5, 10), (0, 10.0),
+		(0, 2 ** 64), ("0", "10")])
+def testInvalidBoundsAreRejected(bounds):
+	table = _table()
+	with pytest.raises(ValueError):
+		table.append({"Start": bounds[0], "End": bounds[1]})
+	with pytest.raises(ValueError):
+		table[0].bounds = bounds
+	assert table[0].bounds == (20, 30)
+	assert _bounds(table.ordered()) == [(0, 10), (10, 20), (20, 30), (40, 50)]
+
+@pytest.mark.parametrize("seed", range(10))
+def testLoadingMatchesAppendingEach(seed):
+	rng = random.Random(seed)
+	sections = list()
+	for _ in range(rng.randrange(0, 30)):
+		start = rng.randrange(0, 200)
+		sections.append({"Start": start, "End": start + rng.choice([0, 0, 5, 20]),
+				"Filetype": rng.choice(["a", "b", ""])})
+	if seed % 2 == 0:
+		sections.sort(key=lambda section: section["Start"])
+	loaded = SectionTable(sections, validate=False)
+	appended = SectionTable()
+	for section in sections:
+		appended.append(section, validate=False)
+	assert list(loaded) == list(appended)
+	assert loaded.overlapping == appended.overlapping
+	for offset in range(0, 230, 3):
+		assert loaded.sectionAt(offset) == appended.sectionAt(offset)
+		assert loaded.sectionsIn(offset, offset + 17) == appended.sectionsIn(
+				offset, offset + 17)
+	assert loaded.gaps(230) == appended.gaps(230)
+
+@pytest.mark.parametrize("bounds", [(-1, 10), (0.5, 10), (0, 2 ** 64), (5, 4)])
+def testLoadingRejectsInvalidBounds(bounds):
+	with pytest.raises(ValueError):
+		SectionTable([{"Start": 0, "End": 1},
+				{"Start": bounds[0], "End": bounds[1]}], validate=False)
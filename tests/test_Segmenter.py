@@ -0,0 +1,99 @@
+import random
+
+import numpy
+import pytest
+
+import Segmenter
+from Corpus import TrainingCorpus
+from NGram import hashCodes, nGramCodes
+from NGramClassifier import NGramClassifier
+from Trainer import Trainer
+
+def _generators(rng):
+	words = ["the", "a", "firmware", "section", "of", "boot"]
+	return {"text": lambda size: " ".join(rng.choice(words)
+			for _ in range(size // 4)).encode()[:size],
+			"random": rng.randbytes,
+			"zeros": bytes}
+
+def _classifier(directory, n=2):
+	"""Return an NGramClassifier trained on text, random and zero bytes, and a
+		function making an image from (filetype, size) pairs."""
+	generators = _generators(random.Random(0))
+	corpus = TrainingCorpus("training", "", n)
+	for name, generate in generators.items():
+		filename = str(directory / name)
+		with open(filename, "wb") as trainingFile:
+			trainingFile.write(generate(50000))
+		corpus.appendFileType({"Name": name,
+				"Filetype File": filename + ".model", "Files": [filename]})
+	Trainer(corpus).run()
+
+	def image(regions):
+		return b"".join(generators[name](size) for name, size in regions)
+	return NGramClassifier(corpus), image
+
+@pytest.mark.parametrize("n", [2, 3])
+def testSlidingLabelsMatchEachWindowLabelledAfresh(tmp_path, n, monkeypatch):
+	classifier, image = _classifier(tmp_path, n)
+	data = image([("text", 40000), ("random", 50000), ("zeros", 20000),
+			("text", 30000)])
+	# Resync rarely, so the scores are mostly kept up by the sliding updates
+	monkeypatch.setattr(Segmenter.SlidingHistogram, "RESYNC_STEPS", 100)
+	segmenter = Segmenter.Segmenter(classifier, windowSize=2048, step=256)
+	assert (segmenter.hashBits is None) == (n == 2)
+	centres, labels = segmenter.labelWindows(data)
+	assert len(centres) == (len(data) - 2048) // 256 + 1
+	assert len(set(labels.tolist())) == 3
+	assert labels.tolist() == [segmenter._labelAt(data, centre)
+			for centre in centres]
+
+def testSlidingScoresMatchFreshHistograms():
+	rng = numpy.random.RandomState(0)
+	data = rng.randint(0, 256, 20000, dtype=numpy.uint8).tobytes()
+	profiles = rng.random_sample((4, 1 << 10))
+	window = Segmenter.SlidingHistogram(data, 3, 1000, profiles, hashBits=10)
+	for _ in range(30):
+		window.advance(337)
+		counts = numpy.bincount(hashCodes(nGramCodes(
+				data[window.start:window.start + 1000], 3), 10), minlength=1 << 10)
+		assert numpy.array_equal(window.counts, counts)
+		assert numpy.allclose(window.scores, profiles.dot(counts))
+
+def testCoarseToFineLabelsFewerWindowsForTheSameSections(tmp_path):
+	classifier, image = _classifier(tmp_path)
+	data = image([("text", 200000), ("random", 200000), ("zeros", 100000),
+			("text", 100000)])
+	segmenter = Segmenter.Segmenter(classifier, coarseStride=65536)
+	full = segmenter.segment(data)
+	fullCalls = segmenter.calls
+	coarse = segmenter.segment(data, coarseToFine=True)
+	assert segmenter.calls < fullCalls / 10
+	assert [(section.bounds, section.filetype) for section in coarse] == \
+			[(section.bounds, section.filetype) for section in full]
+	assert [section.filetype for section in full] == ["text", "random",
+			"zeros", "text"]
+
+def testCompareCountsWindowsEvenWithACache(tmp_path, capsys):
+	classifier, image = _classifier(tmp_path)
+	firmwareFile = str(tmp_path / "fw.bin")
+	with open(firmwareFile, "wb") as firmware:
+		firmware.write(image([("text", 100000), ("random", 100000)]))
+	trainingFile = str(tmp_path / "training.json")
+	classifier.trainingCorpus.writeOut(trainingFile)
+	argv = [trainingFile, str(tmp_path / "out.json"), firmwareFile,
+			"--coarse", "65536", "--compare", "--cache",
+			str(tmp_path / "cache.db")]
+	Segmenter.main(argv)
+	first = capsys.readouterr().out
+	Segmenter.main(argv)
+	assert capsys.readouterr().out == first
+	coarseCalls, fullCalls = [int(word) for word in first.split()
+			if word.isdigit()][:2]
+	assert 0 < coarseCalls < fullCalls
+
+def testCompareNeedsCoarse(tmp_path, capsys):
+	with pytest.raises(SystemExit):
+		Segmenter.main([str(tmp_path / "training.json"),
+				str(tmp_path / "out.json"), str(tmp_path / "fw.bin"), "--compare"])
+	assert "--compare needs --coarse" in capsys.readouterr().err
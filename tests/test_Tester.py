@@ -0,0 +1,115 @@
+import json
+
+import pytest
+
+import Corpus
+import Tester
+from SectionReader import ReaderCache
+
+class _FirstByteClassifier:
+	"""Classifies data by its first byte, and keeps no reference to it."""
+	def classify(self, data):
+		return "%02x" % data[0]
+
+@pytest.fixture
+def worker(monkeypatch):
+	"""Set up the worker globals _initWorker would, without a corpus."""
+	readers = ReaderCache()
+	monkeypatch.setattr(Tester, "_workerReaders", readers)
+	monkeypatch.setattr(Tester, "_workerClassifier", _FirstByteClassifier())
+	monkeypatch.setattr(Tester, "_workerCache", None)
+	yield readers
+	readers.close()
+
+def _images(directory, count):
+	filenames = list()
+	for i in range(count):
+		filename = str(directory / ("image%d.bin" % i))
+		with open(filename, "wb") as imageFile:
+			imageFile.write(bytes([i]) * 32)
+		filenames.append(filename)
+	return filenames
+
+def testBatchSpanningMoreImagesThanReadersOpen(tmp_path, worker):
+	filenames = _images(tmp_path, worker.maxOpen + 2)
+	jobs = [(i, "fw%d" % i, filename, (0, 16), "raw")
+			for i, filename in enumerate(filenames)]
+	results, stages = Tester._classifyBatch(jobs)
+	assert [sequence for sequence, result in results] == list(
+			range(len(filenames)))
+	assert [result["Classification"] for sequence, result in results] == [
+			"%02x" % i for i in range(len(filenames))]
+	# Once the batch is done, the cache is back within its limit
+	assert len(worker._readers) == worker.maxOpen
+
+def testBadSectionReleasesTheBatchViews(tmp_path, worker):
+	filenames = _images(tmp_path, 3)
+	jobs = [(0, "fw0", filenames[0], (0, 16), "raw"),
+			(1, "fw1", filenames[1], (0, 16), "raw"),
+			(2, "fw2", filenames[2], (0, 64), "raw")]
+	with pytest.raises(ValueError):
+		Tester._classifyBatch(jobs)
+	# Every view was released, so every reader can be closed
+	worker.close()
+
+def testReaderCacheKeepsHeldReadersOpen(tmp_path):
+	filenames = _images(tmp_path, 3)
+	readers = ReaderCache(maxOpen=1)
+	held = readers.hold(filenames[0])
+	view = held.section((0, 4))
+	other = readers.get(filenames[1])
+	assert bytes(view) == bytes(4)
+	assert bytes(other.section((0, 1))) == b"\x01"
+	readers.get(filenames[2])
+	view.release()
+	readers.release(filenames[0])
+	assert list(readers._readers) == [filenames[2]]
+	readers.close()
+
+class FirstByteClassifier(_FirstByteClassifier):
+	"""A classifier Tester can load in its workers."""
+	def __init__(self, trainingCorpus):
+		pass
+
+def testIdenticalJobsAreEachWritten(tmp_path):
+	filenames = _images(tmp_path, 2)
+	trainingFilename = str(tmp_path / "training.json")
+	Corpus.TrainingCorpus("training", "", 2).writeOut(trainingFilename)
+	corpus = Corpus.TestCorpus("corpus", "")
+	# The same image listed several times gives identical jobs
+	for i in range(6):
+		corpus.appendFirmware({"Name": "fw", "Filename": filenames[i % 2],
+				"Sections": [{"Start": 0, "End": 16, "Filetype": "raw"},
+				{"Start": 16, "End": 32, "Filetype": "raw"}]})
+	outputFilename = str(tmp_path / "results.jsonl")
+	tester = Tester.Tester(corpus, trainingFilename,
+			"test_Tester.FirstByteClassifier", workers=2, batchSize=1)
+	assert tester.run(outputFilename) == 12
+	with open(outputFilename) as outputFile:
+		results = [json.loads(line) for line in outputFile]
+	assert sorted((result["Filename"], result["Start"], result["Classification"])
+			for result in results) == sorted((filenames[i % 2], start,
+			"%02x" % (i % 2)) for i in range(6) for start in (0, 16))
+
+def testDedupeWritesEverySection(tmp_path):
+	filenames = _images(tmp_path, 3)
+	trainingFilename = str(tmp_path / "training.json")
+	Corpus.TrainingCorpus("training", "", 2).writeOut(trainingFilename)
+	corpus = Corpus.TestCorpus("corpus", "")
+	expected = list()
+	for i in range(30):
+		filename = filenames[i % 3]
+		corpus.appendFirmware({"Name": "fw%d" % i, "Filename": filename,
+				"Sections": [{"Start": 0, "End": 8, "Filetype": "raw"},
+				{"Start": 8, "End": 32, "Filetype": "raw"}]})
+		expected += [("fw%d" % i, 0, "%02x" % (i % 3)),
+				("fw%d" % i, 8, "%02x" % (i % 3))]
+	outputFilename = str(tmp_path / "results.jsonl")
+	tester = Tester.Tester(corpus, trainingFilename,
+			"test_Tester.FirstByteClassifier", workers=2, batchSize=1,
+			dedupe=True)
+	assert tester.run(outputFilename) == len(expected)
+	with open(outputFilename) as outputFile:
+		results = [json.loads(line) for line in outputFile]
+	assert sorted((result["Firmware"], result["Start"],
+			result["Classification"]) for result in results) == sorted(expected)
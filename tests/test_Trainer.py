@@ -0,0 +1,99 @@
+import os
+import random
+
+from Corpus import TrainingCorpus
+from Model import FileTypeModel
+from NGram import NGramVector, countNGrams
+from Trainer import Trainer
+
+def _corpus(directory, contents, n=2):
+	filenames = list()
+	for i, data in enumerate(contents):
+		filename = str(directory / ("file%d" % i))
+		with open(filename, "wb") as trainingFile:
+			trainingFile.write(data)
+		filenames.append(filename)
+	corpus = TrainingCorpus("training", "", n)
+	corpus.appendFileType({"Name": "text",
+			"Filetype File": str(directory / "text.model"), "Files": filenames})
+	return corpus
+
+def _rebuilt(directory, contents):
+	"""Return the model trained from scratch on contents."""
+	fresh = directory / "fresh"
+	fresh.mkdir()
+	corpus = _corpus(fresh, contents)
+	Trainer(corpus).run()
+	return FileTypeModel.load(corpus.filetypeDefinitions[0].filetypeFile)
+
+def _model(corpus):
+	return FileTypeModel.load(corpus.filetypeDefinitions[0].filetypeFile)
+
+def testIncrementalUpdateMatchesRebuild(tmp_path):
+	contents = [b"abcabcabc", b"hello world", b"zzzz"]
+	corpus = _corpus(tmp_path, contents)
+	Trainer(corpus).run()
+	# Change one file, remove another
+	with open(str(tmp_path / "file0"), "wb") as trainingFile:
+		trainingFile.write(b"something else entirely")
+	os.utime(str(tmp_path / "file0"), ns=(1, 1))
+	del corpus.filetypeDefinitions[0].files[2]
+	Trainer(corpus).run()
+	assert _model(corpus).vector == _rebuilt(tmp_path,
+			[b"something else entirely", b"hello world"]).vector
+
+def testModelWithoutRecordsIsRebuilt(tmp_path):
+	contents = [b"abcabcabc", b"hello world"]
+	corpus = _corpus(tmp_path, contents)
+	Trainer(corpus).run()
+	# A model whose counts no per-file records account for
+	model = _model(corpus)
+	FileTypeModel(model.name, model.vector).writeOut(
+			corpus.filetypeDefinitions[0].filetypeFile)
+	Trainer(corpus).run()
+	assert _model(corpus).vector == _rebuilt(tmp_path, contents).vector
+
+def testUnreadableModelIsRebuilt(tmp_path):
+	contents = [b"abcabcabc"]
+	corpus = _corpus(tmp_path, contents)
+	with open(corpus.filetypeDefinitions[0].filetypeFile, "w") as modelFile:
+		modelFile.write('{"Name": "text", "Counts": {}}')
+	Trainer(corpus).run()
+	assert _model(corpus).vector == _rebuilt(tmp_path, contents).vector
+
+def testHashedTraining(tmp_path):
+	contents = [b"abcdefgh" * 50, bytes(range(256)) * 3]
+	corpus = _corpus(tmp_path, contents, n=4)
+	Trainer(corpus, chunkSize=7, hashBits=12).run()
+	expected = NGramVector.merge([countNGrams(data, 4, 12) for data in contents])
+	assert _model(corpus).vector == expected
+	# Counting exactly instead rebuilds the model, rather than updating it
+	Trainer(corpus).run()
+	assert _model(corpus).vector == NGramVector.merge([countNGrams(data, 4)
+			for data in contents])
+
+def _modelBytes(corpus):
+	models = list()
+	for filetype in corpus.filetypeDefinitions:
+		with open(filetype.filetypeFile, "rb") as modelFile:
+			models.append(modelFile.read())
+		os.remove(filetype.filetypeFile)
+	return models
+
+def testParallelTrainingMatchesSerial(tmp_path):
+	corpus = TrainingCorpus("training", "", 3)
+	for filetype in ("text", "random"):
+		filenames = list()
+		for i in range(5):
+			filename = str(tmp_path / ("%s%d" % (filetype, i)))
+			with open(filename, "wb") as trainingFile:
+				trainingFile.write(random.Random(filename).randbytes(20000 + 997 * i))
+			filenames.append(filename)
+		corpus.appendFileType({"Name": filetype,
+				"Filetype File": str(tmp_path / (filetype + ".model")),
+				"Files": filenames})
+	# A chunk size that doesn't divide any file's length
+	Trainer(corpus, chunkSize=7777).run()
+	serial = _modelBytes(corpus)
+	Trainer(corpus, chunkSize=7777, workers=4).run()
+	assert _modelBytes(corpus) == serial
@@ -0,0 +1,13 @@
+from VirtualList import PrefixIndex
+
+def testBuiltIndexMatchesAddedIndex():
+	items = ["beta", "Alpha", "alphabet", "BETA", "gamma", "alpha", ""]
+	built = PrefixIndex(items)
+	added = PrefixIndex()
+	for item in items:
+		added.add(item, item)
+	for prefix in ("", "a", "ALPHA", "alphab", "b", "z"):
+		assert built.matches(prefix)[:] == added.matches(prefix)[:]
+	assert built.matches("alpha")[:] == ["Alpha", "alpha", "alphabet"]
+	built.remove("beta", "beta")
+	assert built.matches("b")[:] == ["BETA"]